@@ -664,7 +664,8 @@ setup(
         Extension(
             'autopick_ext',
             include_dirs=[get_python_inc(), numpy.get_include()],
-            extra_compile_args=['-Wextra'],
+            extra_compile_args=['-Wextra'] + omp_arg,
+            extra_link_args=[] + omp_lib,
             sources=[pjoin('src', 'ext', 'autopick_ext.c')]),
 
         Extension(
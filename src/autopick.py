@@ -4,18 +4,71 @@
 # ---|P------/S----------~Lg----------
 from __future__ import absolute_import
 
+import logging
+import multiprocessing
+
 from . import autopick_ext
 import numpy as num
 
+logger = logging.getLogger('pyrocko.autopick')
+
 
 class AutopickError(Exception):
     pass
 
 
+def _check_temp(temp, ns):
+    # state arrays of older versions had length ns+2 and did not contain the
+    # last input sample, they cannot be used to continue processing
+    if temp is not None and temp.shape[-1] == ns+2:
+        logger.warning(
+            'STA/LTA state array of old format (length ns+2) given, '
+            'starting from scratch.')
+        return None
+
+    return temp
+
+
+def _check_nsamples(nsamples, ns, nl, initialize):
+    if initialize and nsamples <= ns + nl:
+        raise AutopickError(
+            'STA/LTA needs at least %i samples (tshort + tlong + 1 sample) '
+            'when starting from scratch, got %i.' % (ns + nl + 1, nsamples))
+
+
 def recursive_stalta(
         tshort, tlong, kshort, klong, kderivative, energytrace,
         temp=None, inplace=True):
 
+    '''
+    Recursive STA/LTA of a trace.
+
+    :param tshort: short time window length in seconds
+    :param tlong: long time window length in seconds
+    :param kshort: weight of short time average
+    :param klong: weight of long time average
+    :param kderivative: weight of derivative term in characteristic function
+    :param energytrace: :py:class:`pyrocko.trace.Trace` object with float32
+        data
+    :param temp: state array returned by a previous call, to continue with
+        the following chunk of continuous data, or ``None`` to start from
+        scratch
+    :param inplace: whether to replace the data of ``energytrace``
+    :returns: state array of length ``ns+3``, where ``ns`` is ``tshort`` in
+        samples; if ``inplace`` is ``False``, a tuple with the processed trace
+        copy and the state array
+
+    When starting from scratch (``temp=None``), the averages are initialized
+    from the first ``nl+ns`` samples (``nl``: ``tlong`` in samples), which
+    must be available, and the output is 1.0 for these samples. When
+    continuing, chunks of any length, also shorter than ``ns``, can be
+    processed. Versions
+    before the introduction of :py:func:`recursive_stalta_multi` skipped the
+    initialization, used a state array of length ``ns+2`` and did not carry
+    the state over correctly between chunks. State arrays of length ``ns+2``
+    are still accepted, but processing then starts from scratch.
+    '''
+
     if not energytrace.ydata.dtype == num.float32:
         raise AutopickError(
             'energytrace given to recursive_stalta() must have data in '
@@ -24,17 +77,102 @@ def recursive_stalta(
     ns = int(round(tshort/energytrace.deltat))
     nl = int(round(tlong/energytrace.deltat))
 
-    if temp is None:
-        temp = num.zeros((ns+2,), dtype=num.float32)
+    temp = _check_temp(temp, ns)
+    initialize = temp is None
+    _check_nsamples(energytrace.data_len(), ns, nl, initialize)
+    if initialize:
+        temp = num.zeros((ns+3,), dtype=num.float32)
 
     if not inplace:
         energytrace = energytrace.copy()
 
     autopick_ext.recursive_stalta(
         ns, nl, kshort/ns, klong/nl, kderivative, energytrace.ydata,
-        temp, temp is None)
+        temp, initialize)
 
     if inplace:
         return temp
     else:
         return energytrace, temp
+
+
+def recursive_stalta_multi(
+        tshort, tlong, kshort, klong, kderivative, energy, deltat=None,
+        temp=None, nparallel=None):
+
+    '''
+    Recursive STA/LTA of many channels, computed in parallel.
+
+    The channels are processed in parallel threads inside the C extension,
+    with the GIL released. To process continuous data in consecutive chunks,
+    pass the state returned by the previous call as ``temp``.
+
+    :param energy: list of :py:class:`pyrocko.trace.Trace` objects with
+        float32 data, all with the same sampling interval and number of
+        samples, or 2D float32 array of shape ``(nchannels, nsamples)``. The
+        data is replaced by the STA/LTA characteristic function.
+    :param deltat: sampling interval, required if ``energy`` is an array
+    :param temp: state array of shape ``(nchannels, ns+3)`` returned by a
+        previous call, or ``None`` to start from scratch (see
+        :py:func:`recursive_stalta`)
+    :param nparallel: number of threads (default: number of CPUs)
+
+    :returns: state array, to be given as ``temp`` in the next call
+    '''
+
+    if isinstance(energy, num.ndarray):
+        traces = None
+        data = energy
+        if deltat is None:
+            raise AutopickError(
+                'deltat must be given to recursive_stalta_multi() when '
+                'energy is an array.')
+
+    else:
+        traces = energy
+        if not traces:
+            raise AutopickError(
+                'no traces given to recursive_stalta_multi().')
+
+        deltat = traces[0].deltat
+        for tr in traces:
+            if tr.ydata.dtype != num.float32:
+                raise AutopickError(
+                    'energytraces given to recursive_stalta_multi() must '
+                    'have data in float32 format.')
+
+            if tr.deltat != deltat or tr.data_len() != traces[0].data_len():
+                raise AutopickError(
+                    'energytraces given to recursive_stalta_multi() must '
+                    'have same sampling interval and number of samples.')
+
+        data = num.vstack([tr.ydata for tr in traces])
+
+    if not (data.dtype == num.float32 and data.ndim == 2
+            and data.flags.c_contiguous and data.flags.writeable):
+
+        raise AutopickError(
+            'array given to recursive_stalta_multi() must be a writeable, '
+            'C-contiguous 2D array in float32 format.')
+
+    ns = int(round(tshort/deltat))
+    nl = int(round(tlong/deltat))
+
+    temp = _check_temp(temp, ns)
+    initialize = temp is None
+    _check_nsamples(data.shape[1], ns, nl, initialize)
+    if initialize:
+        temp = num.zeros((data.shape[0], ns+3), dtype=num.float32)
+
+    if nparallel is None:
+        nparallel = multiprocessing.cpu_count()
+
+    autopick_ext.recursive_stalta_multi(
+        ns, nl, kshort/ns, klong/nl, kderivative, data, temp, initialize,
+        nparallel)
+
+    if traces is not None:
+        for tr, ydata in zip(traces, data):
+            tr.ydata[:] = ydata
+
+    return temp
@@ -2,6 +2,12 @@
 
 #include "Python.h"
 #include "numpy/arrayobject.h"
+
+#include <stdlib.h>
+#if defined(_OPENMP)
+    # include <omp.h>
+#endif
+
 struct module_state {
     PyObject *error;
 };
@@ -22,26 +28,44 @@ static struct module_state _state;
 
 int autopick_recursive_stalta( int ns, int nl, float ks, float kl, float k, int nsamples, float *inout, float *intermediates, int init)
 {
-    int i, istart;
+    int i, istart, nhead;
     float eps = 1.0e-7;
     float scf0, lcf0, sta0, lta0, nshort, nlong, maxlta;
-    float cf[nsamples], sta[nsamples], lta[nsamples]; /* da sistemare */
+    float *work, *cf, *sta, *lta;
+
+    if (init == 1) {
+        if (nsamples <= ns + nl) {
+            return 1;
+        }
+    } else {
+        /* chunks shorter than ns are fine, the state holds the last ns
+         * samples of the characteristic function */
+        if (nsamples == 0) {
+            return 0;
+        }
+    }
+
+    work = (float*)malloc(sizeof(float) * 3 * (size_t)nsamples);
+    if (work == NULL) {
+        return 1;
+    }
+
+    cf = work;
+    sta = work + nsamples;
+    lta = work + 2*nsamples;
 
     cf[0] = inout[0];
     if (init == 0) {
-        cf[0] = inout[0] + abs(k*(inout[0]-intermediates[ns-1]));
+        cf[0] = inout[0] + fabsf(k*(inout[0]-intermediates[ns+2]));
     }
     for (i=1;i<nsamples;i++)
     {
-        cf[i]=inout[i]+abs(k*(inout[i]-inout[i-1]));
+        cf[i]=inout[i]+fabsf(k*(inout[i]-inout[i-1]));
     }
 
     maxlta = 0.;
     if (init == 1)
     {
-        if (nsamples <= ns + nl) {
-            return 1;
-        }
 
         sta0 = 0.;
         scf0 = 0.;
@@ -68,22 +92,21 @@ int autopick_recursive_stalta( int ns, int nl, float ks, float kl, float k, int
         for (i=0; i<nl+ns; i++) {
             sta[i] = lta[i] = 0.0;
         }
-        istart = nl+ns;
+        maxlta = fabs(lta[nl+ns]);
+        istart = nl+ns+1;
 
     } else {
 
-        if (nsamples <= ns) {
-            return 1;
-        }
+        sta[0] = (ks*cf[0]+(1.-ks)*intermediates[ns]);
+        lta[0] = (kl*intermediates[0]+(1.-kl)*intermediates[ns+1]);
+        maxlta = fabs(lta[0]);
+        nhead = ns < nsamples ? ns : nsamples;
+        istart = nhead;
 
-        sta[0] = intermediates[ns];
-        lta[0] = intermediates[ns+1];
-        istart = ns;
-
-        for(i=1;i<ns;i++)
+        for(i=1;i<nhead;i++)
         {
             sta[i] = (ks*cf[i]+(1.-ks)*sta[i-1]);
-            lta[i] = (kl*(intermediates[i-1]) + (1.-kl)*lta[i-1]);
+            lta[i] = (kl*(intermediates[i]) + (1.-kl)*lta[i-1]);
             maxlta = max(fabs(lta[i]), maxlta);
         }
     }
@@ -95,6 +118,8 @@ int autopick_recursive_stalta( int ns, int nl, float ks, float kl, float k, int
         maxlta = max(fabs(lta[i]), maxlta);
     }
 
+    intermediates[ns+2] = inout[nsamples-1];
+
     if (maxlta == 0.0) {
         maxlta = eps*eps;
     }
@@ -104,17 +129,58 @@ int autopick_recursive_stalta( int ns, int nl, float ks, float kl, float k, int
         inout[i] = (sta[i]+eps*maxlta)/(lta[i]+eps*maxlta);
     }
 
-    for (i=0;i<ns;i++)
-    {
-        intermediates[i] = cf[nsamples-ns+i];
+    if (nsamples >= ns) {
+        for (i=0;i<ns;i++)
+        {
+            intermediates[i] = cf[nsamples-ns+i];
+        }
+    } else {
+        /* shift the stored samples, append the new ones */
+        for (i=0;i<ns-nsamples;i++)
+        {
+            intermediates[i] = intermediates[i+nsamples];
+        }
+        for (i=ns-nsamples;i<ns;i++)
+        {
+            intermediates[i] = cf[i-(ns-nsamples)];
+        }
     }
 
     intermediates[ns] = sta[nsamples-1];
     intermediates[ns+1] = lta[nsamples-1];
 
+    free(work);
     return 0;
 }
 
+int autopick_recursive_stalta_multi( int ns, int nl, float ks, float kl, float k, int nchannels, int nsamples, float *inout, float *intermediates, int init, int nparallel)
+{
+    int ichannel, nfailed;
+    (void) nparallel;
+
+    nfailed = 0;
+
+    Py_BEGIN_ALLOW_THREADS
+
+    #if defined(_OPENMP)
+        #pragma omp parallel for schedule(dynamic, 1) reduction(+:nfailed) num_threads(nparallel)
+    #endif
+    for (ichannel=0; ichannel<nchannels; ichannel++) {
+        if (0 != autopick_recursive_stalta(
+                ns, nl, ks, kl, k, nsamples,
+                inout + (size_t)ichannel*nsamples,
+                intermediates + (size_t)ichannel*(ns+3),
+                init)) {
+
+            nfailed++;
+        }
+    }
+
+    Py_END_ALLOW_THREADS
+
+    return nfailed;
+}
+
 static PyObject* autopick_recursive_stalta_wrapper(PyObject *module, PyObject *args) {
     PyObject *inout_array_obj, *temp_array_obj;
     PyArrayObject *inout_array = NULL;
@@ -142,8 +208,8 @@ static PyObject* autopick_recursive_stalta_wrapper(PyObject *module, PyObject *a
     nsamples = PyArray_SIZE(inout_array);
     ntemp = PyArray_SIZE(temp_array);
 
-    if (ntemp != ns+2) {
-        PyErr_SetString(st->error, "temp_data must have length of ns+2.");
+    if (ntemp != ns+3) {
+        PyErr_SetString(st->error, "temp_data must have length of ns+3.");
         Py_DECREF(temp_array);
         Py_DECREF(inout_array);
         return NULL;
@@ -162,10 +228,63 @@ static PyObject* autopick_recursive_stalta_wrapper(PyObject *module, PyObject *a
     return Py_None;
 }
 
+static PyObject* autopick_recursive_stalta_multi_wrapper(PyObject *module, PyObject *args) {
+    PyObject *inout_array_obj, *temp_array_obj;
+    PyArrayObject *inout_array, *temp_array;
+    int ns, nl, initialize, nparallel, nchannels, nsamples;
+    double ks, kl, k;
+    npy_intp *shape;
+
+    struct module_state *st = GETSTATE(module);
+    if (!PyArg_ParseTuple(args, "iidddOOii", &ns, &nl, &ks, &kl, &k, &inout_array_obj, &temp_array_obj, &initialize, &nparallel)) {
+        PyErr_SetString(st->error, "invalid arguments in recursive_stalta_multi(ns, nl, ks, kl, k, inout_data, temp_data, initialize, nparallel)" );
+        return NULL;
+    }
+
+    if (!PyArray_Check(inout_array_obj) || !PyArray_Check(temp_array_obj)) {
+        PyErr_SetString(st->error, "inout_data and temp_data must be NumPy arrays.");
+        return NULL;
+    }
+
+    inout_array = (PyArrayObject*)inout_array_obj;
+    temp_array = (PyArrayObject*)temp_array_obj;
+
+    if (PyArray_TYPE(inout_array) != NPY_FLOAT32 || PyArray_NDIM(inout_array) != 2 || !PyArray_ISCARRAY(inout_array)) {
+        PyErr_SetString(st->error, "inout_data must be a writable, contiguous 2D float32 array.");
+        return NULL;
+    }
+
+    if (PyArray_TYPE(temp_array) != NPY_FLOAT32 || PyArray_NDIM(temp_array) != 2 || !PyArray_ISCARRAY(temp_array)) {
+        PyErr_SetString(st->error, "temp_data must be a writable, contiguous 2D float32 array.");
+        return NULL;
+    }
+
+    shape = PyArray_DIMS(inout_array);
+    nchannels = shape[0];
+    nsamples = shape[1];
+
+    shape = PyArray_DIMS(temp_array);
+    if (shape[0] != nchannels || shape[1] != ns+3) {
+        PyErr_SetString(st->error, "temp_data must have shape (nchannels, ns+3).");
+        return NULL;
+    }
+
+    if (0 != autopick_recursive_stalta_multi(ns, nl, ks, kl, k, nchannels, nsamples, (float*)PyArray_DATA(inout_array), (float*)PyArray_DATA(temp_array), initialize, nparallel)) {
+        PyErr_SetString(st->error, "running STA/LTA failed.");
+        return NULL;
+    }
+
+    Py_INCREF(Py_None);
+    return Py_None;
+}
+
 static PyMethodDef AutoPickMethods[] = {
     {"recursive_stalta",  (PyCFunction) autopick_recursive_stalta_wrapper, METH_VARARGS,
         "Recursive STA/LTA picker." },
 
+    {"recursive_stalta_multi",  (PyCFunction) autopick_recursive_stalta_multi_wrapper, METH_VARARGS,
+        "Recursive STA/LTA picker, multiple channels in parallel." },
+
     {NULL, NULL, 0, NULL}        /* Sentinel */
 };
 
@@ -1550,7 +1550,7 @@ def MakePileViewerMainClass(base):
 
         def periodical(self):
             if self.menuitem_watch.isChecked():
-                if self.pile.reload_modified():
+                if self.pile.reload_modified(incremental=True):
                     self.update()
 
         def get_pile(self):
@@ -68,12 +68,14 @@ class Chain(Processor):
 
     def process(self, trace):
         traces = [trace]
-        xtraces = []
         for p in self._processors:
+            xtraces = []
             for tr in traces:
-                xtraces.extend(p.process(traces))
+                xtraces.extend(p.process(tr))
 
-        return xtraces
+            traces = xtraces
+
+        return traces
 
 
 class Downsampler(Processor):
@@ -81,22 +83,18 @@ class Downsampler(Processor):
     def __init__(self, mapping, deltat):
         Processor.__init__(self)
         self._mapping = mapping
-        self._downsampler = tracemod.co_downsample_to(deltat)
+        self._downsampler = tracemod.StreamDownsample(deltat)
 
     def process(self, trace):
         target_id = self._mapping(trace)
         if target_id is None:
             return []
 
-        ds_trace = self._downsampler.send(trace)
-        ds_trace.set_codes(*target_id)
-        if ds_trace.data_len() == 0:
-            return []
+        ds_traces = self._downsampler.process(trace)
+        for ds_trace in ds_traces:
+            ds_trace.set_codes(*target_id)
 
-        return [ds_trace]
-
-    def __del__(self):
-        self._downsampler.close()
+        return ds_traces
 
 
 class Grower(Processor):
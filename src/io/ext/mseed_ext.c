@@ -27,48 +27,18 @@ static struct module_state _state;
 
 
 static PyObject*
-mseed_get_traces (PyObject *m, PyObject *args)
+mstg_to_list (struct module_state *st, MSTraceGroup *mstg, int unpackdata)
 {
-    char          *filename;
-    MSTraceGroup  *mstg = NULL;
     MSTrace       *mst = NULL;
-    int           retcode;
     npy_intp      array_dims[1] = {0};
     PyObject      *array = NULL;
     PyObject      *out_traces = NULL;
     PyObject      *out_trace = NULL;
     int           numpytype;
     char          strbuf[BUFSIZE];
-    PyObject      *unpackdata = NULL;
-
-    struct module_state *st = GETSTATE(m);
-
-    if (!PyArg_ParseTuple(args, "sO", &filename, &unpackdata)) {
-        PyErr_SetString(st->error, "usage get_traces(filename, dataflag)" );
-        return NULL;
-    }
-
-    if (!PyBool_Check(unpackdata)) {
-        PyErr_SetString(st->error, "Second argument must be a boolean" );
-        return NULL;
-    }
-  
-    /* get data from mseed file */
-    retcode = ms_readtraces (&mstg, filename, 0, -1.0, -1.0, 0, 1, (unpackdata == Py_True), 0);
-    if ( retcode < 0 ) {
-        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
-        PyErr_SetString(st->error, strbuf);
-        return NULL;
-    }
-
-    if ( ! mstg ) {
-        snprintf (strbuf, BUFSIZE, "Error reading file");
-        PyErr_SetString(st->error, strbuf);
-        return NULL;
-    }
 
     /* check that there is data in the traces */
-    if (unpackdata == Py_True) {
+    if (unpackdata) {
         mst = mstg->traces;
         while (mst) {
             if (mst->datasamples == NULL) {
@@ -88,7 +58,7 @@ mseed_get_traces (PyObject *m, PyObject *args)
 
     while (mst) {
         
-        if (unpackdata == Py_True) {
+        if (unpackdata) {
             array_dims[0] = mst->numsamples;
             switch (mst->sampletype) {
                 case 'i':
@@ -137,6 +107,262 @@ mseed_get_traces (PyObject *m, PyObject *args)
         mst = mst->next;
     }
 
+    return out_traces;
+}
+
+static PyObject*
+mseed_get_traces (PyObject *m, PyObject *args)
+{
+    char          *filename;
+    MSTraceGroup  *mstg = NULL;
+    int           retcode;
+    PyObject      *out_traces = NULL;
+    char          strbuf[BUFSIZE];
+    PyObject      *unpackdata = NULL;
+
+    struct module_state *st = GETSTATE(m);
+
+    if (!PyArg_ParseTuple(args, "sO", &filename, &unpackdata)) {
+        PyErr_SetString(st->error, "usage get_traces(filename, dataflag)" );
+        return NULL;
+    }
+
+    if (!PyBool_Check(unpackdata)) {
+        PyErr_SetString(st->error, "Second argument must be a boolean" );
+        return NULL;
+    }
+  
+    /* get data from mseed file */
+    Py_BEGIN_ALLOW_THREADS
+    retcode = ms_readtraces (&mstg, filename, 0, -1.0, -1.0, 0, 1, (unpackdata == Py_True), 0);
+    Py_END_ALLOW_THREADS
+    if ( retcode < 0 ) {
+        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+        PyErr_SetString(st->error, strbuf);
+        return NULL;
+    }
+
+    if ( ! mstg ) {
+        snprintf (strbuf, BUFSIZE, "Error reading file");
+        PyErr_SetString(st->error, strbuf);
+        return NULL;
+    }
+
+    out_traces = mstg_to_list(st, mstg, (unpackdata == Py_True));
+
+    mst_freegroup (&mstg);
+
+    return out_traces;
+}
+
+static PyObject*
+mseed_scan_traces (PyObject *m, PyObject *args)
+{
+    char          *filename;
+    long long     group_nbytes;
+    MSFileParam   *msfp = NULL;
+    MSRecord      *msr = NULL;
+    MSTraceGroup  *mstg = NULL;
+    off_t         fpos = 0;
+    int           retcode;
+    int64_t       *groups = NULL;
+    int64_t       *groups_new = NULL;
+    int64_t       *g = NULL;
+    npy_intp      ngroups = 0;
+    npy_intp      ngroups_alloc = 0;
+    hptime_t      endtime;
+    npy_intp      array_dims[2] = {0, 4};
+    PyObject      *out_traces = NULL;
+    PyObject      *out_groups = NULL;
+    char          strbuf[BUFSIZE];
+
+    struct module_state *st = GETSTATE(m);
+
+    if (!PyArg_ParseTuple(args, "sL", &filename, &group_nbytes)) {
+        PyErr_SetString(st->error, "usage scan_traces(filename, group_nbytes)" );
+        return NULL;
+    }
+
+    mstg = mst_initgroup(NULL);
+    if ( ! mstg ) {
+        PyErr_SetString(st->error, "Cannot allocate trace group");
+        return NULL;
+    }
+
+    Py_BEGIN_ALLOW_THREADS
+
+    /* read record headers, merge them into traces and build record groups */
+    while ( (retcode = ms_readmsr_r (&msfp, &msr, filename, 0, &fpos, NULL,
+                                     1, 0, 0)) == MS_NOERROR ) {
+
+        mst_addmsrtogroup (mstg, msr, 0, -1.0, -1.0);
+
+        endtime = msr_endtime (msr);
+        if (ngroups == 0 || g[0] + g[1] != fpos ||
+                g[1] + msr->reclen > group_nbytes) {
+
+            if (ngroups == ngroups_alloc) {
+                ngroups_alloc = ngroups_alloc == 0 ? 64 : ngroups_alloc * 2;
+                groups_new = realloc(groups, ngroups_alloc*4*sizeof(int64_t));
+                if (groups_new == NULL) {
+                    retcode = MS_GENERROR;
+                    break;
+                }
+                groups = groups_new;
+            }
+            g = groups + 4*ngroups;
+            ngroups++;
+
+            g[0] = fpos;
+            g[1] = 0;
+            g[2] = msr->starttime;
+            g[3] = endtime;
+        }
+
+        g[1] += msr->reclen;
+        if (msr->starttime < g[2]) g[2] = msr->starttime;
+        if (endtime > g[3]) g[3] = endtime;
+    }
+
+    /* cleanup memory and close file */
+    ms_readmsr_r (&msfp, &msr, NULL, 0, NULL, NULL, 0, 0, 0);
+
+    Py_END_ALLOW_THREADS
+
+    if ( retcode != MS_ENDOFFILE ) {
+        snprintf (strbuf, BUFSIZE, "Cannot read file '%s': %s", filename, ms_errorstr(retcode));
+        PyErr_SetString(st->error, strbuf);
+        free(groups);
+        mst_freegroup (&mstg);
+        return NULL;
+    }
+
+    out_traces = mstg_to_list(st, mstg, 0);
+    mst_freegroup (&mstg);
+    if (out_traces == NULL) {
+        free(groups);
+        return NULL;
+    }
+
+    array_dims[0] = ngroups;
+    out_groups = PyArray_SimpleNew(2, array_dims, NPY_INT64);
+    if (ngroups > 0) {
+        memcpy( PyArray_DATA((PyArrayObject*)out_groups), groups, ngroups*4*sizeof(int64_t) );
+    }
+    free(groups);
+
+    return Py_BuildValue("(N,N)", out_traces, out_groups);
+}
+
+static PyObject*
+mseed_get_traces_window (PyObject *m, PyObject *args)
+{
+    char          *filename;
+    long long     itmin, itmax;
+    PyObject      *spans_arg = NULL;
+    PyArrayObject *spans = NULL;
+    int64_t       *span;
+    npy_intp      ispan, nspans;
+    FILE          *fp = NULL;
+    char          *buf = NULL;
+    char          *buf_new = NULL;
+    int64_t       buflen = 0;
+    int64_t       pos;
+    int           reclen;
+    int           retcode;
+    MSRecord      *msr = NULL;
+    MSTraceGroup  *mstg = NULL;
+    PyObject      *out_traces = NULL;
+    char          strbuf[BUFSIZE];
+
+    struct module_state *st = GETSTATE(m);
+
+    if (!PyArg_ParseTuple(args, "sLLO", &filename, &itmin, &itmax, &spans_arg)) {
+        PyErr_SetString(st->error, "usage get_traces_window(filename, itmin, itmax, spans)" );
+        return NULL;
+    }
+
+    spans = (PyArrayObject*)PyArray_FROMANY(spans_arg, NPY_INT64, 2, 2, NPY_ARRAY_IN_ARRAY);
+    if (spans == NULL || PyArray_DIMS(spans)[1] != 2) {
+        Py_XDECREF(spans);
+        PyErr_SetString(st->error, "spans must be an array of shape (n, 2) with (offset, nbytes) rows");
+        return NULL;
+    }
+
+    fp = fopen(filename, "rb");
+    if (fp == NULL) {
+        Py_DECREF(spans);
+        snprintf (strbuf, BUFSIZE, "Cannot open file '%s'", filename);
+        PyErr_SetString(st->error, strbuf);
+        return NULL;
+    }
+
+    mstg = mst_initgroup(NULL);
+    nspans = PyArray_DIMS(spans)[0];
+    strbuf[0] = '\0';
+
+    Py_BEGIN_ALLOW_THREADS
+
+    for (ispan=0; ispan<nspans; ispan++) {
+        span = (int64_t*)PyArray_GETPTR2(spans, ispan, 0);
+        if (span[1] > buflen) {
+            buf_new = realloc(buf, span[1]);
+            if (buf_new == NULL) {
+                snprintf (strbuf, BUFSIZE, "Cannot allocate read buffer");
+                break;
+            }
+            buf = buf_new;
+            buflen = span[1];
+        }
+
+        if (lmp_fseeko(fp, span[0], SEEK_SET) ||
+                (int64_t)fread(buf, 1, span[1], fp) != span[1]) {
+            snprintf (strbuf, BUFSIZE, "Cannot read %lld bytes at offset %lld from file '%s'",
+                      (long long)span[1], (long long)span[0], filename);
+            break;
+        }
+
+        /* only unpack data of records overlapping the time window */
+        pos = 0;
+        while (pos < span[1]) {
+            retcode = msr_parse(buf+pos, span[1]-pos, &msr, 0, 0, 0);
+            if (retcode != MS_NOERROR) {
+                snprintf (strbuf, BUFSIZE, "Cannot parse record at offset %lld in file '%s'",
+                          (long long)(span[0]+pos), filename);
+                break;
+            }
+
+            reclen = msr->reclen;
+            if (msr->starttime <= itmax && msr_endtime(msr) >= itmin) {
+                retcode = msr_parse(buf+pos, reclen, &msr, reclen, 1, 0);
+                if (retcode != MS_NOERROR) {
+                    snprintf (strbuf, BUFSIZE, "Cannot unpack record at offset %lld in file '%s': %s",
+                              (long long)(span[0]+pos), filename, ms_errorstr(retcode));
+                    break;
+                }
+                mst_addmsrtogroup (mstg, msr, 0, -1.0, -1.0);
+            }
+
+            pos += reclen;
+        }
+
+        if (strbuf[0] != '\0') break;
+    }
+
+    msr_free(&msr);
+    free(buf);
+    fclose(fp);
+
+    Py_END_ALLOW_THREADS
+    Py_DECREF(spans);
+
+    if (strbuf[0] != '\0') {
+        PyErr_SetString(st->error, strbuf);
+        mst_freegroup (&mstg);
+        return NULL;
+    }
+
+    out_traces = mstg_to_list(st, mstg, 1);
     mst_freegroup (&mstg);
 
     return out_traces;
@@ -294,6 +520,24 @@ static PyMethodDef mseed_ext_methods[] = {
     "in libmseed. If dataflag is True, `data` is a numpy array containing the\n"
     "data. If dataflag is False, the data is not unpacked and `data` is None.\n" },
 
+    {"scan_traces",  mseed_scan_traces, METH_VARARGS,
+    "scan_traces(filename, group_nbytes)\n"
+    "Get headers of all traces stored in an mseed file and an index of its\n"
+    "records.\n\n"
+    "Returns a tuple (traces, groups). The traces are given as with\n"
+    "get_traces(filename, False). groups is an int64 array of shape (n, 4),\n"
+    "where each row describes a group of consecutive records in the file:\n\n"
+    "  (offset, nbytes, starttime, endtime)\n\n"
+    "Records are grouped until the size of a group would exceed group_nbytes.\n" },
+
+    {"get_traces_window",  mseed_get_traces_window, METH_VARARGS,
+    "get_traces_window(filename, starttime, endtime, spans)\n"
+    "Get traces with data from selected byte ranges of an mseed file.\n\n"
+    "spans is an array of shape (n, 2) with (offset, nbytes) rows, each\n"
+    "covering complete records. Only the data of records overlapping the time\n"
+    "window [starttime, endtime] (in HPTMODULUS units) are unpacked. Returns\n"
+    "a list of tuples as get_traces(filename, True).\n" },
+
     {"store_traces",  mseed_store_traces, METH_VARARGS, 
     "store_traces(traces, filename)\n" },
 
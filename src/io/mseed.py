@@ -8,8 +8,11 @@ from builtins import zip
 from struct import unpack
 import os
 import re
+import math
 import logging
 
+import numpy as num
+
 from pyrocko import trace
 from pyrocko.util import reuse, ensuredirs
 from .io_common import FileLoadError, FileSaveError
@@ -21,39 +24,168 @@ class CodeTooLong(FileSaveError):
     pass
 
 
-def iload(filename, load_data=True):
+def _make_traces(trtups, filename):
     from pyrocko import mseed_ext
 
     have_zero_rate_traces = False
-    try:
-        traces = []
-        for tr in mseed_ext.get_traces(filename, load_data):
-            network, station, location, channel = tr[1:5]
-            tmin = float(tr[5])/float(mseed_ext.HPTMODULUS)
-            tmax = float(tr[6])/float(mseed_ext.HPTMODULUS)
-            try:
-                deltat = reuse(1.0/float(tr[7]))
-            except ZeroDivisionError as e:
-                have_zero_rate_traces = True
-                continue
-
-            ydata = tr[8]
-
-            traces.append(trace.Trace(
-                network, station, location, channel, tmin, tmax,
-                deltat, ydata))
-
-        for tr in traces:
-            yield tr
+    traces = []
+    for tr in trtups:
+        network, station, location, channel = tr[1:5]
+        tmin = float(tr[5])/float(mseed_ext.HPTMODULUS)
+        tmax = float(tr[6])/float(mseed_ext.HPTMODULUS)
+        try:
+            deltat = reuse(1.0/float(tr[7]))
+        except ZeroDivisionError:
+            have_zero_rate_traces = True
+            continue
 
-    except (OSError, mseed_ext.MSeedError) as e:
-        raise FileLoadError(str(e)+' (file: %s)' % filename)
+        ydata = tr[8]
+
+        traces.append(trace.Trace(
+            network, station, location, channel, tmin, tmax,
+            deltat, ydata))
 
     if have_zero_rate_traces:
         logger.warning(
             'Ignoring traces with sampling rate of zero in file %s '
             '(maybe LOG traces)' % filename)
 
+    return traces
+
+
+def iload(filename, load_data=True):
+    from pyrocko import mseed_ext
+
+    try:
+        traces = _make_traces(
+            mseed_ext.get_traces(filename, load_data), filename)
+
+    except (OSError, mseed_ext.MSeedError) as e:
+        raise FileLoadError(str(e)+' (file: %s)' % filename)
+
+    for tr in traces:
+        yield tr
+
+
+def scan(filename, group_nbytes=2**16):
+    '''
+    Read trace headers and an index of the records of a Mini-SEED file.
+
+    :param filename: path to the file
+    :param group_nbytes: consecutive records are collected into groups of at
+        most this size in bytes
+
+    :returns: tuple ``(traces, record_groups)``, where ``traces`` is a list of
+        :py:class:`pyrocko.trace.Trace` objects without data and
+        ``record_groups`` is an integer array of shape ``(n, 4)``, each row
+        giving byte offset, size in bytes, start time and end time (in
+        ``mseed_ext.HPTMODULUS`` units) of a group of records
+
+    The record groups can be passed to :py:func:`load_window` to read a time
+    window from the file without having to read and decode all of it.
+    '''
+
+    from pyrocko import mseed_ext
+
+    try:
+        trtups, record_groups = mseed_ext.scan_traces(filename, group_nbytes)
+        traces = _make_traces(trtups, filename)
+
+    except (OSError, mseed_ext.MSeedError) as e:
+        raise FileLoadError(str(e)+' (file: %s)' % filename)
+
+    return traces, record_groups
+
+
+def load_window(filename, tmin, tmax, record_groups):
+    '''
+    Load a time window of data from a Mini-SEED file.
+
+    Only the record groups overlapping the time window are read from the file
+    and only the records overlapping the time window are decoded.
+
+    :param filename: path to the file
+    :param tmin: start time of the window
+    :param tmax: end time of the window
+    :param record_groups: record index of the file as returned by
+        :py:func:`scan`
+
+    :returns: list of :py:class:`pyrocko.trace.Trace` objects holding (at
+        least) the data of the time window
+    '''
+
+    from pyrocko import mseed_ext
+
+    itmin = int(math.floor(tmin*mseed_ext.HPTMODULUS))
+    itmax = int(math.ceil(tmax*mseed_ext.HPTMODULUS))
+
+    groups = select_record_groups(record_groups, tmin, tmax)
+
+    # join adjacent groups to read them in one go
+    spans = []
+    for offset, nbytes in groups[:, :2]:
+        if spans and spans[-1][0] + spans[-1][1] == offset:
+            spans[-1][1] += nbytes
+        else:
+            spans.append([offset, nbytes])
+
+    if not spans:
+        return []
+
+    try:
+        trtups = mseed_ext.get_traces_window(
+            filename, itmin, itmax, num.array(spans, dtype=num.int64))
+
+        return _make_traces(trtups, filename)
+
+    except (OSError, mseed_ext.MSeedError) as e:
+        raise FileLoadError(str(e)+' (file: %s)' % filename)
+
+
+def select_record_groups(record_groups, tmin, tmax):
+    '''
+    Get the record groups overlapping a time window.
+
+    :param record_groups: record index of a file as returned by :py:func:`scan`
+    :param tmin: start time of the window
+    :param tmax: end time of the window
+
+    :returns: the selected rows of ``record_groups``
+    '''
+
+    from pyrocko import mseed_ext
+
+    itmin = int(math.floor(tmin*mseed_ext.HPTMODULUS))
+    itmax = int(math.ceil(tmax*mseed_ext.HPTMODULUS))
+
+    return record_groups[num.logical_and(
+        record_groups[:, 3] >= itmin, record_groups[:, 2] <= itmax)]
+
+
+def load_record_group(filename, record_group):
+    '''
+    Load and decode all records of a single record group.
+
+    :param filename: path to the file
+    :param record_group: one row of the record index as returned by
+        :py:func:`scan`
+
+    :returns: list of :py:class:`pyrocko.trace.Trace` objects
+    '''
+
+    from pyrocko import mseed_ext
+
+    offset, nbytes, itmin, itmax = [int(x) for x in record_group]
+    try:
+        trtups = mseed_ext.get_traces_window(
+            filename, itmin, itmax,
+            num.array([[offset, nbytes]], dtype=num.int64))
+
+        return _make_traces(trtups, filename)
+
+    except (OSError, mseed_ext.MSeedError) as e:
+        raise FileLoadError(str(e)+' (file: %s)' % filename)
+
 
 def as_tuple(tr):
     from pyrocko import mseed_ext
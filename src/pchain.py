@@ -3,24 +3,44 @@
 # The Pyrocko Developers, 21st Century
 # ---|P------/S----------~Lg----------
 
+from . import util
+
+g_nmax_default = 16
+
+_miss = object()
+
 
 class Stage(object):
-    def __init__(self, f):
+    '''
+    Processing stage with bounded cache of results.
+
+    :param f: processing function
+    :param nmax: maximum number of results kept in the cache; least recently
+        used results are dropped
+    '''
+
+    def __init__(self, f, nmax=None):
         self._f = f
         self._parent = None
-        self._cache = {}
+        if nmax is None:
+            nmax = g_nmax_default
+
+        self._cache = util.LRUCache(nmax)
 
     def __call__(self, *x, **kwargs):
         if kwargs.get('nocache', False):
             return self.call_nocache(*x)
 
-        if x not in self._cache:
+        result = self._cache.get(x, _miss)
+        if result is _miss:
             if self._parent is not None:
-                self._cache[x] = self._f(self._parent(*x[:-1]), *x[-1])
+                result = self._f(self._parent(*x[:-1]), *x[-1])
             else:
-                self._cache[x] = self._f(*x[-1])
+                result = self._f(*x[-1])
+
+            self._cache.put(x, result)
 
-        return self._cache[x]
+        return result
 
     def call_nocache(self, *x):
         if self._parent is not None:
@@ -31,14 +51,33 @@ class Stage(object):
     def clear(self):
         self._cache.clear()
 
+    def set_nmax(self, nmax):
+        self._cache.set_nmax(nmax)
+
+    def get_stats(self):
+        '''
+        Get cache statistics, see :py:meth:`pyrocko.util.LRUCache.stats`.
+        '''
+
+        return self._cache.stats()
+
 
 class Chain(object):
-    def __init__(self, *stages):
+    '''
+    Chain of processing stages with cached intermediate results.
+
+    :param stages: processing functions or :py:class:`Stage` objects
+    :param nmax: cache size of stages created from plain functions (given as
+        keyword argument)
+    '''
+
+    def __init__(self, *stages, **kwargs):
+        nmax = kwargs.pop('nmax', None)
         parent = None
         self.stages = []
         for stage in stages:
             if not isinstance(stage, Stage):
-                stage = Stage(stage)
+                stage = Stage(stage, nmax=nmax)
 
             stage._parent = parent
             parent = stage
@@ -48,5 +87,26 @@ class Chain(object):
         for stage in self.stages:
             stage.clear()
 
+    def set_nmax(self, nmax):
+        for stage in self.stages:
+            stage.set_nmax(nmax)
+
+    def get_stats(self):
+        '''
+        Get cache statistics summed over all stages.
+
+        :returns: dict in the format of
+            :py:meth:`pyrocko.util.LRUCache.stats`, use
+            ``chain.stages[i].get_stats()`` for the statistics of a single
+            stage
+        '''
+
+        total = {}
+        for stage in self.stages:
+            for k, v in stage.get_stats().items():
+                total[k] = total.get(k, 0) + v
+
+        return total
+
     def __call__(self, *x, **kwargs):
         return self.stages[len(x)-1](*x, **kwargs)
@@ -13,22 +13,31 @@ import os
 import logging
 import time
 import weakref
+import threading
+import queue
 import copy
 import re
 import sys
 import operator
 import math
+import multiprocessing
 import hashlib
+import sqlite3
+from collections import OrderedDict
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
 
 
+import numpy as num
+
 from . import avl
 from . import trace, io, util
 from . import config
+from .io import mseed
 from .trace import degapper
+from .parimap import parimap
 
 
 show_progress_force_off = False
@@ -200,6 +209,22 @@ class TracesFileCache(object):
             return dircache[abspath]
         return None
 
+    def get_many(self, abspaths):
+        '''Get many items from the cache.
+
+        :param abspaths: absolute paths of the objects to retrieve
+
+        :returns: dict with the objects found, indexed by path
+        '''
+
+        tfiles = {}
+        for abspath in abspaths:
+            tfile = self.get(abspath)
+            if tfile is not None:
+                tfiles[abspath] = tfile
+
+        return tfiles
+
     def put(self, abspath, tfile):
         '''Put an item into the cache.
 
@@ -259,6 +284,9 @@ class TracesFileCache(object):
                 del cache[fn]
 
         for v in cache.values():
+            if not hasattr(v, 'record_groups'):
+                v.record_groups = None
+
             v.trees_from_content(v.traces)
             for tr in v.traces:
                 tr.file = v
@@ -305,17 +333,345 @@ class TracesFileCache(object):
         os.rename(tmpfn, cachefilename)
 
 
-def get_cache(cachedir):
-    '''Get global TracesFileCache object for given directory.'''
-    if cachedir not in TracesFileCache.caches:
-        TracesFileCache.caches[cachedir] = TracesFileCache(cachedir)
+# number of paths per database query, below SQLite's limit of 999 parameters
+g_db_batch_size = 500
+
+
+class TracesFileDBCache(object):
+    '''Manages trace metainformation cache in an SQLite database.
+
+    Alternative to :py:class:`TracesFileCache`. Instead of pickling complete
+    :py:class:`TracesFile` objects per directory, only the codes, time spans
+    and sampling intervals of the traces, as well as the modification times of
+    the files, are stored in an indexed database. Concurrent processes may
+    safely share one cache and a cache object may be used from several
+    threads. Time and code range queries can be answered by
+    :py:meth:`get_paths`, without loading any header objects.
+    '''
+
+    caches = {}
+
+    def __init__(self, cachedir):
+        '''Create new cache.
+
+        :param cachedir: directory to hold the database file.
+
+        '''
+
+        self.cachedir = cachedir
+        self.modified = {}
+        util.ensuredir(self.cachedir)
+        self.dbpath = pjoin(self.cachedir, 'traces.sqlite')
+        # one connection shared by all threads, access is serialized
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            self.dbpath, timeout=60., check_same_thread=False)
+        with self._conn:
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS files (
+                    file_id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    format TEXT NOT NULL,
+                    mtime REAL NOT NULL,
+                    record_groups BLOB);
+
+                CREATE TABLE IF NOT EXISTS traces (
+                    file_id INTEGER NOT NULL REFERENCES files(file_id),
+                    network TEXT NOT NULL,
+                    station TEXT NOT NULL,
+                    location TEXT NOT NULL,
+                    channel TEXT NOT NULL,
+                    tmin REAL NOT NULL,
+                    tmax REAL NOT NULL,
+                    deltat REAL NOT NULL);
+
+                CREATE INDEX IF NOT EXISTS traces_file_id
+                    ON traces (file_id);
+                CREATE INDEX IF NOT EXISTS traces_tmin ON traces (tmin);
+                CREATE INDEX IF NOT EXISTS traces_tmax ON traces (tmax);
+                CREATE INDEX IF NOT EXISTS traces_codes
+                    ON traces (network, station, location, channel);
+            ''')
+
+    def get(self, abspath):
+        '''Try to get an item from the cache.
+
+        :param abspath: absolute path of the object to retrieve
+
+        :returns: a :py:class:`TracesFile` object, reconstructed from the
+            database, or None if nothing could be found.
+
+        '''
+
+        return self.get_many([abspath]).get(abspath, None)
+
+    def get_many(self, abspaths):
+        '''Get many items from the cache.
+
+        The database is queried in batches, not once per path.
+
+        :param abspaths: absolute paths of the objects to retrieve
+
+        :returns: dict with the :py:class:`TracesFile` objects found, indexed
+            by path
+        '''
+
+        with self._lock:
+            tfiles = {}
+            query = []
+            for abspath in abspaths:
+                if abspath in self.modified:
+                    tfiles[abspath] = self.modified[abspath]
+                else:
+                    query.append(abspath)
+
+            for ibatch in range(0, len(query), g_db_batch_size):
+                batch = query[ibatch:ibatch+g_db_batch_size]
+                files = {}
+                for (file_id, abspath, format, mtime, record_groups) \
+                        in self._conn.execute(
+                            '''
+                                SELECT file_id, path, format, mtime,
+                                    record_groups
+                                FROM files WHERE path IN (%s)
+                            ''' % ', '.join(['?'] * len(batch)), batch):
+
+                    if record_groups is not None:
+                        record_groups = num.frombuffer(
+                            record_groups, dtype=num.int64).reshape((-1, 4))
+
+                    files[file_id] = (
+                        abspath, format, mtime, record_groups, [])
+
+                if not files:
+                    continue
+
+                file_ids = list(files.keys())
+                for (file_id, net, sta, loc, cha, tmin, tmax, deltat) \
+                        in self._conn.execute(
+                            '''
+                                SELECT file_id, network, station, location,
+                                    channel, tmin, tmax, deltat
+                                FROM traces WHERE file_id IN (%s)
+                                ORDER BY file_id, rowid
+                            ''' % ', '.join(['?'] * len(file_ids)), file_ids):
+
+                    mtime, traces = files[file_id][2], files[file_id][4]
+                    traces.append(trace.Trace(
+                        net, sta, loc, cha,
+                        tmin=tmin, tmax=tmax, deltat=deltat, mtime=mtime))
+
+                for (abspath, format, mtime, record_groups, traces) \
+                        in files.values():
+
+                    tfiles[abspath] = TracesFile(
+                        None, abspath, format, mtime=mtime, traces=traces,
+                        record_groups=record_groups)
+
+            return tfiles
+
+    def put(self, abspath, tfile):
+        '''Put an item into the cache.
+
+        :param abspath: absolute path of the object to be stored
+        :param tfile: :py:class:`TracesFile` object to be stored
+
+        The item is written to the database on the next call to
+        :py:meth:`dump_modified`.
+        '''
+
+        with self._lock:
+            self.modified[abspath] = tfile
+
+    def dump_modified(self):
+        '''Save any modifications to disk.'''
+
+        with self._lock:
+            if not self.modified:
+                return
+
+            with self._conn:
+                for abspath, tfile in self.modified.items():
+                    self._delete(abspath)
+                    record_groups = None
+                    if tfile.record_groups is not None:
+                        record_groups = sqlite3.Binary(
+                            tfile.record_groups.astype(num.int64).tobytes())
+
+                    cursor = self._conn.execute(
+                        '''
+                            INSERT INTO files
+                                (path, format, mtime, record_groups)
+                            VALUES (?, ?, ?, ?)
+                        ''', (
+                            abspath, tfile.format, tfile.mtime, record_groups))
+
+                    file_id = cursor.lastrowid
+                    self._conn.executemany(
+                        '''
+                            INSERT INTO traces VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ''', [
+                            (file_id, tr.network, tr.station, tr.location,
+                             tr.channel, float(tr.tmin), float(tr.tmax),
+                             tr.deltat)
+                            for tr in tfile.traces])
+
+            self.modified = {}
+
+    def clean(self):
+        '''Weed out missing files from the database.'''
+
+        with self._lock:
+            self.dump_modified()
 
-    return TracesFileCache.caches[cachedir]
+            missing = [
+                path for (path,)
+                in self._conn.execute('SELECT path FROM files')
+                if not os.path.isfile(path)]
+
+            with self._conn:
+                for path in missing:
+                    self._delete(path)
+
+    def get_mtimes(self, abspaths):
+        '''Get format and modification time of cached files.
+
+        :param abspaths: absolute paths of the files
+
+        :returns: dict with ``(format, mtime)`` tuples of the files found,
+            indexed by path
+        '''
+
+        with self._lock:
+            mtimes = dict(
+                (abspath, (tfile.format, tfile.mtime))
+                for (abspath, tfile) in self.modified.items())
+
+            query = [abspath for abspath in abspaths if abspath not in mtimes]
+            for ibatch in range(0, len(query), g_db_batch_size):
+                batch = query[ibatch:ibatch+g_db_batch_size]
+                for (abspath, format, mtime) in self._conn.execute(
+                        '''
+                            SELECT path, format, mtime FROM files
+                            WHERE path IN (%s)
+                        ''' % ', '.join(['?'] * len(batch)), batch):
+
+                    mtimes[abspath] = (format, mtime)
+
+            return mtimes
+
+    def get_paths(self, tmin=None, tmax=None, codes=None):
+        '''Query paths of cached files by time span and trace codes.
+
+        :param tmin: start time or ``None``
+        :param tmax: end time or ``None``
+        :param codes: pattern or list of patterns, matched against
+            ``'network.station.location.channel'`` (see
+            :py:func:`pyrocko.util.match_nslc`), or ``None``
+
+        :returns: sorted list of absolute paths of files containing at least
+            one matching trace within the given time span.
+        '''
+
+        conditions = []
+        args = []
+        if tmin is not None:
+            conditions.append('traces.tmax >= ?')
+            args.append(float(tmin))
+
+        if tmax is not None:
+            conditions.append('traces.tmin <= ?')
+            args.append(float(tmax))
+
+        if codes is not None:
+            if isinstance(codes, str):
+                codes = [codes]
+
+            # matching is case insensitive, like in util.match_nslc
+            conditions.append('(%s)' % ' OR '.join(
+                ["lower(traces.network || '.' || traces.station || '.' || "
+                 "traces.location || '.' || traces.channel) GLOB ?"] *
+                len(codes)))
+
+            args.extend(
+                pattern.replace('[!', '[^').lower() for pattern in codes)
+
+        sql = '''
+            SELECT DISTINCT files.path
+            FROM files JOIN traces ON files.file_id = traces.file_id
+        '''
+
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        sql += ' ORDER BY files.path'
+
+        with self._lock:
+            return [path for (path,) in self._conn.execute(sql, args)]
+
+    def _delete(self, abspath):
+        self._conn.execute(
+            '''
+                DELETE FROM traces WHERE file_id IN (
+                    SELECT file_id FROM files WHERE path = ?)
+            ''', (abspath,))
+
+        self._conn.execute('DELETE FROM files WHERE path = ?', (abspath,))
+
+
+def get_cache(cachedir, backend='pickle'):
+    '''Get global cache object for given directory.
+
+    :param cachedir: directory to hold the cache files
+    :param backend: ``'pickle'`` to get a :py:class:`TracesFileCache`,
+        ``'sqlite'`` to get a :py:class:`TracesFileDBCache`
+    '''
+
+    if backend == 'pickle':
+        cls = TracesFileCache
+    elif backend == 'sqlite':
+        cls = TracesFileDBCache
+    else:
+        raise ValueError('Unknown cache backend: %s' % backend)
+
+    if cachedir not in cls.caches:
+        cls.caches[cachedir] = cls(cachedir)
+
+    return cls.caches[cachedir]
+
+
+def _load_headers(abspath, fileformat, substitutions):
+    if fileformat == 'mseed':
+        mtime = os.stat(abspath)[8]
+        traces, record_groups = mseed.scan(abspath)
+        for tr in traces:
+            io.make_substitutions(tr, substitutions)
+            tr.set_mtime(mtime)
+
+    else:
+        traces = io.load(
+            abspath, format=fileformat, getdata=False,
+            substitutions=substitutions)
+
+        record_groups = None
+
+    return traces, record_groups
+
+
+def _scan_headers(abspath, fileformat, substitutions):
+    try:
+        traces, record_groups = _load_headers(
+            abspath, fileformat, substitutions)
+
+        return traces, record_groups, None
+
+    except (io.FileLoadError, OSError) as xerror:
+        return None, None, str(xerror)
 
 
 def loader(
         filenames, fileformat, cache, filename_attributes,
-        show_progress=True, update_progress=None):
+        show_progress=True, update_progress=None, nworkers=1):
 
     if show_progress_force_off:
         show_progress = False
@@ -353,6 +709,11 @@ def loader(
     if filename_attributes:
         regex = re.compile(filename_attributes)
 
+    cached = {}
+    if cache:
+        cached = cache.get_many(
+            [os.path.abspath(filename) for filename in filenames])
+
     progress = Progress('Looking at files', len(filenames))
 
     failures = []
@@ -375,9 +736,7 @@ def loader(
                         substitutions[k] = m.groupdict()[k]
 
             mtime = os.stat(filename)[8]
-            tfile = None
-            if cache:
-                tfile = cache.get(abspath)
+            tfile = cached.get(abspath, None)
 
             mustload = (
                 not tfile or
@@ -411,12 +770,25 @@ def loader(
     if to_load:
         progress = Progress('Scanning files', nload)
 
+        to_scan = [x for x in to_load if x[0]]
+        scanned = parimap(
+            _scan_headers,
+            [x[2] for x in to_scan],
+            [fileformat] * len(to_scan),
+            [x[3] for x in to_scan],
+            nprocs=nworkers)
+
         for (mustload, mtime, abspath, substitutions, tfile) in to_load:
             try:
                 if mustload:
+                    traces, record_groups, xerror = next(scanned)
+                    if xerror is not None:
+                        raise io.FileLoadError(xerror)
+
                     tfile = TracesFile(
                         None, abspath, fileformat,
-                        substitutions=substitutions, mtime=mtime)
+                        substitutions=substitutions, mtime=mtime,
+                        traces=traces, record_groups=record_groups)
 
                     if cache and not substitutions:
                         cache.put(abspath, tfile)
@@ -437,6 +809,7 @@ def loader(
             if abort:
                 break
 
+        scanned.close()
         progress.update(nload)
 
     if failures:
@@ -452,6 +825,331 @@ def tlen(x):
     return x.tmax-x.tmin
 
 
+class TraceIntervals(object):
+    '''Time interval index over the traces of a single channel.'''
+
+    def __init__(self):
+        self.by_tmin = Sorted([], 'tmin')
+        self.by_tlen = Sorted([], tlen)
+
+    def insert(self, tr):
+        self.by_tmin.insert(tr)
+        self.by_tlen.insert(tr)
+
+    def remove(self, tr):
+        self.by_tmin.remove(tr)
+        self.by_tlen.remove(tr)
+
+    def __len__(self):
+        return len(self.by_tmin)
+
+    def overlapping(self, tmin, tmax):
+        '''Get traces overlapping with the time span ``tmin``, ``tmax``.'''
+
+        if not self.by_tmin:
+            return []
+
+        tlenmax = tlen(self.by_tlen.max())
+        return [tr for tr in self.by_tmin.with_key_in(tmin-tlenmax, tmax)
+                if tr.is_relevant(tmin, tmax)]
+
+
+class DataCache(object):
+    '''Keeps decoded waveform data of currently unused files in memory.
+
+    When no accessor uses the data of a file anymore, the file is handed over
+    to this cache instead of forgetting its data immediately. The data of the
+    least recently used files is released when the total size of the cached
+    data exceeds the memory budget.
+
+    :param nbytes_max: memory budget in bytes
+    '''
+
+    def __init__(self, nbytes_max):
+        self.nbytes_max = nbytes_max
+        self.nbytes = 0
+        self._files = OrderedDict()
+        self.nhits = 0
+        self.nmisses = 0
+        self.nevictions = 0
+
+    def lookup(self, file):
+        '''Count access to file data and mark it as recently used.'''
+
+        if file.data_loaded:
+            self.nhits += 1
+            if file in self._files:
+                self._files[file] = self._files.pop(file)
+        else:
+            self.nmisses += 1
+
+    def put(self, file):
+        '''Take over data of a file which is no longer used.'''
+
+        self.discard(file)
+        nbytes = file.get_data_nbytes()
+        self._files[file] = nbytes
+        self.nbytes += nbytes
+        self._evict()
+
+    def take(self, file):
+        '''Remove file from cache, e.g. because it is used again.'''
+
+        self.discard(file)
+
+    def discard(self, file):
+        if file in self._files:
+            self.nbytes -= self._files.pop(file)
+
+    def clear(self):
+        '''Release data of all cached files.'''
+
+        while self._files:
+            file, nbytes = self._files.popitem(last=False)
+            self.nbytes -= nbytes
+            file.forget_data()
+
+    def set_nbytes_max(self, nbytes_max):
+        self.nbytes_max = nbytes_max
+        self._evict()
+
+    def _evict(self):
+        while self._files and self.nbytes > self.nbytes_max:
+            file, nbytes = self._files.popitem(last=False)
+            self.nbytes -= nbytes
+            file.forget_data()
+            self.nevictions += 1
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, file):
+        return file in self._files
+
+    def __str__(self):
+        s = 'DataCache\n'
+        s += 'number of files: %i\n' % len(self._files)
+        s += 'size: %i / %i bytes\n' % (self.nbytes, self.nbytes_max)
+        s += 'hits: %i\n' % self.nhits
+        s += 'misses: %i\n' % self.nmisses
+        s += 'evictions: %i\n' % self.nevictions
+        return s
+
+
+# when the sample cache exceeds its limit, entries are removed until its size
+# is below this fraction of the limit
+g_sample_cache_low_water = 0.8
+
+# the sample cache directory is rescanned, to account for other processes
+# sharing it, at most after this number of puts or this time interval [s]
+g_sample_cache_rescan_nputs = 100
+g_sample_cache_rescan_interval = 60.
+
+
+class SampleCache(object):
+    '''On-disk cache of decoded waveform samples.
+
+    The decoded sample arrays of whole files are stored as ``.npy`` files,
+    keyed by path, size, and modification time of the original file. For
+    partial reads of Mini-SEED files (see
+    :py:meth:`TracesFile.load_data_window`), the decoded samples of each
+    record group are stored separately, with the byte span and time span of
+    the group added to the key. When
+    read back, they are memory-mapped (copy-on-write), so that repeated
+    loading of the same files, also by different processes sharing the cache
+    directory, needs neither decoding nor copying. The least recently used
+    entries are removed when the total size of the cache exceeds the limit.
+
+    The size of the cache and the order of use of its entries are tracked in
+    memory. The cache directory is only rescanned occasionally, so that
+    entries written by other processes are accounted for with some delay.
+
+    :param cachedir: directory to hold the cache files
+    :param nbytes_max: size limit in bytes
+    '''
+
+    def __init__(self, cachedir, nbytes_max):
+        self.cachedir = cachedir
+        self.nbytes_max = nbytes_max
+        util.ensuredir(cachedir)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._scan()
+
+    def _key(self, abspath, fileformat, substitutions, span):
+        st = os.stat(abspath)
+        k = (abspath, st.st_size, st.st_mtime, fileformat,
+             sorted((substitutions or {}).items()))
+
+        if span is not None:
+            k += (tuple(int(x) for x in span),)
+
+        return ehash(repr(k))
+
+    def _path(self, fn):
+        return os.path.join(self.cachedir, fn)
+
+    def _write(self, fn, write):
+        tmpfn = self._path('%s.tmp-%i-%i' % (
+            fn, os.getpid(), threading.current_thread().ident))
+
+        with open(tmpfn, 'wb') as f:
+            write(f)
+            nbytes = f.tell()
+
+        os.rename(tmpfn, self._path(fn))
+        return nbytes
+
+    def get(self, abspath, fileformat, substitutions=None, span=None):
+        '''Get traces of a file from the cache.
+
+        :param span: record group (see :py:func:`pyrocko.io.mseed.scan`) to
+            get the traces of, or ``None`` for the whole file
+        :returns: list of :py:class:`pyrocko.trace.Trace` objects or ``None``
+            if the file is not in the cache
+        '''
+
+        try:
+            key = self._key(abspath, fileformat, substitutions, span)
+            indexpath = self._path(key + '.index')
+            with open(indexpath, 'rb') as f:
+                entries = pickle.load(f)
+
+            traces = []
+            for fn, kwargs in entries:
+                ydata = num.load(self._path(fn), mmap_mode='c')
+                traces.append(
+                    trace.Trace(ydata=ydata.view(num.ndarray), **kwargs))
+
+            os.utime(indexpath, None)
+
+        except (OSError, IOError, EOFError, ValueError, pickle.PickleError):
+            return None
+
+        with self._lock:
+            if key in self._index:
+                self._index[key] = self._index.pop(key)
+
+        return traces
+
+    def put(self, abspath, fileformat, substitutions, traces, span=None):
+        '''Store traces of a file in the cache.
+
+        :param span: record group (see :py:func:`pyrocko.io.mseed.scan`) the
+            traces have been decoded from, or ``None`` for the whole file
+        '''
+
+        try:
+            key = self._key(abspath, fileformat, substitutions, span)
+            entries = []
+            fns = []
+            nbytes = 0
+            for i, tr in enumerate(traces):
+                fn = '%s-%i.npy' % (key, i)
+                ydata = num.ascontiguousarray(tr.ydata)
+                nbytes += self._write(fn, lambda f: num.save(f, ydata))
+                fns.append(fn)
+                entries.append((fn, dict(
+                    network=tr.network,
+                    station=tr.station,
+                    location=tr.location,
+                    channel=tr.channel,
+                    tmin=tr.tmin,
+                    deltat=tr.deltat,
+                    mtime=tr.mtime,
+                    meta=tr.meta)))
+
+            # index is written last, its presence marks a complete entry
+            nbytes += self._write(key + '.index', lambda f: pickle.dump(
+                entries, f, protocol=2))
+            fns.append(key + '.index')
+
+        except (OSError, IOError) as e:
+            logger.warning('Failed to write sample cache entry: %s' % e)
+            return
+
+        with self._lock:
+            if key in self._index:
+                self._nbytes -= self._index.pop(key)[1]
+
+            self._index[key] = [fns, nbytes]
+            self._nbytes += nbytes
+            self._nputs += 1
+            if self._nbytes > self.nbytes_max:
+                if self._nputs >= g_sample_cache_rescan_nputs or \
+                        time.time() - self._tscan \
+                        >= g_sample_cache_rescan_interval:
+
+                    self._scan()
+
+                if self._nbytes > self.nbytes_max:
+                    self._evict_locked(
+                        g_sample_cache_low_water * self.nbytes_max)
+
+    def get_nbytes(self):
+        '''Get total size of the cache files.'''
+
+        with self._lock:
+            self._scan()
+            return self._nbytes
+
+    def _scan(self):
+        # Rebuild the in-memory LRU index and the running byte total from the
+        # cache directory, which may be shared with other processes.
+        entries = self._entries()
+        self._index = OrderedDict(
+            (key, [fns, nbytes]) for (key, (fns, nbytes, _)) in sorted(
+                entries.items(), key=lambda item: item[1][2]))
+
+        self._nbytes = sum(nbytes for (_, nbytes) in self._index.values())
+        self._nputs = 0
+        self._tscan = time.time()
+
+    def _entries(self):
+        entries = {}
+        for fn in os.listdir(self.cachedir):
+            if '.tmp-' in fn:
+                continue
+
+            try:
+                st = os.stat(self._path(fn))
+            except OSError:
+                continue
+
+            key = fn.split('.')[0].split('-')[0]
+            if key not in entries:
+                entries[key] = [[], 0, None]
+
+            entry = entries[key]
+            entry[0].append(fn)
+            entry[1] += st.st_size
+            if fn.endswith('.index'):
+                entry[2] = st.st_mtime
+
+        for entry in entries.values():
+            if entry[2] is None:
+                # incomplete entry, remove first
+                entry[2] = 0.0
+
+        return entries
+
+    def _evict(self):
+        with self._lock:
+            self._scan()
+            self._evict_locked(self.nbytes_max)
+
+    def _evict_locked(self, nbytes_target):
+        while self._nbytes > nbytes_target and self._index:
+            _, (fns, nbytes_entry) = self._index.popitem(last=False)
+            for fn in sorted(fns, key=lambda fn: not fn.endswith('.index')):
+                try:
+                    os.unlink(self._path(fn))
+                except OSError:
+                    pass
+
+            self._nbytes -= nbytes_entry
+
+
 class TracesGroup(object):
 
     '''Trace container base class.
@@ -474,6 +1172,18 @@ class TracesGroup(object):
     def get_parent(self):
         return self.parent
 
+    def get_data_cache(self):
+        if self.parent is not None:
+            return self.parent.get_data_cache()
+
+        return None
+
+    def get_sample_cache(self):
+        if self.parent is not None:
+            return self.parent.get_sample_cache()
+
+        return None
+
     def empty(self):
         self.networks, self.stations, self.locations, self.channels, \
             self.nslc_ids, self.deltats = [Counter() for x in range(6)]
@@ -647,6 +1357,7 @@ class MemTracesFile(TracesGroup):
         TracesGroup.__init__(self, parent)
         self.add(traces)
         self.mtime = time.time()
+        self.data_loaded = True
 
     def add(self, traces):
         if isinstance(traces, trace.Trace):
@@ -660,7 +1371,7 @@ class MemTracesFile(TracesGroup):
     def load_headers(self, mtime=None):
         pass
 
-    def load_data(self):
+    def load_data(self, force=False, traces=None):
         pass
 
     def use_data(self):
@@ -705,7 +1416,7 @@ class MemTracesFile(TracesGroup):
 class TracesFile(TracesGroup):
     def __init__(
             self, parent, abspath, format,
-            substitutions=None, mtime=None):
+            substitutions=None, mtime=None, traces=None, record_groups=None):
 
         TracesGroup.__init__(self, parent)
         self.abspath = abspath
@@ -714,23 +1425,38 @@ class TracesFile(TracesGroup):
         self.data_loaded = False
         self.data_use_count = 0
         self.substitutions = substitutions
-        self.load_headers(mtime=mtime)
+        self.record_groups = None
+        self.load_headers(
+            mtime=mtime, traces=traces, record_groups=record_groups)
         self.mtime = mtime
 
-    def load_headers(self, mtime=None):
-        logger.debug('loading headers from file: %s' % self.abspath)
+    def load_headers(self, mtime=None, traces=None, record_groups=None):
+        '''Load trace meta-information from file.
+
+        :param mtime: modification time of the file (queried if ``None``)
+        :param traces: header-only :py:class:`pyrocko.trace.Trace` objects
+            which have already been read from the file, e.g. by a parallel
+            scanner (read from the file if ``None``)
+        :param record_groups: Mini-SEED record index belonging to ``traces``
+            (see :py:func:`pyrocko.io.mseed.scan`)
+        '''
+
         if mtime is None:
             self.mtime = os.stat(self.abspath)[8]
 
+        if traces is None:
+            logger.debug('loading headers from file: %s' % self.abspath)
+            traces, record_groups = _load_headers(
+                self.abspath, self.format, self.substitutions)
+
+        self.record_groups = record_groups
+
         def kgen(tr):
             return (tr.mtime, tr.tmin, tr.tmax) + tr.nslc_id
 
         self.remove(self.traces)
         ks = set()
-        for tr in io.load(self.abspath,
-                          format=self.format,
-                          getdata=False,
-                          substitutions=self.substitutions):
+        for tr in traces:
 
             k = kgen(tr)
             if k not in ks:
@@ -743,7 +1469,52 @@ class TracesFile(TracesGroup):
         self.data_loaded = False
         self.data_use_count = 0
 
-    def load_data(self, force=False):
+    def read_data(self):
+        '''Read traces with data from file without attaching them.
+
+        This method does not modify the state of the object, so it may be
+        called from a background thread.
+        '''
+
+        def kgen(tr):
+            return (tr.mtime, tr.tmin, tr.tmax) + tr.nslc_id
+
+        sample_cache = self.get_sample_cache()
+        if sample_cache is not None:
+            traces = sample_cache.get(
+                self.abspath, self.format, self.substitutions)
+
+            if traces is not None:
+                return traces
+
+        traces_ = io.load(self.abspath, format=self.format, getdata=True,
+                          substitutions=self.substitutions)
+
+        # prevent adding duplicate snippets from corrupt mseed files
+        k_loaded = set()
+        traces = []
+        for tr in traces_:
+            k = kgen(tr)
+            if k not in k_loaded:
+                k_loaded.add(k)
+                traces.append(tr)
+
+        if sample_cache is not None:
+            sample_cache.put(
+                self.abspath, self.format, self.substitutions, traces)
+
+        return traces
+
+    def load_data(self, force=False, traces=None):
+        '''Load waveform data from file.
+
+        :param force: reload even if data is already loaded
+        :param traces: traces as returned by :py:meth:`read_data`, e.g. read
+            in advance by a prefetcher (read from the file if ``None``)
+
+        :returns: ``True`` if the file contents have changed
+        '''
+
         file_changed = False
         if not self.data_loaded or force:
             logger.debug('loading data from file: %s' % self.abspath)
@@ -751,17 +1522,10 @@ class TracesFile(TracesGroup):
             def kgen(tr):
                 return (tr.mtime, tr.tmin, tr.tmax) + tr.nslc_id
 
-            traces_ = io.load(self.abspath, format=self.format, getdata=True,
-                              substitutions=self.substitutions)
+            if traces is None:
+                traces = self.read_data()
 
-            # prevent adding duplicate snippets from corrupt mseed files
-            k_loaded = set()
-            traces = []
-            for tr in traces_:
-                k = kgen(tr)
-                if k not in k_loaded:
-                    k_loaded.add(k)
-                    traces.append(tr)
+            k_loaded = set(kgen(tr) for tr in traces)
 
             k_current_d = dict((kgen(tr), tr) for tr in self.traces)
             k_current = set(k_current_d)
@@ -795,24 +1559,117 @@ class TracesFile(TracesGroup):
 
         return file_changed
 
+    def load_data_window(self, tmin, tmax):
+        '''Read data of a time window without loading the complete file.
+
+        Only available for Mini-SEED files with a record index (see
+        :py:func:`pyrocko.io.mseed.scan`). The returned traces are not
+        managed by this object, i.e. :py:meth:`use_data` and
+        :py:meth:`drop_data` do not apply to them. If a
+        :py:class:`SampleCache` is in use, the record groups overlapping the
+        window are decoded as a whole and looked up in, or stored to, the
+        cache individually.
+
+        :returns: list of :py:class:`pyrocko.trace.Trace` objects holding at
+            least the samples between ``tmin`` and ``tmax`` or ``None`` if
+            partial reading is not possible.
+        '''
+
+        if self.record_groups is None or self.deltatmax is None:
+            return None
+
+        try:
+            if os.stat(self.abspath)[8] != self.mtime:
+                return None
+
+            sample_cache = self.get_sample_cache()
+            if sample_cache is not None:
+                return self._load_data_window_cached(
+                    sample_cache,
+                    tmin - self.deltatmax,
+                    tmax + self.deltatmax)
+
+            traces = mseed.load_window(
+                self.abspath,
+                tmin - self.deltatmax,
+                tmax + self.deltatmax,
+                self.record_groups)
+
+        except (io.FileLoadError, OSError) as e:
+            logger.debug(
+                'partial read failed, falling back to full read: %s' % e)
+            return None
+
+        for tr in traces:
+            io.make_substitutions(tr, self.substitutions)
+            tr.set_mtime(self.mtime)
+            tr.file = self
+
+        return traces
+
+    def _load_data_window_cached(self, sample_cache, tmin, tmax):
+        traces = []
+        for group in mseed.select_record_groups(
+                self.record_groups, tmin, tmax):
+
+            gtraces = sample_cache.get(
+                self.abspath, self.format, self.substitutions, span=group)
+
+            if gtraces is None:
+                gtraces = mseed.load_record_group(self.abspath, group)
+                for tr in gtraces:
+                    io.make_substitutions(tr, self.substitutions)
+                    tr.set_mtime(self.mtime)
+
+                sample_cache.put(
+                    self.abspath, self.format, self.substitutions, gtraces,
+                    span=group)
+
+            traces.extend(gtraces)
+
+        # reconnect traces split at record group boundaries
+        traces.sort(key=lambda tr: tr.full_id)
+        traces = degapper(traces, maxgap=0, maxlap=0)
+        for tr in traces:
+            tr.file = self
+
+        return traces
+
     def use_data(self):
         if not self.data_loaded:
             raise Exception('Data not loaded')
+
+        if self.data_use_count == 0:
+            cache = self.get_data_cache()
+            if cache is not None:
+                cache.take(self)
+
         self.data_use_count += 1
 
     def drop_data(self):
         if self.data_loaded:
             if self.data_use_count == 1:
-                logger.debug('forgetting data of file: %s' % self.abspath)
-                for tr in self.traces:
-                    tr.drop_data()
-
-                self.data_loaded = False
+                cache = self.get_data_cache()
+                if cache is not None:
+                    cache.put(self)
+                else:
+                    self.forget_data()
 
             self.data_use_count -= 1
         else:
             self.data_use_count = 0
 
+    def forget_data(self):
+        logger.debug('forgetting data of file: %s' % self.abspath)
+        for tr in self.traces:
+            tr.drop_data()
+
+        self.data_loaded = False
+
+    def get_data_nbytes(self):
+        return sum(
+            tr.ydata.nbytes for tr in self.traces if tr.ydata is not None)
+
     def reload_if_modified(self):
         mtime = os.stat(self.abspath)[8]
         if mtime != self.mtime:
@@ -821,6 +1678,7 @@ class TracesFile(TracesGroup):
 
             self.mtime = mtime
             if self.data_loaded:
+                self.record_groups = None
                 self.load_data(force=True)
             else:
                 self.load_headers()
@@ -860,6 +1718,81 @@ class FilenameAttributeError(Exception):
     pass
 
 
+class Prefetcher(object):
+    '''Reads file data in a background thread.
+
+    Used by :py:meth:`Pile.chopper` to read the files needed for upcoming
+    windows while the current window is processed. The data read is held
+    back until it is requested with :py:meth:`get`, so that the bookkeeping
+    of the files is only ever modified by the consuming thread.
+    '''
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def request(self, file):
+        '''Schedule reading of the data of a file.'''
+
+        with self._lock:
+            if file in self._pending:
+                return
+
+            entry = [threading.Event(), None]
+            self._pending[file] = entry
+
+        self._queue.put((file, entry))
+
+    def get(self, file):
+        '''Get data read for a file.
+
+        Waits until reading has finished, if necessary.
+
+        :returns: traces as returned by :py:meth:`TracesFile.read_data` or
+            ``None`` if the file has not been requested or reading failed.
+        '''
+
+        with self._lock:
+            entry = self._pending.pop(file, None)
+
+        if entry is None:
+            return None
+
+        entry[0].wait()
+        return entry[1]
+
+    def close(self):
+        '''Discard pending requests and stop the background thread.'''
+
+        with self._lock:
+            self._closed = True
+            self._pending.clear()
+
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            file, entry = item
+            if not self._closed:
+                try:
+                    entry[1] = file.read_data()
+                except Exception as e:
+                    # error is reported when the consumer loads the file
+                    logger.debug('prefetching failed: %s' % e)
+
+            entry[0].set()
+
+
 class SubPile(TracesGroup):
     def __init__(self, parent):
         TracesGroup.__init__(self, parent)
@@ -944,14 +1877,127 @@ class SubPile(TracesGroup):
 
 
 class Pile(TracesGroup):
-    '''Waveform archive lookup, data loading and caching infrastructure.'''
+    '''Waveform archive lookup, data loading and caching infrastructure.
 
-    def __init__(self):
+    :param data_cache_nbytes: if given, the decoded data of files no longer
+        in use is kept in a :py:class:`DataCache` with this memory budget in
+        bytes, otherwise it is released immediately
+    :param sample_cache: :py:class:`SampleCache` object to keep decoded
+        samples on disk, or ``None``
+    '''
+
+    def __init__(self, data_cache_nbytes=None, sample_cache=None):
         TracesGroup.__init__(self, None)
         self.subpiles = {}
         self.open_files = {}
         self.listeners = []
         self.abspaths = set()
+        self.data_cache = None
+        if data_cache_nbytes is not None:
+            self.data_cache = DataCache(data_cache_nbytes)
+
+        self.sample_cache = sample_cache
+        self._watched = {}
+        self._dir_mtimes = {}
+        self._last_check = None
+
+    def get_data_cache(self):
+        return self.data_cache
+
+    def get_sample_cache(self):
+        return self.sample_cache
+
+    def set_sample_cache(self, sample_cache):
+        '''Set :py:class:`SampleCache` to be used, ``None`` to disable it.'''
+
+        self.sample_cache = sample_cache
+
+    def empty(self):
+        TracesGroup.empty(self)
+        self.by_nslc = {}
+
+    def add(self, content):
+        if isinstance(content, (trace.Trace, TracesGroup)):
+            content = [content]
+
+        for tr in self._iter_content_traces(content):
+            if tr.nslc_id not in self.by_nslc:
+                self.by_nslc[tr.nslc_id] = TraceIntervals()
+
+            self.by_nslc[tr.nslc_id].insert(tr)
+
+        TracesGroup.add(self, content)
+
+    def remove(self, content):
+        if isinstance(content, (trace.Trace, TracesGroup)):
+            content = [content]
+
+        for tr in self._iter_content_traces(content):
+            intervals = self.by_nslc[tr.nslc_id]
+            intervals.remove(tr)
+            if not intervals:
+                del self.by_nslc[tr.nslc_id]
+
+        TracesGroup.remove(self, content)
+
+    def _iter_content_traces(self, content):
+        for c in content:
+            if isinstance(c, TracesGroup):
+                for tr in c.by_tmin:
+                    yield tr
+
+            elif isinstance(c, trace.Trace):
+                yield c
+
+    def relevant(
+            self, tmin, tmax, group_selector=None, trace_selector=None,
+            codes=None):
+
+        '''Return list of :py:class:`pyrocko.trace.Trace` objects where given
+        arguments ``tmin`` and ``tmax`` match.
+
+        :param tmin: start time
+        :param tmax: end time
+        :param group_selector: filter callback taking :py:class:`TracesGroup`
+            objects
+        :param trace_selector: filter callback taking
+            :py:class:`pyrocko.trace.Trace` objects
+        :param codes: pattern or list of patterns of network, station,
+            location and channel codes, as understood by
+            :py:func:`pyrocko.util.match_nslc`; if given, only the traces of
+            the matching channels are looked up, using a per-channel index
+        '''
+
+        if codes is None:
+            return TracesGroup.relevant(
+                self, tmin, tmax, group_selector, trace_selector)
+
+        if not self.by_tmin or not self.is_relevant(
+                tmin, tmax, group_selector):
+
+            return []
+
+        traces = []
+        for nslc in util.match_nslcs(codes, list(self.by_nslc.keys())):
+            traces.extend(
+                tr for tr in self.by_nslc[nslc].overlapping(tmin, tmax)
+                if trace_selector is None or trace_selector(tr))
+
+        return traces
+
+    def set_data_cache_nbytes(self, nbytes):
+        '''Set memory budget of the data cache, ``None`` to disable it.'''
+
+        if nbytes is None:
+            if self.data_cache is not None:
+                self.data_cache.clear()
+                self.data_cache = None
+
+        elif self.data_cache is None:
+            self.data_cache = DataCache(nbytes)
+
+        else:
+            self.data_cache.set_nbytes_max(nbytes)
 
     def add_listener(self, obj):
         self.listeners.append(weakref.ref(obj))
@@ -968,12 +2014,30 @@ class Pile(TracesGroup):
             fileformat='mseed',
             cache=None,
             show_progress=True,
-            update_progress=None):
+            update_progress=None,
+            nworkers=1):
+
+        '''Load files into the pile.
+
+        :param filenames: list of paths to the files to be loaded
+        :param filename_attributes: regular expression with named groups
+            (``network``, ``station``, ``location``, ``channel``) to override
+            the trace codes with parts of the file paths
+        :param fileformat: format of the files
+        :param cache: :py:class:`TracesFileCache` object or ``None``
+        :param show_progress: show progress bar
+        :param update_progress: progress callback, called with label, current
+            and total count; a true return value aborts loading
+        :param nworkers: number of worker processes used to scan the file
+            headers (default: 1, scan sequentially; ``None`` uses one process
+            per CPU)
+        '''
 
         load = loader(
             filenames, fileformat, cache, filename_attributes,
             show_progress=show_progress,
-            update_progress=update_progress)
+            update_progress=update_progress,
+            nworkers=nworkers)
 
         self.add_files(load)
 
@@ -997,6 +2061,9 @@ class Pile(TracesGroup):
             self.abspaths.add(file.abspath)
 
     def remove_file(self, file):
+        if self.data_cache is not None:
+            self.data_cache.discard(file)
+
         subpile = file.get_parent()
         if subpile is not None:
             subpile.remove_file(file)
@@ -1015,6 +2082,9 @@ class Pile(TracesGroup):
         for subpile, files in subpile_files.items():
             subpile.remove_files(files)
             for file in files:
+                if self.data_cache is not None:
+                    self.data_cache.discard(file)
+
                 if file.abspath is not None:
                     self.abspaths.remove(file.abspath)
 
@@ -1032,23 +2102,152 @@ class Pile(TracesGroup):
     def get_deltats(self):
         return list(self.deltats.keys())
 
+    def coverage(self, tmin=None, tmax=None, codes=None, trace_selector=None):
+        '''Get time spans covered by data, per channel.
+
+        Computed from the trace meta-information only, no waveform data is
+        loaded. Traces which overlap or are separated by less than half a
+        sampling interval are merged into a single span.
+
+        :param tmin: start time (default uses start time of available data)
+        :param tmax: end time (default uses end time of available data)
+        :param codes: pattern or list of patterns of network, station,
+            location and channel codes (see
+            :py:func:`pyrocko.util.match_nslc`)
+        :param trace_selector: filter callback taking
+            :py:class:`pyrocko.trace.Trace` objects
+        :returns: dict with nslc tuples as keys and arrays of shape ``(n, 2)``
+            holding the start and end times of the covered spans, clipped to
+            ``tmin`` and ``tmax``, as values. The end time of a trace is taken
+            as the time of its last sample plus one sampling interval.
+            Channels without data in the time span are not included.
+        '''
+
+        if self.tmin is None:
+            return {}
+
+        if tmin is None:
+            tmin = self.tmin
+
+        if tmax is None:
+            tmax = self.tmax + self.deltatmax
+
+        if codes is None:
+            nslcs = list(self.by_nslc.keys())
+        else:
+            nslcs = util.match_nslcs(codes, list(self.by_nslc.keys()))
+
+        spans = {}
+        for nslc in nslcs:
+            traces = [
+                tr for tr in self.by_nslc[nslc].overlapping(tmin, tmax)
+                if (trace_selector is None or trace_selector(tr))]
+
+            if not traces:
+                continue
+
+            # already sorted by tmin
+            tmins = num.array([tr.tmin for tr in traces], dtype=num.float)
+            deltats = num.array([tr.deltat for tr in traces], dtype=num.float)
+            tmaxs = num.array([tr.tmax for tr in traces], dtype=num.float) \
+                + deltats
+
+            ends = num.maximum.accumulate(tmaxs)
+            new = num.ones(tmins.size, dtype=num.bool)
+            new[1:] = tmins[1:] > ends[:-1] + 0.5*deltats[1:]
+            istarts = num.nonzero(new)[0]
+            iends = num.concatenate((istarts[1:] - 1, [tmins.size - 1]))
+
+            span = num.empty((istarts.size, 2), dtype=num.float)
+            span[:, 0] = num.maximum(tmins[istarts], tmin)
+            span[:, 1] = num.minimum(ends[iends], tmax)
+            span = span[span[:, 0] < span[:, 1]]
+            if span.size:
+                spans[nslc] = span
+
+        return spans
+
+    def gaps(self, tmin=None, tmax=None, codes=None, trace_selector=None):
+        '''Get time spans not covered by data, per channel.
+
+        Complement of :py:meth:`coverage` within ``tmin`` and ``tmax``, with
+        the same arguments. Channels of the pile without any data in the
+        time span have a single gap spanning the complete time span.
+
+        :returns: dict with nslc tuples as keys and arrays of shape ``(n, 2)``
+            holding the start and end times of the gaps as values. Channels
+            without gaps are not included.
+        '''
+
+        if self.tmin is None:
+            return {}
+
+        if tmin is None:
+            tmin = self.tmin
+
+        if tmax is None:
+            tmax = self.tmax + self.deltatmax
+
+        covered = self.coverage(tmin, tmax, codes, trace_selector)
+
+        if codes is None:
+            nslcs = list(self.by_nslc.keys())
+        else:
+            nslcs = util.match_nslcs(codes, list(self.by_nslc.keys()))
+
+        gaps = {}
+        for nslc in nslcs:
+            span = covered.get(nslc, num.zeros((0, 2), dtype=num.float))
+            gap = num.empty((span.shape[0] + 1, 2), dtype=num.float)
+            gap[0, 0] = tmin
+            gap[1:, 0] = span[:, 1]
+            gap[:-1, 1] = span[:, 0]
+            gap[-1, 1] = tmax
+            gap = gap[gap[:, 0] < gap[:, 1]]
+            if gap.size:
+                gaps[nslc] = gap
+
+        return gaps
+
     def chop(
             self, tmin, tmax,
             group_selector=None,
             trace_selector=None,
             snap=(round, round),
             include_last=False,
-            load_data=True):
+            load_data=True,
+            partial_reads=False,
+            prefetcher=None,
+            codes=None):
 
         chopped = []
         used_files = set()
 
-        traces = self.relevant(tmin, tmax, group_selector, trace_selector)
+        traces = self.relevant(
+            tmin, tmax, group_selector, trace_selector, codes)
         if load_data:
             files_changed = False
+            window_traces = {}
             for tr in traces:
-                if tr.file and tr.file not in used_files:
-                    if tr.file.load_data():
+                if tr.file and tr.file not in used_files \
+                        and tr.file not in window_traces:
+
+                    if self.data_cache is not None:
+                        self.data_cache.lookup(tr.file)
+
+                    if partial_reads and isinstance(tr.file, TracesFile) \
+                            and not tr.file.data_loaded:
+
+                        wtraces = tr.file.load_data_window(tmin, tmax)
+                        if wtraces is not None:
+                            window_traces[tr.file] = wtraces
+                            continue
+
+                    prefetched = None
+                    if prefetcher is not None:
+                        prefetched = prefetcher.get(tr.file)
+
+                    if tr.file.load_data(traces=prefetched):
                         files_changed = True
 
                     if tr.file is not None:
@@ -1056,7 +2255,16 @@ class Pile(TracesGroup):
 
             if files_changed:
                 traces = self.relevant(
-                    tmin, tmax, group_selector, trace_selector)
+                    tmin, tmax, group_selector, trace_selector, codes)
+
+            if window_traces:
+                traces = [tr for tr in traces if tr.file not in window_traces]
+                for wtraces in window_traces.values():
+                    traces.extend(
+                        tr for tr in wtraces
+                        if tr.is_relevant(tmin, tmax, trace_selector) and (
+                            codes is None or
+                            util.match_nslc(codes, tr.nslc_id)))
 
         for tr in traces:
             if not load_data and tr.ydata is not None:
@@ -1116,7 +2324,8 @@ class Pile(TracesGroup):
             group_selector=None, trace_selector=None,
             want_incomplete=True, degap=True, maxgap=5, maxlap=None,
             keep_current_files_open=False, accessor_id=None,
-            snap=(round, round), include_last=False, load_data=True):
+            snap=(round, round), include_last=False, load_data=True,
+            partial_reads=False, prefetch=0, codes=None):
 
         '''
         Get iterator for shifting window wise data extraction from waveform
@@ -1152,6 +2361,18 @@ class Pile(TracesGroup):
         :param load_data: whether to load the waveform data. If set to
             ``False``, traces with no data samples, but with correct
             meta-information are returned
+        :param partial_reads: if ``True``, only the records overlapping the
+            requested window are read and decoded from Mini-SEED files which
+            are not already in memory; no data is kept in memory between
+            windows for these files
+        :param prefetch: number of upcoming windows for which the data files
+            are read in a background thread while the current window is
+            processed (default: 0, no prefetching)
+        :param codes: pattern or list of patterns of network, station,
+            location and channel codes (see
+            :py:func:`pyrocko.util.match_nslc`) to select traces by; unlike
+            ``trace_selector``, this uses a per-channel index, so that the
+            cost of a lookup depends on the number of selected channels only
         :returns: itererator yielding a list of :py:class:`pyrocko.trace.Trace`
             objects for every extracted time window
         '''
@@ -1178,44 +2399,194 @@ class Pile(TracesGroup):
 
         open_files = self.open_files[accessor_id]
 
-        iwin = 0
-        while True:
-            chopped = []
+        def window(iwin):
             wmin, wmax = tmin+iwin*tinc, min(tmin+(iwin+1)*tinc, tmax)
             eps = tinc*1e-6
             if wmin >= tmax-eps:
-                break
+                return None
 
-            chopped, used_files = self.chop(
-                wmin-tpad, wmax+tpad, group_selector, trace_selector, snap,
-                include_last, load_data)
+            return wmin, wmax
 
-            for file in used_files - open_files:
-                # increment datause counter on newly opened files
-                file.use_data()
+        prefetcher = None
+        if prefetch and load_data:
+            prefetcher = Prefetcher()
+
+        try:
+            iwin = 0
+            while True:
+                chopped = []
+                w = window(iwin)
+                if w is None:
+                    break
 
-            open_files.update(used_files)
+                wmin, wmax = w
 
-            processed = self._process_chopped(
-                chopped, degap, maxgap, maxlap, want_incomplete, wmax, wmin,
-                tpad)
+                chopped, used_files = self.chop(
+                    wmin-tpad, wmax+tpad, group_selector, trace_selector,
+                    snap, include_last, load_data, partial_reads, prefetcher,
+                    codes)
 
-            yield processed
+                for file in used_files - open_files:
+                    # increment datause counter on newly opened files
+                    file.use_data()
 
-            unused_files = open_files - used_files
+                open_files.update(used_files)
 
-            while unused_files:
-                file = unused_files.pop()
-                file.drop_data()
-                open_files.remove(file)
+                if prefetcher is not None:
+                    self._prefetch(
+                        prefetcher,
+                        [window(jwin)
+                         for jwin in range(iwin+1, iwin+1+prefetch)],
+                        tpad, group_selector, trace_selector, partial_reads,
+                        codes)
 
-            iwin += 1
+                processed = self._process_chopped(
+                    chopped, degap, maxgap, maxlap, want_incomplete, wmax,
+                    wmin, tpad)
+
+                yield processed
+
+                unused_files = open_files - used_files
+
+                while unused_files:
+                    file = unused_files.pop()
+                    file.drop_data()
+                    open_files.remove(file)
+
+                iwin += 1
+
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
 
         if not keep_current_files_open:
             while open_files:
                 file = open_files.pop()
                 file.drop_data()
 
+    def chopper_map(
+            self, func,
+            tmin=None, tmax=None, tinc=None, tpad=0.,
+            nprocs=None, nwindows_run=None, **kwargs):
+
+        '''
+        Apply a function to the windows of :py:meth:`chopper` in parallel.
+
+        Contiguous runs of windows are distributed over worker processes using
+        :py:func:`pyrocko.parimap.parimap`. Each worker reads the data files
+        it needs on its own, keeps them open for consecutive windows of a run,
+        and releases them as soon as they are no longer needed.
+
+        :param func: function taking a list of :py:class:`pyrocko.trace.Trace`
+            objects and returning a picklable result
+        :param tmin: start time (default uses start time of available data)
+        :param tmax: end time (default uses end time of available data)
+        :param tinc: time increment (window shift time) (default uses
+            ``tmax-tmin``)
+        :param tpad: padding time appended on either side of the data windows
+            (window overlap is ``2*tpad``)
+        :param nprocs: number of worker processes (default: one per CPU), if
+            set to 1, the windows are processed in the calling process
+        :param nwindows_run: number of consecutive windows processed by a
+            worker in one go (default: spread the windows evenly, in four runs
+            per worker process)
+        :param kwargs: further arguments passed to :py:meth:`chopper`, except
+            ``keep_current_files_open`` and ``accessor_id``
+        :returns: iterator yielding the results of ``func``, in window order
+        '''
+
+        for k in ('keep_current_files_open', 'accessor_id'):
+            if k in kwargs:
+                raise TypeError(
+                    'chopper_map() got an unsupported argument: %s' % k)
+
+        if nprocs == 1:
+            for traces in self.chopper(
+                    tmin=tmin, tmax=tmax, tinc=tinc, tpad=tpad, **kwargs):
+
+                yield func(traces)
+
+            return
+
+        if tmin is None:
+            if self.tmin is None:
+                logger.warning('Pile\'s tmin is not set - pile may be empty.')
+                return
+            tmin = self.tmin + tpad
+
+        if tmax is None:
+            if self.tmax is None:
+                logger.warning('Pile\'s tmax is not set - pile may be empty.')
+                return
+            tmax = self.tmax - tpad
+
+        if tinc is None:
+            tinc = tmax - tmin
+
+        windows = []
+        iwin = 0
+        while True:
+            wmin, wmax = tmin+iwin*tinc, min(tmin+(iwin+1)*tinc, tmax)
+            eps = tinc*1e-6
+            if wmin >= tmax-eps:
+                break
+
+            windows.append((wmin, wmax))
+            iwin += 1
+
+        if nwindows_run is None:
+            nruns = 4 * (nprocs or multiprocessing.cpu_count())
+            nwindows_run = max(1, int(math.ceil(float(len(windows)) / nruns)))
+
+        runs = [windows[i:i+nwindows_run]
+                for i in range(0, len(windows), nwindows_run)]
+
+        # the workers are forked, each of them gets its own copy of the pile
+        accessor_id = ('chopper_map', id(func))
+
+        def work(run):
+            results = []
+            for wmin, wmax in run:
+                # the generator must run to completion: after the window has
+                # been processed, it releases the files not used by it
+                wresults = [func(traces) for traces in self.chopper(
+                    tmin=wmin, tmax=wmax, tpad=tpad,
+                    keep_current_files_open=True,
+                    accessor_id=accessor_id,
+                    **kwargs)]
+
+                results.append(wresults[0] if wresults else func([]))
+
+            open_files = self.open_files.pop(accessor_id, set())
+            while open_files:
+                open_files.pop().drop_data()
+
+            return results
+
+        for results in parimap(work, runs, nprocs=nprocs):
+            for result in results:
+                yield result
+
+    def _prefetch(
+            self, prefetcher, windows, tpad, group_selector, trace_selector,
+            partial_reads, codes):
+
+        for w in windows:
+            if w is None:
+                break
+
+            wmin, wmax = w
+            for tr in self.relevant(
+                    wmin-tpad, wmax+tpad, group_selector, trace_selector,
+                    codes):
+
+                file = tr.file
+                if isinstance(file, TracesFile) and not file.data_loaded \
+                        and not (partial_reads and
+                                 file.record_groups is not None):
+
+                    prefetcher.request(file)
+
     def all(self, *args, **kwargs):
         '''
         Shortcut to aggregate :py:meth:`chopper` output into a single list.
@@ -1321,13 +2692,185 @@ class Pile(TracesGroup):
             for file in subpile.iter_files():
                 yield file
 
-    def reload_modified(self):
+    def watch(
+            self, dirnames,
+            regex=None,
+            filename_attributes=None,
+            fileformat='mseed',
+            cache=None,
+            show_progress=True):
+
+        '''Load files from directories and watch these for new files.
+
+        All files found recursively in the given directories, which are not
+        already in the pile, are loaded. Files created later in these
+        directories or in any of their subdirectories are loaded by
+        :py:meth:`reload_modified` in incremental mode.
+
+        :param dirnames: list of paths to the directories to be watched
+        :param regex: if given, only files with paths matching this regular
+            expression are considered
+        :param filename_attributes: see :py:meth:`load_files`
+        :param fileformat: format of the files
+        :param cache: :py:class:`TracesFileCache` object or ``None``
+        :param show_progress: show progress bar
+        '''
+
+        if isinstance(dirnames, str):
+            dirnames = [dirnames]
+
+        filenames = []
+        for dirname in dirnames:
+            dirpath = os.path.abspath(dirname)
+            self._watched[dirpath] = dict(
+                regex=regex,
+                filename_attributes=filename_attributes,
+                fileformat=fileformat,
+                cache=cache)
+
+            self._dir_mtimes[dirpath] = os.stat(dirpath).st_mtime
+            filenames.extend(self._list_new_files(dirpath, regex))
+
+        self.load_files(
+            filenames,
+            filename_attributes=filename_attributes,
+            fileformat=fileformat,
+            cache=cache,
+            show_progress=show_progress)
+
+    def _get_watch(self, dirpath):
+        for watched_dirpath, watch in self._watched.items():
+            if dirpath == watched_dirpath or dirpath.startswith(
+                    watched_dirpath + os.sep):
+
+                return watch
+
+        return None
+
+    def _list_new_files(self, dirpath, regex):
+        try:
+            entries = os.listdir(dirpath)
+        except OSError:
+            return []
+
+        filenames = []
+        for entry in sorted(entries):
+            path = os.path.join(dirpath, entry)
+            if os.path.isdir(path):
+                if path not in self._dir_mtimes:
+                    # directory mtime must be recorded before it is listed
+                    self._dir_mtimes[path] = os.stat(path).st_mtime
+                    filenames.extend(self._list_new_files(path, regex))
+
+            elif path not in self.abspaths and (
+                    regex is None or re.search(regex, path)):
+
+                filenames.append(path)
+
+        return filenames
+
+    def reload_modified(self, incremental=False, hot_period=3600.):
+        '''Reload files which have been modified since they were loaded.
+
+        :param incremental: if ``False``, the modification times of all files
+            in the pile are checked. If ``True``, only the files in
+            directories whose modification time has changed since the last
+            incremental check are checked, plus the files which have been
+            modified during the last ``hot_period`` seconds (appending to a
+            file does not change the modification time of its directory). In
+            this mode, files which have been deleted from changed directories
+            are removed from the pile, and new files in directories registered
+            with :py:meth:`watch` are loaded.
+        :param hot_period: see ``incremental``
+        :returns: ``True`` if the contents of the pile have changed
+        '''
+
+        if incremental:
+            return self._reload_modified_incremental(hot_period)
+
         modified = False
         for subpile in self.subpiles.values():
             modified |= subpile.reload_modified()
 
         return modified
 
+    def _reload_modified_incremental(self, hot_period):
+        now = time.time()
+        last_check = self._last_check
+        self._last_check = now
+
+        files_by_dir = {}
+        for file in self.iter_files():
+            if isinstance(file, TracesFile):
+                dirpath = os.path.dirname(file.abspath)
+                if dirpath not in files_by_dir:
+                    files_by_dir[dirpath] = []
+
+                files_by_dir[dirpath].append(file)
+
+        dirpaths = set(files_by_dir)
+        for dirpath in list(self._dir_mtimes.keys()):
+            if self._get_watch(dirpath) is not None:
+                dirpaths.add(dirpath)
+            elif dirpath not in dirpaths:
+                del self._dir_mtimes[dirpath]
+
+        changed = set()
+        for dirpath in dirpaths:
+            try:
+                mtime = os.stat(dirpath).st_mtime
+            except OSError:
+                self._dir_mtimes.pop(dirpath, None)
+                changed.add(dirpath)
+                continue
+
+            # modifications within the resolution of the directory mtime
+            # cannot be told apart from earlier ones
+            if last_check is None or mtime >= last_check - 2.0 \
+                    or mtime != self._dir_mtimes.get(dirpath):
+
+                self._dir_mtimes[dirpath] = mtime
+                changed.add(dirpath)
+
+        modified = False
+        deleted = []
+        for dirpath, files in files_by_dir.items():
+            for file in files:
+                if dirpath in changed or file.mtime is None \
+                        or file.mtime >= now - hot_period:
+
+                    try:
+                        modified |= file.reload_if_modified()
+                    except OSError:
+                        deleted.append(file)
+
+        if deleted:
+            logger.debug(
+                'removing %i deleted file%s from pile' % (
+                    len(deleted), util.plural_s(len(deleted))))
+
+            self.remove_files(deleted)
+            modified = True
+
+        for dirpath in sorted(changed):
+            watch = self._get_watch(dirpath)
+            if watch is None or dirpath not in self._dir_mtimes:
+                continue
+
+            filenames = self._list_new_files(dirpath, watch['regex'])
+            if filenames:
+                nfiles = len(self.abspaths)
+                self.load_files(
+                    filenames,
+                    filename_attributes=watch['filename_attributes'],
+                    fileformat=watch['fileformat'],
+                    cache=watch['cache'],
+                    show_progress=False)
+
+                modified |= len(self.abspaths) != nfiles
+
+        return modified
+
     def get_tmin(self):
         return self.tmin
 
@@ -1383,7 +2926,8 @@ class Pile(TracesGroup):
 def make_pile(
         paths=None, selector=None, regex=None,
         fileformat='mseed',
-        cachedirname=None, show_progress=True):
+        cachedirname=None, show_progress=True, nworkers=1,
+        cache_backend='pickle', tmin=None, tmax=None, codes=None):
 
     '''Create pile from given file and directory names.
 
@@ -1398,6 +2942,23 @@ def make_pile(
     :param cachedirname: loader cache is stored under this directory. It is
         created as neccessary.
     :param show_progress: show progress bar and other progress information
+    :param nworkers: number of worker processes used to scan the file headers
+        (default: 1, scan sequentially; ``None`` uses one process per CPU)
+    :param cache_backend: ``'pickle'`` (per-directory pickle files) or
+        ``'sqlite'`` (indexed database shareable between processes), see
+        :py:func:`get_cache`
+    :param tmin: if given, only files with traces ending at or after this
+        time are added to the pile
+    :param tmax: if given, only files with traces starting at or before this
+        time are added to the pile
+    :param codes: if given, only files with traces matching this pattern or
+        list of patterns (see :py:func:`pyrocko.util.match_nslc`) are added
+        to the pile
+
+    With ``cache_backend='sqlite'``, the selection by ``tmin``, ``tmax`` and
+    ``codes`` is answered by the database: header objects are only created
+    for the selected files and for files which are not yet in the cache or
+    have been modified.
     '''
 
     if show_progress_force_off:
@@ -1415,13 +2976,61 @@ def make_pile(
     fns = util.select_files(
         paths, selector, regex, show_progress=show_progress)
 
-    cache = get_cache(cachedirname)
+    cache = get_cache(cachedirname, backend=cache_backend)
+    fns = sorted(fns)
     p = Pile()
-    p.load_files(
-        sorted(fns),
-        cache=cache,
-        fileformat=fileformat,
-        show_progress=show_progress)
+
+    if tmin is None and tmax is None and codes is None:
+        p.load_files(
+            fns,
+            cache=cache,
+            fileformat=fileformat,
+            show_progress=show_progress,
+            nworkers=nworkers)
+
+    elif isinstance(cache, TracesFileDBCache):
+        abspaths = [os.path.abspath(fn) for fn in fns]
+        mtimes = cache.get_mtimes(abspaths)
+        outdated = []
+        for fn, abspath in zip(fns, abspaths):
+            try:
+                mtime = os.stat(fn)[8]
+            except OSError:
+                continue
+
+            cached_format, cached_mtime = mtimes.get(abspath, (None, None))
+            if cached_mtime != mtime or (
+                    cached_format != fileformat and fileformat != 'detect'):
+
+                outdated.append(fn)
+
+        if outdated:
+            # bring the database up to date, results are not kept
+            for _ in loader(
+                    outdated, fileformat, cache, None,
+                    show_progress=show_progress, nworkers=nworkers):
+                pass
+
+        selected = set(cache.get_paths(tmin, tmax, codes))
+        p.load_files(
+            [fn for (fn, abspath) in zip(fns, abspaths)
+             if abspath in selected],
+            cache=cache,
+            fileformat=fileformat,
+            show_progress=show_progress,
+            nworkers=nworkers)
+
+    else:
+        def selected(tr):
+            return (tmin is None or tr.tmax >= tmin) and \
+                (tmax is None or tr.tmin <= tmax) and \
+                (codes is None or util.match_nslc(codes, tr.nslc_id))
+
+        p.add_files(
+            tfile for tfile in loader(
+                fns, fileformat, cache, None,
+                show_progress=show_progress, nworkers=nworkers)
+            if any(selected(tr) for tr in tfile.traces))
 
     return p
 
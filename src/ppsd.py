@@ -0,0 +1,396 @@
+# http://pyrocko.org - GPLv3
+#
+# The Pyrocko Developers, 21st Century
+# ---|P------/S----------~Lg----------
+'''
+Probabilistic power spectral densities (PPSD) of continuous waveforms.
+
+Power spectral densities of consecutive time windows are averaged in
+logarithmically spaced frequency bands and accumulated in a histogram of
+frequency vs. power (McNamara and Buland, 2004). The histogram is updated in
+place, so that months of data can be processed with constant memory::
+
+    from pyrocko import pile, ppsd
+
+    p = pile.make_pile('data/')
+    acc = ppsd.PPSD(codes=('GE', 'STA', '', 'BHZ'), transfer_function=resp)
+    acc.add_pile(p)
+    acc.dump(filename='STA.BHZ.ppsd')
+
+Accumulators with the same setup, e.g. from processes working on different
+time spans, can be merged with :py:meth:`PPSD.add`.
+'''
+from __future__ import absolute_import, division
+
+import math
+import logging
+
+import numpy as num
+
+from . import trace
+from .guts import Object, Float, Int, Tuple, String, Timestamp, load_string
+from .guts_array import Array
+
+guts_prefix = 'pf'
+
+logger = logging.getLogger('pyrocko.ppsd')
+
+
+def _dump_or_none(obj):
+    if obj is None:
+        return None
+
+    # dump a reloaded copy, so that the values are in their regularized form
+    return load_string(obj.dump()).dump()
+
+
+class IncompatiblePPSD(Exception):
+    '''
+    Raised when merging accumulators with different setup.
+    '''
+    pass
+
+
+class PPSD(Object):
+    '''
+    Accumulator for probabilistic power spectral densities of one channel.
+
+    :param codes: network, station, location and channel codes of the
+        channel, used to select traces in :py:meth:`add_pile`
+    :param twindow: length of time windows in seconds, for each of which one
+        power spectral density is computed
+    :param tsegment: segment length of Welch's method in seconds (default:
+        ``twindow/4``)
+    :param overlap: overlap of Welch segments as fraction of ``tsegment``
+    :param fmin: center frequency of lowest frequency band in Hz
+    :param fmax: center frequency of highest frequency band in Hz
+    :param nfrequencies: number of logarithmically spaced frequency bands
+    :param bandwidth: width of the frequency bands in octaves
+    :param db_min: lower edge of the power histogram in dB
+    :param db_max: upper edge of the power histogram in dB
+    :param db_step: bin width of the power histogram in dB
+    :param transfer_function: :py:class:`pyrocko.trace.FrequencyResponse`
+        to be removed from the data
+
+    Band powers outside of the histogram range ``[db_min, db_max)`` are not
+    entered into the histogram but counted per frequency band in
+    :py:attr:`nbelow` and :py:attr:`nabove`. The statistics derived from the
+    histogram (:py:meth:`get_density`, :py:meth:`percentile`,
+    :py:meth:`mode`) refer to the values within the histogram range only.
+    '''
+
+    codes = Tuple.T(4, String.T(), default=('*', '*', '*', '*'))
+    twindow = Float.T(default=3600.)
+    tsegment = Float.T(optional=True)
+    overlap = Float.T(default=0.75)
+    fmin = Float.T(default=0.01)
+    fmax = Float.T(default=10.)
+    nfrequencies = Int.T(default=100)
+    bandwidth = Float.T(default=1.0)
+    db_min = Float.T(default=-200.)
+    db_max = Float.T(default=-50.)
+    db_step = Float.T(default=1.)
+    transfer_function = trace.FrequencyResponse.T(optional=True)
+
+    nwindows = Int.T(default=0)
+    tmin = Timestamp.T(optional=True)
+    tmax = Timestamp.T(optional=True)
+    counts = Array.T(
+        optional=True,
+        shape=(None, None),
+        dtype=num.int64,
+        serialize_as='npy')
+    nbelow = Array.T(
+        optional=True,
+        shape=(None,),
+        dtype=num.int64,
+        serialize_as='npy',
+        help='number of band powers below db_min, per frequency band')
+    nabove = Array.T(
+        optional=True,
+        shape=(None,),
+        dtype=num.int64,
+        serialize_as='npy',
+        help='number of band powers at or above db_max, per frequency '
+             'band')
+
+    def __init__(self, **kwargs):
+        Object.__init__(self, **kwargs)
+        self._band_indices = {}
+
+    @property
+    def frequencies(self):
+        '''
+        Center frequencies of the frequency bands.
+        '''
+
+        return num.exp(num.linspace(
+            math.log(self.fmin), math.log(self.fmax), self.nfrequencies))
+
+    @property
+    def ndb(self):
+        return int(round((self.db_max - self.db_min) / self.db_step))
+
+    @property
+    def db_edges(self):
+        '''
+        Edges of the power bins in dB.
+        '''
+
+        return self.db_min + num.arange(self.ndb+1) * self.db_step
+
+    @property
+    def db_centers(self):
+        '''
+        Centers of the power bins in dB.
+        '''
+
+        return self.db_min + (num.arange(self.ndb) + 0.5) * self.db_step
+
+    def get_tsegment(self):
+        if self.tsegment is None:
+            return self.twindow / 4.
+        else:
+            return self.tsegment
+
+    def get_counts(self):
+        '''
+        Get histogram array, shape ``(nfrequencies, ndb)``.
+        '''
+
+        if self.counts is None:
+            self.counts = num.zeros(
+                (self.nfrequencies, self.ndb), dtype=num.int64)
+
+        return self.counts
+
+    def get_out_of_range_counts(self):
+        '''
+        Get numbers of band powers outside of the histogram range.
+
+        :returns: tuple ``(nbelow, nabove)`` of arrays, shape
+            ``(nfrequencies,)``
+        '''
+
+        if self.nbelow is None:
+            self.nbelow = num.zeros(self.nfrequencies, dtype=num.int64)
+
+        if self.nabove is None:
+            self.nabove = num.zeros(self.nfrequencies, dtype=num.int64)
+
+        return self.nbelow, self.nabove
+
+    def _get_band_indices(self, freqs):
+        k = (freqs.size, freqs[1])
+        if k not in self._band_indices:
+            fcenter = self.frequencies
+            half = 2.0**(0.5*self.bandwidth)
+            i0 = num.searchsorted(freqs, fcenter / half, 'left')
+            i1 = num.searchsorted(freqs, fcenter * half, 'right')
+            self._band_indices[k] = (num.maximum(i0, 1), i1)
+
+        return self._band_indices[k]
+
+    def band_averages(self, freqs, values):
+        '''
+        Average power spectral density in the frequency bands.
+
+        :param freqs: equidistant frequencies, starting at zero
+        :param values: power spectral density at ``freqs``
+
+        :returns: averages, ``nan`` for bands containing no frequency
+        '''
+
+        i0, i1 = self._get_band_indices(freqs)
+        csum = num.zeros(values.size + 1)
+        csum[2:] = num.cumsum(values[1:])  # zero frequency excluded
+        n = i1 - i0
+        with num.errstate(divide='ignore', invalid='ignore'):
+            return num.where(n > 0, (csum[i1] - csum[i0]) / n, num.nan)
+
+    def add_trace(self, tr):
+        '''
+        Add power spectral density of a trace to the histogram.
+
+        The trace is processed as one time window, regardless of its length.
+
+        :param tr: :py:class:`pyrocko.trace.Trace` object
+
+        :returns: ``True`` if the trace has been added, ``False`` if it is
+            too short
+        '''
+
+        try:
+            freqs, values = tr.psd(
+                self.get_tsegment(), self.overlap, self.transfer_function)
+
+        except trace.TraceTooShort:
+            logger.warning(
+                'Trace %s.%s.%s.%s too short for PPSD, skipped.'
+                % tr.nslc_id)
+            return False
+
+        with num.errstate(divide='ignore', invalid='ignore'):
+            db = 10. * num.log10(self.band_averages(freqs, values))
+
+        ifreq = num.where(num.isfinite(db))[0]
+        idb = num.floor((db[ifreq] - self.db_min) / self.db_step).astype(
+            num.int64)
+
+        nbelow, nabove = self.get_out_of_range_counts()
+        below = idb < 0
+        above = idb >= self.ndb
+        if num.any(below) or num.any(above):
+            logger.debug(
+                'PPSD: %i band powers of trace %s.%s.%s.%s outside of '
+                'histogram range' % (
+                    (num.sum(below) + num.sum(above),) + tr.nslc_id))
+
+        # frequency indices are unique, so fancy indexing updates in place
+        nbelow[ifreq[below]] += 1
+        nabove[ifreq[above]] += 1
+        inside = num.logical_not(num.logical_or(below, above))
+        self.get_counts()[ifreq[inside], idb[inside]] += 1
+
+        self.nwindows += 1
+        self.tmin = tr.tmin if self.tmin is None else min(self.tmin, tr.tmin)
+        self.tmax = tr.tmax if self.tmax is None else max(self.tmax, tr.tmax)
+        return True
+
+    def add_pile(self, pile, tmin=None, tmax=None, **kwargs):
+        '''
+        Add complete time windows of a pile to the histogram.
+
+        Iterates over windows of length ``twindow`` using
+        :py:meth:`pyrocko.pile.Pile.chopper`, restricted to the channels
+        matching :py:attr:`codes`. Incomplete or gappy windows are skipped.
+
+        :param pile: :py:class:`pyrocko.pile.Pile` object
+        :param tmin: start time (default uses start time of available data)
+        :param tmax: end time (default uses end time of available data)
+        :param kwargs: further arguments passed to
+            :py:meth:`pyrocko.pile.Pile.chopper`
+
+        :returns: number of windows added
+        '''
+
+        kwargs.setdefault('want_incomplete', False)
+        kwargs.setdefault('keep_current_files_open', True)
+
+        nadded = 0
+        for traces in pile.chopper(
+                tmin=tmin, tmax=tmax, tinc=self.twindow,
+                codes='.'.join(self.codes), **kwargs):
+
+            for tr in traces:
+                if self.add_trace(tr):
+                    nadded += 1
+
+        return nadded
+
+    def check_compatible(self, other):
+        '''
+        Check if another accumulator can be merged into this one.
+
+        Raises :py:exc:`IncompatiblePPSD` if the channel codes, the response
+        or the setup of the histogram differ.
+        '''
+
+        if tuple(self.codes) != tuple(other.codes):
+            raise IncompatiblePPSD(
+                'PPSD channel codes differ: %s != %s' % (
+                    '.'.join(self.codes), '.'.join(other.codes)))
+
+        if _dump_or_none(self.transfer_function) \
+                != _dump_or_none(other.transfer_function):
+
+            raise IncompatiblePPSD('PPSD transfer functions differ')
+
+        for k in ('twindow', 'overlap', 'fmin', 'fmax', 'nfrequencies',
+                  'bandwidth', 'db_min', 'db_max', 'db_step'):
+
+            if getattr(self, k) != getattr(other, k):
+                raise IncompatiblePPSD(
+                    'PPSD setup differs in attribute "%s": %s != %s'
+                    % (k, getattr(self, k), getattr(other, k)))
+
+        if self.get_tsegment() != other.get_tsegment():
+            raise IncompatiblePPSD(
+                'PPSD setup differs in attribute "tsegment"')
+
+    def add(self, other):
+        '''
+        Merge histogram of another accumulator into this one.
+
+        :param other: :py:class:`PPSD` object with the same codes, transfer
+            function and setup
+
+        Raises :py:exc:`IncompatiblePPSD` if the setups differ.
+        '''
+
+        self.check_compatible(other)
+        if other.counts is not None:
+            self.get_counts()[:, :] += other.counts
+
+        nbelow, nabove = self.get_out_of_range_counts()
+        if other.nbelow is not None:
+            nbelow += other.nbelow
+
+        if other.nabove is not None:
+            nabove += other.nabove
+
+        self.nwindows += other.nwindows
+        for k, f in (('tmin', min), ('tmax', max)):
+            a, b = getattr(self, k), getattr(other, k)
+            if a is None or b is None:
+                setattr(self, k, a if b is None else b)
+            else:
+                setattr(self, k, f(a, b))
+
+    def get_density(self):
+        '''
+        Get histogram normalized to unit sum in each frequency band.
+        '''
+
+        counts = self.get_counts().astype(num.float64)
+        total = num.sum(counts, axis=1)[:, num.newaxis]
+        with num.errstate(divide='ignore', invalid='ignore'):
+            return counts / total
+
+    def percentile(self, p):
+        '''
+        Get power percentile in each frequency band.
+
+        :param p: percentile (0-100)
+
+        :returns: power in dB at bin centers, ``nan`` where no data has been
+            accumulated
+        '''
+
+        counts = self.get_counts()
+        cumulative = num.cumsum(counts, axis=1)
+        total = cumulative[:, -1]
+        idb = num.argmax(
+            cumulative >= (p / 100.) * total[:, num.newaxis], axis=1)
+
+        return num.where(total > 0, self.db_centers[idb], num.nan)
+
+    def mode(self):
+        '''
+        Get most frequent power in each frequency band.
+
+        :returns: power in dB at bin centers, ``nan`` where no data has been
+            accumulated
+        '''
+
+        counts = self.get_counts()
+        return num.where(
+            num.sum(counts, axis=1) > 0,
+            self.db_centers[num.argmax(counts, axis=1)],
+            num.nan)
+
+
+__all__ = '''
+IncompatiblePPSD
+PPSD
+'''.split()
@@ -10,14 +10,26 @@ from builtins import map
 from builtins import range
 from builtins import str as newstr
 
+import os
 import time
 import math
 import copy
 import logging
+import threading
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 import numpy as num
 from scipy import signal
 
+try:
+    # scipy >= 1.4, transforms single precision data in single precision
+    from scipy import fft as scipy_fft
+except ImportError:
+    scipy_fft = None
+
 from . import util, evalresp, orthodrome, pchain, model
 from .util import reuse, hpfloat, UnavailableDecimation
 from .guts import Object, Float, Int, String, Complex, Tuple, List, \
@@ -63,7 +75,7 @@ class Trace(object):
     silently truncated when the trace is stored
     '''
 
-    cached_frequencies = {}
+    cached_frequencies = util.LRUCache(64)
 
     def __init__(self, network='', station='STA', location='', channel='',
                  tmin=0., tmax=None, deltat=1., ydata=None, mtime=None,
@@ -596,7 +608,7 @@ class Trace(object):
         return finals
 
     def downsample_to(self, deltat, snap=False, allow_upsample_max=1,
-                      initials=None, demean=False):
+                      initials=None, demean=False, allow_polyphase=False):
 
         '''
         Downsample to given sampling rate.
@@ -608,7 +620,9 @@ class Trace(object):
         number of possible downsampling ratios.
 
         If the requested ratio is not supported, an exception of type
-        :py:exc:`pyrocko.util.UnavailableDecimation` is raised.
+        :py:exc:`pyrocko.util.UnavailableDecimation` is raised, unless
+        ``allow_polyphase`` is ``True``, in which case
+        :py:meth:`Trace.resample_poly` is used.
         '''
 
         ratio = deltat/self.deltat
@@ -624,6 +638,10 @@ class Trace(object):
                 break
 
         if not ok:
+            if allow_polyphase:
+                return self.resample_poly(
+                    deltat, snap=snap, initials=initials, demean=demean)
+
             raise util.UnavailableDecimation('ratio = %g' % ratio)
 
         if upsratio > 1:
@@ -654,13 +672,21 @@ class Trace(object):
         if initials is not None:
             return finals
 
-    def resample(self, deltat):
+    def resample(self, deltat, method='fft'):
         '''
         Resample to given sampling rate ``deltat``.
 
-        Resampling is performed in the frequency domain.
+        :param method: ``'fft'`` to resample in the frequency domain, or
+            ``'polyphase'`` to use :py:meth:`Trace.resample_poly`
         '''
 
+        if method == 'polyphase':
+            self.resample_poly(deltat)
+            return
+
+        elif method != 'fft':
+            raise ValueError('unknown resampling method: %s' % method)
+
         ndata = self.ydata.size
         ntrans = nextpow2(ndata)
         fntrans2 = ntrans * self.deltat/deltat
@@ -685,6 +711,78 @@ class Trace(object):
         self.deltat = deltat2
         self.set_ydata(data2)
 
+    def resample_poly(self, deltat, snap=False, initials=None, demean=False,
+                      max_denominator=1000):
+
+        '''
+        Resample to given sampling rate with a rational polyphase filter.
+
+        The ratio of the sampling intervals is expressed as a fraction
+        ``down/up`` and the trace is resampled with
+        :py:class:`pyrocko.util.PolyphaseResampler`. Any ratio is supported
+        for which the denominator does not exceed ``max_denominator``,
+        otherwise :py:exc:`pyrocko.util.UnavailableDecimation` is raised.
+
+        :param deltat: new sampling interval
+        :param snap: whether to put the new sampling instances closest to
+            multiples of the sampling rate.
+        :param initials: ``None``, ``True``, or the state of the resampler
+            obtained from a previous run on the preceding data. In the latter
+            two cases, the state is returned instead of ``None``. Here, the
+            output lags behind the input by half the filter length; the
+            missing samples are returned with the next chunk of data.
+        :param demean: whether to demean the signal before filtering.
+        '''
+
+        from fractions import Fraction
+
+        ratio = Fraction(deltat / self.deltat).limit_denominator(
+            max_denominator)
+
+        if ratio == 0 or abs(float(ratio) * self.deltat - deltat) \
+                > deltat * 1e-6:
+
+            raise util.UnavailableDecimation(
+                'ratio = %g' % (deltat / self.deltat))
+
+        down, up = ratio.numerator, ratio.denominator
+        deltat_up = self.deltat / up
+
+        if initials is None or initials is True:
+            ioffset = 0
+            if snap:
+                ioffset = int(round(
+                    (math.ceil(self.tmin / deltat) * deltat - self.tmin)
+                    / deltat_up)) % down
+
+            state = util.PolyphaseResampler(up, down, ioffset=ioffset)
+            state.tmin = self.tmin
+            state.deltat = self.deltat
+        else:
+            state = initials
+            if (state.up, state.down) != (up, down) \
+                    or abs(state.deltat - self.deltat) > self.deltat * 1e-6:
+
+                raise ValueError(
+                    'resample_poly: initials do not match sampling rates')
+
+        data = self.ydata.astype(num.float64)
+        if demean:
+            data -= num.mean(data)
+
+        m_first = state.m_next
+        ydata = state.process(data)
+        if initials is None:
+            ydata = num.concatenate((ydata, state.flush()))
+
+        self.drop_growbuffer()
+        self.tmin = state.tmin + (state.ioffset + m_first*down) * deltat_up
+        self.deltat = reuse(deltat_up * down)
+        self.set_ydata(ydata)
+
+        if initials is not None:
+            return state
+
     def resample_simple(self, deltat):
         tyear = 3600*24*365.
 
@@ -797,13 +895,16 @@ class Trace(object):
                 raise AboveNyquist(message)
 
     def lowpass(self, order, corner, nyquist_warn=True,
-                nyquist_exception=False, demean=True):
+                nyquist_exception=False, demean=True, dtype=None):
 
         '''
         Apply Butterworth lowpass to the trace.
 
         :param order: order of the filter
         :param corner: corner frequency of the filter
+        :param dtype: floating point type of the output, ``numpy.float32``
+            or ``numpy.float64`` (default: see
+            :py:func:`set_processing_dtype`)
 
         Mean is removed before filtering.
         '''
@@ -821,20 +922,23 @@ class Trace(object):
                 'scipy.signal.butter(). You may need to downsample the '
                 'signal before filtering.')
 
-        data = self.ydata.astype(num.float64)
+        data = self.ydata.astype(_processing_dtype(dtype))
         if demean:
-            data -= num.mean(data)
+            data -= num.mean(data, dtype=num.float64)
         self.drop_growbuffer()
-        self.ydata = signal.lfilter(b, a, data)
+        self.ydata = _lfilter(b, a, data)
 
     def highpass(self, order, corner, nyquist_warn=True,
-                 nyquist_exception=False, demean=True):
+                 nyquist_exception=False, demean=True, dtype=None):
 
         '''
         Apply butterworth highpass to the trace.
 
         :param order: order of the filter
         :param corner: corner frequency of the filter
+        :param dtype: floating point type of the output, ``numpy.float32``
+            or ``numpy.float64`` (default: see
+            :py:func:`set_processing_dtype`)
 
         Mean is removed before filtering.
         '''
@@ -846,24 +950,28 @@ class Trace(object):
         (b, a) = _get_cached_filter_coefs(
             order, [corner*2.0*self.deltat], btype='high')
 
-        data = self.ydata.astype(num.float64)
+        data = self.ydata.astype(_processing_dtype(dtype))
         if len(a) != order+1 or len(b) != order+1:
             logger.warning(
                 'Erroneous filter coefficients returned by '
                 'scipy.signal.butter(). You may need to downsample the '
                 'signal before filtering.')
         if demean:
-            data -= num.mean(data)
+            data -= num.mean(data, dtype=num.float64)
         self.drop_growbuffer()
-        self.ydata = signal.lfilter(b, a, data)
+        self.ydata = _lfilter(b, a, data)
 
-    def bandpass(self, order, corner_hp, corner_lp, demean=True):
+    def bandpass(self, order, corner_hp, corner_lp, demean=True,
+                 dtype=None):
         '''
         Apply butterworth bandpass to the trace.
 
         :param order: order of the filter
         :param corner_hp: lower corner frequency of the filter
         :param corner_lp: upper corner frequency of the filter
+        :param dtype: floating point type of the output, ``numpy.float32``
+            or ``numpy.float64`` (default: see
+            :py:func:`set_processing_dtype`)
 
         Mean is removed before filtering.
         '''
@@ -874,21 +982,33 @@ class Trace(object):
             order,
             [corner*2.0*self.deltat for corner in (corner_hp, corner_lp)],
             btype='band')
-        data = self.ydata.astype(num.float64)
+        data = self.ydata.astype(_processing_dtype(dtype))
         if demean:
-            data -= num.mean(data)
+            data -= num.mean(data, dtype=num.float64)
         self.drop_growbuffer()
-        self.ydata = signal.lfilter(b, a, data)
+        self.ydata = _lfilter(b, a, data)
+
+    def abshilbert(self, nblock=None, noverlap=None):
+        '''
+        Replace data by absolute value of the analytic signal.
+
+        See :py:meth:`envelope` for the meaning of ``nblock`` and
+        ``noverlap``.
+        '''
 
-    def abshilbert(self):
         self.drop_growbuffer()
-        self.ydata = num.abs(hilbert(self.ydata))
+        self.ydata = _hilbert_envelope(self.ydata, nblock, noverlap)
 
-    def envelope(self, inplace=True):
+    def envelope(self, inplace=True, nblock=None, noverlap=None):
         '''
         Calculate the envelope of the trace.
 
         :param inplace: calculate envelope in place
+        :param nblock: if given, the Hilbert transform is computed in
+            overlapping blocks of this number of samples, to limit memory use
+            and FFT size for long traces
+        :param noverlap: number of samples blocks are extended on either side,
+            to suppress block edge effects (default: ``nblock // 4``)
 
         The calculation follows:
 
@@ -897,17 +1017,22 @@ class Trace(object):
             Y' = \\sqrt{Y^2+H(Y)^2}
 
         where H is the Hilbert-Transform of the signal Y.
+
+        The block-wise Hilbert transform is an approximation, because the
+        Hilbert transform is not local. Its error decreases with increasing
+        ``noverlap`` and is negligible, when ``noverlap`` spans many periods
+        of the lowest frequency present in the signal.
         '''
 
         if inplace:
             self.drop_growbuffer()
-            self.ydata = num.sqrt(self.ydata**2 + hilbert(self.ydata)**2)
+            self.ydata = _hilbert_envelope(self.ydata, nblock, noverlap)
         else:
             tr = self.copy(data=False)
-            tr.ydata = num.sqrt(self.ydata**2 + hilbert(self.ydata)**2)
+            tr.ydata = _hilbert_envelope(self.ydata, nblock, noverlap)
             return tr
 
-    def taper(self, taperer, inplace=True, chop=False):
+    def taper(self, taperer, inplace=True, chop=False, dtype=None):
         '''
         Apply a :py:class:`Taper` to the trace.
 
@@ -915,6 +1040,10 @@ class Trace(object):
         :param inplace: apply taper inplace
         :param chop: if ``True``: exclude tapered parts from the resulting
             trace
+        :param dtype: floating point type to convert the data to,
+            ``numpy.float32`` or ``numpy.float64``. By default, floating point
+            data is tapered as is and integer data is converted to the type
+            set with :py:func:`set_processing_dtype`.
         '''
 
         if not inplace:
@@ -927,6 +1056,11 @@ class Trace(object):
             tr.shift(i*tr.deltat)
             tr.set_ydata(tr.ydata[i:i+n])
 
+        if dtype is not None \
+                or not num.issubdtype(tr.ydata.dtype, num.floating):
+
+            tr.set_ydata(tr.ydata.astype(_processing_dtype(dtype)))
+
         taperer(tr.ydata, tr.tmin, tr.deltat)
 
         if not inplace:
@@ -1035,28 +1169,34 @@ class Trace(object):
 
     def _get_cached_freqs(self, nf, deltaf):
         ck = (nf, deltaf)
-        if ck not in Trace.cached_frequencies:
-            Trace.cached_frequencies[ck] = deltaf * num.arange(
-                nf, dtype=num.float)
+        freqs = Trace.cached_frequencies.get(ck)
+        if freqs is None:
+            freqs = deltaf * num.arange(nf, dtype=num.float)
+            freqs.flags.writeable = False
+            Trace.cached_frequencies.put(ck, freqs)
 
-        return Trace.cached_frequencies[ck]
+        return freqs
 
-    def bandpass_fft(self, corner_hp, corner_lp):
+    def bandpass_fft(self, corner_hp, corner_lp, dtype=None):
         '''
         Apply boxcar bandbpass to trace (in spectral domain).
+
+        :param dtype: floating point type of the output, ``numpy.float32``
+            or ``numpy.float64`` (default: see
+            :py:func:`set_processing_dtype`)
         '''
 
+        dtype = _processing_dtype(dtype)
         n = len(self.ydata)
-        n2 = nextpow2(n)
-        data = num.zeros(n2, dtype=num.float64)
-        data[:n] = self.ydata
-        fdata = num.fft.rfft(data)
+        n2 = nextfftlen(n)
+        data = _get_fft_work_buffer(n2, self.ydata, dtype)
+        fdata = _rfft(data)
         freqs = self._get_cached_freqs(len(fdata), 1./(self.deltat*n2))
         fdata[0] = 0.0
         fdata *= num.logical_and(corner_hp < freqs, freqs < corner_lp)
-        data = num.fft.irfft(fdata)
+        data = _irfft(fdata, n2)
         self.drop_growbuffer()
-        self.ydata = data[:n]
+        self.ydata = data[:n].astype(dtype, copy=False)
 
     def shift(self, tshift):
         '''
@@ -1252,60 +1392,14 @@ class Trace(object):
         tuples (time, value) for each detected peak is returned. The
         ``deadtime`` argument turns on a special deadtime duration detection
         algorithm useful in combination with recursive STA/LTA filters.
-        '''
-
-        y = self.ydata
-        above = num.where(y > threshold, 1, 0)
-        deriv = num.zeros(y.size, dtype=num.int8)
-        deriv[1:] = above[1:]-above[:-1]
-        itrig_positions = num.nonzero(deriv > 0)[0]
-        tpeaks = []
-        apeaks = []
-        tzeros = []
-        tzero = self.tmin
-
-        for itrig_pos in itrig_positions:
-            ibeg = itrig_pos
-            iend = min(
-                len(self.ydata),
-                itrig_pos + int(math.ceil(tsearch/self.deltat)))
-            ipeak = num.argmax(y[ibeg:iend])
-            tpeak = self.tmin + (ipeak+ibeg)*self.deltat
-            apeak = y[ibeg+ipeak]
-
-            if tpeak < tzero:
-                continue
 
-            if deadtime:
-                ibeg = itrig_pos
-                iblock = 0
-                nblock = nblock_duration_detection
-                totalsum = 0.
-                while True:
-                    if ibeg+iblock*nblock >= len(y):
-                        tzero = self.tmin + (len(y)-1) * self.deltat
-                        break
-
-                    logy = num.log(
-                        y[ibeg+iblock*nblock:ibeg+(iblock+1)*nblock])
-                    logy[0] += totalsum
-                    ysum = num.cumsum(logy)
-                    totalsum = ysum[-1]
-                    below = num.where(ysum <= 0., 1, 0)
-                    deriv = num.zeros(ysum.size, dtype=num.int8)
-                    deriv[1:] = below[1:]-below[:-1]
-                    izero_positions = num.nonzero(deriv > 0)[0] + iblock*nblock
-                    if len(izero_positions) > 0:
-                        tzero = self.tmin + self.deltat * (
-                            ibeg + izero_positions[0])
-                        break
-                    iblock += 1
-            else:
-                tzero = ibeg*self.deltat + self.tmin + tsearch
+        See :py:class:`StreamPeaks` to detect peaks in long continuous data,
+        which is split into successive chunks.
+        '''
 
-            tpeaks.append(tpeak)
-            apeaks.append(apeak)
-            tzeros.append(tzero)
+        tpeaks, apeaks, tzeros, _, _ = _peaks(
+            self.ydata, self.tmin, self.deltat, threshold, tsearch, deadtime,
+            nblock_duration_detection, self.tmin, True)
 
         if deadtime:
             return tpeaks, apeaks, tzeros
@@ -1363,7 +1457,9 @@ class Trace(object):
                  freqlimits=None,
                  transfer_function=None,
                  cut_off_fading=True,
-                 invert=False):
+                 invert=False,
+                 nblock=None,
+                 dtype=None):
 
         '''
         Return new trace with transfer function applied (convolution).
@@ -1377,6 +1473,15 @@ class Trace(object):
         :param cut_off_fading: whether to cut off rise/fall interval in output
             trace.
         :param invert: set to True to do a deconvolution
+        :param nblock: if given, the trace is processed in segments of this
+            number of samples (overlap-add), instead of transforming it as a
+            whole. This bounds the memory needed for long traces. The impulse
+            response of the tapered transfer function is truncated to
+            ``nblock`` samples, so the block length should be long compared to
+            it, e.g. several times ``1/freqlimits[0]``.
+        :param dtype: floating point type of the output, ``numpy.float32``
+            or ``numpy.float64`` (default: see
+            :py:func:`set_processing_dtype`)
         '''
 
         if transfer_function is None:
@@ -1388,24 +1493,38 @@ class Trace(object):
                 'trace length = %g, fading length = %g'
                 % (self.nslc_id + (self.tmax-self.tmin, tfade)))
 
+        dtype = _processing_dtype(dtype)
         ndata = self.ydata.size
-        ntrans = nextpow2(ndata*1.2)
-        coefs = self._get_tapered_coefs(
-            ntrans, freqlimits, transfer_function, invert=invert)
+        ntrans = nextfftlen(ndata*1.2)
 
-        data = self.ydata
-        data_pad = num.zeros(ntrans, dtype=num.float)
-        data_pad[:ndata] = data - data.mean()
-        if tfade != 0.0:
-            data_pad[:ndata] *= costaper(
-                0., tfade, self.deltat*(ndata-1)-tfade, self.deltat*ndata,
-                ndata, self.deltat)
+        if nblock is not None and nblock + nblock % 2 < ntrans:
+            data = self.ydata.astype(dtype)
+            data -= self.ydata.mean()
+            if tfade != 0.0:
+                _apply_fade(data, tfade, self.deltat)
+
+            coefs = self._get_tapered_coefs(
+                nblock + nblock % 2, freqlimits, transfer_function,
+                invert=invert)
+
+            ddata = _overlap_add(data, coefs)
+
+        else:
+            coefs = self._get_tapered_coefs(
+                ntrans, freqlimits, transfer_function, invert=invert)
+
+            data = self.ydata
+            data_pad = _get_fft_work_buffer(ntrans, data, dtype)
+            data_pad[:ndata] -= data.mean()
+            if tfade != 0.0:
+                _apply_fade(data_pad[:ndata], tfade, self.deltat)
+
+            fdata = _rfft(data_pad)
+            fdata *= coefs
+            ddata = _irfft(fdata, ntrans)
 
-        fdata = num.fft.rfft(data_pad)
-        fdata *= coefs
-        ddata = num.fft.irfft(fdata)
         output = self.copy()
-        output.ydata = ddata[:ndata]
+        output.ydata = ddata[:ndata].astype(dtype, copy=False)
         if cut_off_fading and tfade != 0.0:
             try:
                 output.chop(output.tmin+tfade, output.tmax-tfade, inplace=True)
@@ -1461,7 +1580,10 @@ class Trace(object):
                 processed = processed.envelope(inplace=False)
 
             elif setup.domain == 'absolute':
-                processed.set_ydata(num.abs(processed.get_ydata()))
+                # not in place, processed may be a cached result
+                data = num.abs(processed.get_ydata())
+                processed = processed.copy(data=False)
+                processed.set_ydata(data)
 
             return processed.get_ydata(), processed
 
@@ -1527,15 +1649,77 @@ class Trace(object):
         if tfade is None:
             ydata = self.ydata
         else:
-            ydata = self.ydata * costaper(
-                0., tfade, self.deltat*(ndata-1)-tfade, self.deltat*ndata,
-                ndata, self.deltat)
+            ydata = self.ydata.astype(num.float64)
+            _apply_fade(ydata, tfade, self.deltat)
 
         fydata = num.fft.rfft(ydata, ntrans)
         df = 1./(ntrans*self.deltat)
         fxdata = num.arange(len(fydata))*df
         return fxdata, fydata
 
+    def psd(self, tsegment, overlap=0.5, transfer_function=None,
+            nchunk=64):
+        '''
+        Estimate power spectral density of the trace (Welch's method).
+
+        The trace is cut into overlapping segments, each segment is demeaned
+        and multiplied with a Hann window and the squared magnitudes of
+        their spectra are averaged. Segments are transformed in chunks, so
+        that memory use does not grow with the length of the trace.
+
+        :param tsegment: segment length in seconds
+        :param overlap: overlap of consecutive segments, as fraction of the
+            segment length
+        :param transfer_function: :py:class:`FrequencyResponse` of the
+            recording system; if given, it is removed from the estimate by
+            division with its squared magnitude
+        :param nchunk: number of segments transformed at once
+
+        :returns: a tuple with (frequencies, values), the one-sided power
+            spectral density in [unit**2/Hz]
+        '''
+
+        ndata = self.ydata.size
+        nseg = int(round(tsegment / self.deltat))
+        if nseg < 2 or ndata < nseg:
+            raise TraceTooShort(
+                'Trace %s.%s.%s.%s too short for segment length setting. '
+                'trace length = %g, segment length = %g'
+                % (self.nslc_id + (self.tmax-self.tmin, tsegment)))
+
+        nstep = max(1, int(round(nseg * (1.0 - overlap))))
+        nwin = (ndata - nseg) // nstep + 1
+
+        ydata = num.ascontiguousarray(self.ydata)
+        segments = num.lib.stride_tricks.as_strided(
+            ydata,
+            shape=(nwin, nseg),
+            strides=(ydata.strides[0]*nstep, ydata.strides[0]))
+
+        window = 0.5 - 0.5*num.cos(2.*num.pi*num.arange(nseg)/nseg)
+
+        values = num.zeros(nseg//2+1)
+        for ibeg in range(0, nwin, nchunk):
+            chunk = segments[ibeg:ibeg+nchunk].astype(num.float64)
+            chunk -= num.mean(chunk, axis=1)[:, num.newaxis]
+            chunk *= window[num.newaxis, :]
+            spec = num.fft.rfft(chunk, axis=1)
+            values += num.sum(spec.real**2 + spec.imag**2, axis=0)
+
+        values *= self.deltat / (nwin * num.sum(window**2))
+        if nseg % 2 == 0:
+            values[1:-1] *= 2.
+        else:
+            values[1:] *= 2.
+
+        freqs = num.arange(values.size) / (nseg*self.deltat)
+
+        if transfer_function is not None:
+            with num.errstate(divide='ignore', invalid='ignore'):
+                values /= num.abs(transfer_function.evaluate(freqs))**2
+
+        return freqs, values
+
     def multi_filter(self, filter_freqs, bandwidth):
 
         class Gauss(FrequencyResponse):
@@ -1580,27 +1764,8 @@ class Trace(object):
     def _get_tapered_coefs(
             self, ntrans, freqlimits, transfer_function, invert=False):
 
-        deltaf = 1./(self.deltat*ntrans)
-        nfreqs = ntrans//2 + 1
-        transfer = num.ones(nfreqs, dtype=num.complex)
-        hi = snapper(nfreqs, deltaf)
-        if freqlimits is not None:
-            a, b, c, d = freqlimits
-            freqs = num.arange(hi(d)-hi(a), dtype=num.float)*deltaf \
-                + hi(a)*deltaf
-
-            if invert:
-                transfer[hi(a):hi(d)] = 1.0 / transfer_function.evaluate(freqs)
-            else:
-                transfer[hi(a):hi(d)] = transfer_function.evaluate(freqs)
-
-            tapered_transfer = costaper(a, b, c, d, nfreqs, deltaf)*transfer
-        else:
-            freqs = num.arange(nfreqs) * deltaf
-            tapered_transfer = transfer_function.evaluate(freqs)
-
-        tapered_transfer[0] = 0.0  # don't introduce static offsets
-        return tapered_transfer
+        return _get_tapered_coefs(
+            self.deltat, ntrans, freqlimits, transfer_function, invert)
 
     def fill_template(self, template, **additional):
         '''
@@ -1741,6 +1906,354 @@ class ResamplingFailed(Exception):
     pass
 
 
+class TraceArray(object):
+
+    '''
+    Create new multi-channel trace array.
+
+    A ``TraceArray`` holds the data of several equally sampled, time-aligned
+    channels in a single contiguous 2D NumPy array with one row per channel.
+    Its processing methods work on all channels at once, so that filter
+    design and other per-call overhead is paid only once for the whole array.
+
+    :param codes: list of (network, station, location, channel) tuples, one
+        for each row of ``data``
+    :param tmin: system time of first sample in [s]
+    :param deltat: sampling interval in [s]
+    :param data: 2D numpy array with data samples, shape ``(nchannels,
+        nsamples)``
+    '''
+
+    def __init__(self, codes, tmin, deltat, data):
+        data = num.ascontiguousarray(data)
+        codes = [tuple(nslc) for nslc in codes]
+        if data.ndim != 2 or data.shape[0] != len(codes):
+            raise ValueError(
+                'data must be a 2D array with one row per channel')
+
+        self.codes = codes
+        self.tmin = tmin
+        self.deltat = deltat
+        self.data = data
+
+    @classmethod
+    def from_traces(cls, traces, tmin=None, tmax=None):
+        '''
+        Create trace array from list of traces.
+
+        :param traces: list of :py:class:`Trace` objects with identical
+            sampling rates and sampling instances
+        :param tmin: start time (default: latest start time of the traces)
+        :param tmax: end time (default: earliest end time of the traces)
+
+        Traces not fully covering the time span are padded with zeros.
+        Raises :py:exc:`MisalignedTraces` if the sampling intervals of the
+        traces differ or if their samples are not aligned.
+        '''
+
+        if not traces:
+            raise NoData()
+
+        deltat = traces[0].deltat
+        for tr in traces:
+            if abs(tr.deltat - deltat) > deltat * 1e-6:
+                raise MisalignedTraces(
+                    'sampling intervals of traces differ')
+
+            offset = (tr.tmin - traces[0].tmin) / deltat
+            if abs(offset - round(offset)) > 0.01:
+                raise MisalignedTraces(
+                    'sampling instances of traces are not aligned')
+
+        if tmin is None:
+            tmin = max(tr.tmin for tr in traces)
+
+        if tmax is None:
+            tmax = min(tr.tmax for tr in traces)
+
+        # snap to sampling instances of the traces
+        tmin = traces[0].tmin + round((tmin - traces[0].tmin) / deltat) \
+            * deltat
+
+        nsamples = int(round((tmax - tmin) / deltat)) + 1
+        if nsamples <= 0:
+            raise NoData()
+
+        dtype = num.result_type(*[tr.ydata for tr in traces])
+        data = num.zeros((len(traces), nsamples), dtype=dtype)
+        for irow, tr in enumerate(traces):
+            ioff = int(round((tr.tmin - tmin) / deltat))
+            ibeg = max(0, ioff)
+            iend = min(nsamples, ioff + tr.ydata.size)
+            if ibeg < iend:
+                data[irow, ibeg:iend] = tr.ydata[ibeg-ioff:iend-ioff]
+
+        return cls([tr.nslc_id for tr in traces], tmin, deltat, data)
+
+    def to_traces(self, copy=True):
+        '''
+        Get list of :py:class:`Trace` objects, one for each channel.
+
+        :param copy: if ``False``, the data arrays of the traces are views
+            into the data array of this object
+        '''
+
+        traces = []
+        for nslc, ydata in zip(self.codes, self.data):
+            if copy:
+                ydata = ydata.copy()
+
+            traces.append(Trace(
+                *nslc, tmin=self.tmin, deltat=self.deltat, ydata=ydata))
+
+        return traces
+
+    @property
+    def nchannels(self):
+        return self.data.shape[0]
+
+    @property
+    def nsamples(self):
+        return self.data.shape[1]
+
+    @property
+    def tmax(self):
+        return self.tmin + (self.nsamples - 1) * self.deltat
+
+    @property
+    def nsl_ids(self):
+        '''
+        List of (network, station, location) tuples of the channels, in order
+        of first appearance.
+        '''
+
+        nsls = []
+        seen = set()
+        for nslc in self.codes:
+            if nslc[:3] not in seen:
+                seen.add(nslc[:3])
+                nsls.append(nslc[:3])
+
+        return nsls
+
+    def copy(self):
+        '''
+        Get copy of the trace array.
+        '''
+
+        return TraceArray(
+            self.codes, self.tmin, self.deltat, self.data.copy())
+
+    def __getitem__(self, index):
+        '''
+        Get trace array with a subset of the channels.
+
+        :param index: integer, slice, list of integers or boolean mask
+        '''
+
+        if isinstance(index, (int, num.integer)):
+            index = [index]
+
+        irows = num.arange(self.nchannels)[index]
+        return TraceArray(
+            [self.codes[irow] for irow in irows], self.tmin, self.deltat,
+            self.data[irows])
+
+    def chop(self, tmin, tmax, inplace=True, include_last=False):
+        '''
+        Cut the trace array to given time span.
+
+        See :py:meth:`Trace.chop`.
+        '''
+
+        ibeg = max(0, t2ind(tmin-self.tmin, self.deltat))
+        iend = min(
+            self.nsamples,
+            t2ind(tmax-self.tmin, self.deltat) + int(include_last))
+
+        if ibeg >= iend:
+            raise NoData()
+
+        obj = self
+        if not inplace:
+            obj = TraceArray(self.codes, self.tmin, self.deltat, self.data)
+
+        obj.data = self.data[:, ibeg:iend].copy()
+        obj.tmin = self.tmin + ibeg*self.deltat
+        return obj
+
+    def _float_data(self, demean):
+        data = self.data.astype(num.float64)
+        if demean:
+            data -= num.mean(data, axis=1)[:, num.newaxis]
+
+        return data
+
+    def _nyquist_check(self, frequency, intro):
+        if frequency >= 0.5/self.deltat:
+            logger.warning(
+                '%s (%g Hz) is equal to or higher than nyquist '
+                'frequency (%g Hz).' % (intro, frequency, 0.5/self.deltat))
+
+    def lowpass(self, order, corner, demean=True):
+        '''
+        Apply Butterworth lowpass to all channels.
+
+        See :py:meth:`Trace.lowpass`.
+        '''
+
+        self._nyquist_check(corner, 'Corner frequency of lowpass')
+        (b, a) = _get_cached_filter_coefs(
+            order, [corner*2.0*self.deltat], btype='low')
+
+        self.data = signal.lfilter(b, a, self._float_data(demean), axis=1)
+
+    def highpass(self, order, corner, demean=True):
+        '''
+        Apply Butterworth highpass to all channels.
+
+        See :py:meth:`Trace.highpass`.
+        '''
+
+        self._nyquist_check(corner, 'Corner frequency of highpass')
+        (b, a) = _get_cached_filter_coefs(
+            order, [corner*2.0*self.deltat], btype='high')
+
+        self.data = signal.lfilter(b, a, self._float_data(demean), axis=1)
+
+    def bandpass(self, order, corner_hp, corner_lp, demean=True):
+        '''
+        Apply Butterworth bandpass to all channels.
+
+        See :py:meth:`Trace.bandpass`.
+        '''
+
+        self._nyquist_check(corner_hp, 'Lower corner frequency of bandpass')
+        self._nyquist_check(corner_lp, 'Higher corner frequency of bandpass')
+        (b, a) = _get_cached_filter_coefs(
+            order,
+            [corner*2.0*self.deltat for corner in (corner_hp, corner_lp)],
+            btype='band')
+
+        self.data = signal.lfilter(b, a, self._float_data(demean), axis=1)
+
+    def taper(self, taperer):
+        '''
+        Apply a :py:class:`Taper` to all channels.
+        '''
+
+        window = num.ones(self.nsamples)
+        taperer(window, self.tmin, self.deltat)
+        self.data = self.data * window[num.newaxis, :]
+
+    def envelope(self):
+        '''
+        Replace the data of all channels by their envelopes.
+
+        See :py:meth:`Trace.envelope`.
+        '''
+
+        data = self.data.astype(num.float64)
+        self.data = num.ascontiguousarray(num.abs(hilbert(data.T).T))
+
+    def downsample_to(self, deltat, snap=False, demean=False):
+        '''
+        Downsample all channels to given sampling interval.
+
+        See :py:meth:`Trace.downsample_to`, intermediate upsampling is not
+        supported. Raises :py:exc:`pyrocko.util.UnavailableDecimation` if
+        the ratio is not supported.
+        '''
+
+        ratio = deltat/self.deltat
+        rratio = int(round(ratio))
+        if abs(ratio - rratio) / ratio > 0.0001 \
+                or not util.decitab(rratio):
+
+            raise util.UnavailableDecimation('ratio = %g' % ratio)
+
+        data = self._float_data(demean)
+        for ndecimate in util.decitab(rratio):
+            if ndecimate == 1:
+                continue
+
+            newdeltat = self.deltat*ndecimate
+            ilag = 0
+            if snap:
+                ilag = int(round(
+                    (math.ceil(self.tmin / newdeltat) * newdeltat - self.tmin)
+                    / self.deltat))
+
+                if ilag >= data.shape[1]:
+                    ilag = 0
+
+            b, a, n = util.decimate_coeffs(ndecimate, ftype='fir')
+            data = signal.lfilter(b, a, data, axis=1)[
+                :, n//2+ilag::ndecimate].copy()
+
+            self.tmin += ilag*self.deltat
+            self.deltat = reuse(newdeltat)
+
+        self.data = data
+
+    def transfer(
+            self,
+            tfade=0.,
+            freqlimits=None,
+            transfer_function=None,
+            cut_off_fading=True,
+            invert=False):
+
+        '''
+        Return new trace array with transfer function applied to all
+        channels.
+
+        See :py:meth:`Trace.transfer`.
+        '''
+
+        if transfer_function is None:
+            transfer_function = FrequencyResponse()
+
+        if self.tmax - self.tmin <= tfade*2.:
+            raise TraceTooShort(
+                'Trace array too short for fading length setting. '
+                'trace length = %g, fading length = %g'
+                % (self.tmax-self.tmin, tfade))
+
+        ndata = self.nsamples
+        ntrans = nextfftlen(ndata*1.2)
+        coefs = _get_tapered_coefs(
+            self.deltat, ntrans, freqlimits, transfer_function, invert=invert)
+
+        data_pad = num.zeros((self.nchannels, ntrans), dtype=num.float)
+        data_pad[:, :ndata] = self._float_data(True)
+        if tfade != 0.0:
+            _apply_fade(data_pad[:, :ndata], tfade, self.deltat)
+
+        fdata = num.fft.rfft(data_pad, axis=1)
+        fdata *= coefs[num.newaxis, :]
+        ddata = num.fft.irfft(fdata, n=ntrans, axis=1)
+
+        output = TraceArray(
+            self.codes, self.tmin, self.deltat, ddata[:, :ndata])
+
+        if cut_off_fading and tfade != 0.0:
+            try:
+                output.chop(output.tmin+tfade, output.tmax-tfade)
+            except NoData:
+                raise TraceTooShort(
+                    'Trace array too short for fading length setting. '
+                    'trace length = %g, fading length = %g'
+                    % (self.tmax-self.tmin, tfade))
+
+        return output
+
+    def __str__(self):
+        return 'TraceArray (%i channels, %i samples, %s - %s)' % (
+            self.nchannels, self.nsamples,
+            util.time_to_str(self.tmin), util.time_to_str(self.tmax))
+
+
 def minmax(traces, key=None, mode='minmax'):
 
     '''
@@ -1851,12 +2364,19 @@ def degapper(
     out_traces = []
     if not in_traces:
         return out_traces
-    out_traces.append(in_traces.pop(0))
-    while in_traces:
 
-        a = out_traces[-1]
-        b = in_traces.pop(0)
+    # first pass: decide on merges using only the trace headers, collect the
+    # pieces of each merged trace; second pass: fill data arrays, allocating
+    # each of them only once
+
+    a = in_traces[0]
+    out_traces.append(a)
+    runs = []
+    pieces = []
+    na = a.data_len()
+    nmax = na
 
+    for b in in_traces[1:]:
         avirt, bvirt = a.ydata is None, b.ydata is None
         assert avirt == bvirt, \
             'traces given to degapper() must either all have data or have ' \
@@ -1865,74 +2385,76 @@ def degapper(
         virtual = avirt and bvirt
 
         if (a.nslc_id == b.nslc_id and a.deltat == b.deltat
-                and a.data_len() >= 1 and b.data_len() >= 1
+                and na >= 1 and b.data_len() >= 1
                 and (virtual or a.ydata.dtype == b.ydata.dtype)):
 
-            dist = (b.tmin-(a.tmin+(a.data_len()-1)*a.deltat))/a.deltat
+            nb = b.data_len()
+            dist = (b.tmin-(a.tmin+(na-1)*a.deltat))/a.deltat
             idist = int(round(dist))
             if abs(dist - idist) > 0.05 and idist <= maxgap:
                 # logger.warning('Cannot degap traces with displaced sampling '
                 #                '(%s, %s, %s, %s)' % a.nslc_id)
                 pass
             else:
-                if 1 < idist <= maxgap:
+                if idist == 1 or 1 < idist <= maxgap:
                     if not virtual:
-                        if fillmethod == 'interpolate':
-                            filler = a.ydata[-1] + (
-                                ((1.0 + num.arange(idist-1, dtype=num.float))
-                                 / idist) * (b.ydata[0]-a.ydata[-1])
-                            ).astype(a.ydata.dtype)
-                        elif fillmethod == 'zeros':
-                            filler = num.zeros(idist-1, dtype=a.ydist.dtype)
-                        a.ydata = num.concatenate((a.ydata, filler, b.ydata))
-                    a.tmax = b.tmax
-                    if a.mtime and b.mtime:
-                        a.mtime = max(a.mtime, b.mtime)
-                    continue
+                        pieces.append((b, idist))
+                        na += idist - 1 + nb
+                        nmax = max(na, nmax)
 
-                elif idist == 1:
-                    if not virtual:
-                        a.ydata = num.concatenate((a.ydata, b.ydata))
                     a.tmax = b.tmax
                     if a.mtime and b.mtime:
                         a.mtime = max(a.mtime, b.mtime)
+
+                    if virtual:
+                        na = a.data_len()
+
                     continue
 
                 elif idist <= 0 and (maxlap is None or -maxlap < idist):
                     if b.tmax > a.tmax:
                         if not virtual:
-                            na = a.ydata.size
                             n = -idist+1
                             if deoverlap == 'use_second':
-                                a.ydata = num.concatenate(
-                                    (a.ydata[:-n], b.ydata))
-                            elif deoverlap in ('use_first', 'crossfade_cos'):
-                                a.ydata = num.concatenate(
-                                    (a.ydata, b.ydata[n:]))
-                            elif deoverlap == 'add':
-                                a.ydata[-n:] += b.ydata[:n]
-                                a.ydata = num.concatenate(
-                                    (a.ydata, b.ydata[n:]))
+                                na = max(na - n, 0) + nb
+                            elif deoverlap in (
+                                    'use_first', 'crossfade_cos', 'add'):
+                                na += max(nb - n, 0)
                             else:
                                 assert False, 'unknown deoverlap method'
 
-                            if deoverlap == 'crossfade_cos':
-                                n = -idist+1
-                                taper = 0.5-0.5*num.cos(
-                                    (1.+num.arange(n))/(1.+n)*num.pi)
-                                a.ydata[na-n:na] *= 1.-taper
-                                a.ydata[na-n:na] += b.ydata[:n] * taper
+                            pieces.append((b, idist))
+                            nmax = max(na, nmax)
 
                         a.tmax = b.tmax
                         if a.mtime and b.mtime:
                             a.mtime = max(a.mtime, b.mtime)
+
+                        if virtual:
+                            na = a.data_len()
+
                         continue
                     else:
                         # make short second trace vanish
                         continue
 
         if b.data_len() >= 1:
+            if pieces:
+                runs.append((a, pieces, nmax))
+
             out_traces.append(b)
+            a = b
+            pieces = []
+            na = nmax = a.data_len()
+
+    if pieces:
+        runs.append((a, pieces, nmax))
+
+    for a, pieces, nmax in runs:
+        _degapper_join(a, pieces, nmax, fillmethod, deoverlap)
+
+    # input list is consumed, as it always was
+    del in_traces[:]
 
     for tr in out_traces:
         tr._update_ids()
@@ -1940,9 +2462,58 @@ def degapper(
     return out_traces
 
 
-def rotate(traces, azimuth, in_channels, out_channels):
-    '''
-    2D rotation of traces.
+def _degapper_join(a, pieces, nmax, fillmethod, deoverlap):
+    out = num.empty(nmax, dtype=a.ydata.dtype)
+    na = a.ydata.size
+    out[:na] = a.ydata
+    for b, idist in pieces:
+        nb = b.ydata.size
+        if idist >= 1:
+            if idist > 1:
+                if fillmethod == 'interpolate':
+                    out[na:na+idist-1] = out[na-1] + (
+                        ((1.0 + num.arange(idist-1, dtype=num.float))
+                         / idist) * (b.ydata[0]-out[na-1])
+                    ).astype(a.ydata.dtype)
+                elif fillmethod == 'zeros':
+                    out[na:na+idist-1] = 0
+                else:
+                    assert False, 'unknown fillmethod'
+
+                na += idist-1
+
+            out[na:na+nb] = b.ydata
+            na += nb
+
+        else:
+            n = -idist+1
+            if deoverlap == 'use_second':
+                na = max(na - n, 0)
+                out[na:na+nb] = b.ydata
+                na += nb
+
+            else:
+                if deoverlap == 'add':
+                    out[:na][-n:] += b.ydata[:n]
+
+                rest = b.ydata[n:]
+                out[na:na+rest.size] = rest
+                nold = na
+                na += rest.size
+
+                if deoverlap == 'crossfade_cos':
+                    taper = 0.5-0.5*num.cos(
+                        (1.+num.arange(n))/(1.+n)*num.pi)
+                    cur = out[:na]
+                    cur[nold-n:nold] *= 1.-taper
+                    cur[nold-n:nold] += b.ydata[:n] * taper
+
+    a.ydata = out[:na]
+
+
+def rotate(traces, azimuth, in_channels, out_channels):
+    '''
+    2D rotation of traces.
 
     :param traces: list of input traces
     :param azimuth: difference of the azimuths of the component directions
@@ -2279,6 +2850,189 @@ def _project3(traces, matrix, in_channels, out_channels):
     return projected
 
 
+def _per_station(values, nstations):
+    values = num.asarray(values, dtype=num.float64)
+    if values.ndim == 0:
+        return num.repeat(values, nstations)
+
+    if values.shape != (nstations,):
+        raise ValueError(
+            'number of given values (%i) does not match number of stations '
+            '(%i)' % (values.size, nstations))
+
+    return values
+
+
+def project_array(array, matrix, in_channels, out_channels):
+    '''
+    Affine transform of three-component data of many stations at once.
+
+    Vectorized counterpart of :py:func:`project`, working on the data of all
+    stations in a :py:class:`TraceArray`. Channels are grouped into stations
+    by their (network, station, location) codes. As in :py:func:`project`,
+    the transformation is split into independent sub-systems where possible,
+    so that stations lacking e.g. the vertical component still get their
+    horizontal components transformed. Each sub-system is applied to all
+    stations with a single matrix product.
+
+    :param array: :py:class:`TraceArray` with the input channels of all
+        stations on a common time base
+    :param matrix: transformation matrix, shape ``(nout, nin)``, or array of
+        per-station matrices, shape ``(nstations, nout, nin)``, ordered like
+        :py:attr:`TraceArray.nsl_ids`
+    :param in_channels: input channel names
+    :param out_channels: output channel names
+    :returns: :py:class:`TraceArray` with the transformed channels, ordered
+        by station and output channel
+    '''
+
+    in_channels = tuple(_channels_to_names(in_channels))
+    out_channels = tuple(_channels_to_names(out_channels))
+    nsl_ids = array.nsl_ids
+
+    matrix = num.asarray(matrix, dtype=num.float64)
+    if matrix.ndim == 2:
+        matrix = matrix[num.newaxis, :, :].repeat(len(nsl_ids), axis=0)
+
+    if matrix.shape != (len(nsl_ids), len(out_channels), len(in_channels)):
+        raise ValueError(
+            'shape of transformation matrix %s does not match number of '
+            'stations (%i) and channels' % (matrix.shape, len(nsl_ids)))
+
+    systems = _decompose(num.any(matrix != 0.0, axis=0).astype(num.float64))
+
+    # fallback to full matrix if some are not quadratic
+    for iins, iouts, submatrix in systems:
+        if submatrix.shape[0] != submatrix.shape[1]:
+            systems = [(
+                list(range(len(in_channels))),
+                list(range(len(out_channels))),
+                None)]
+            break
+
+    irows = dict((nslc, irow) for (irow, nslc) in enumerate(array.codes))
+
+    keys = []
+    blocks = []
+    for iins, iouts, _ in systems:
+        istations = []
+        rows = []
+        for ista, nsl in enumerate(nsl_ids):
+            try:
+                rows.append(
+                    [irows[nsl + (in_channels[iin],)] for iin in iins])
+                istations.append(ista)
+            except KeyError:
+                pass
+
+        if not istations:
+            continue
+
+        submatrices = matrix[istations][:, iouts][:, :, iins]
+        projected = num.matmul(submatrices, array.data[num.array(rows)])
+        blocks.append(projected.reshape((-1, array.nsamples)))
+        keys.extend(
+            (ista, iout) for ista in istations for iout in iouts)
+
+    if not blocks:
+        raise NoData()
+
+    order = sorted(range(len(keys)), key=lambda i: keys[i])
+    data = num.concatenate(blocks)[order]
+    codes = [
+        nsl_ids[ista] + (out_channels[iout],)
+        for (ista, iout) in (keys[i] for i in order)]
+
+    return TraceArray(codes, array.tmin, array.deltat, data)
+
+
+def rotate_array(array, azimuths, in_channels, out_channels):
+    '''
+    2D rotation of the horizontal components of many stations at once.
+
+    Vectorized counterpart of :py:func:`rotate`, see :py:func:`project_array`.
+
+    :param array: :py:class:`TraceArray` with the input channels
+    :param azimuths: difference of the azimuths of the component directions
+        (azimuth of out_channels[0]) - (azimuth of in_channels[0]), one value
+        for all stations or one per station, ordered like
+        :py:attr:`TraceArray.nsl_ids`
+    :param in_channels: names of the input channels (e.g. 'N', 'E')
+    :param out_channels: names of the output channels (e.g. 'R', 'T')
+    :returns: :py:class:`TraceArray` with the rotated channels
+    '''
+
+    phi = _per_station(azimuths, len(array.nsl_ids)) / 180. * math.pi
+    cphi = num.cos(phi)
+    sphi = num.sin(phi)
+
+    matrix = num.empty((phi.size, 2, 2))
+    matrix[:, 0, 0] = cphi
+    matrix[:, 0, 1] = sphi
+    matrix[:, 1, 0] = -sphi
+    matrix[:, 1, 1] = cphi
+
+    return project_array(array, matrix, in_channels, out_channels)
+
+
+def rotate_to_rt_array(
+        array, backazimuths, in_channels=('N', 'E'), out_channels=('R', 'T')):
+
+    '''
+    Rotate horizontal components of many stations to radial and transverse.
+
+    Vectorized counterpart of :py:func:`rotate_to_rt`.
+
+    :param array: :py:class:`TraceArray` with the input channels
+    :param backazimuths: backazimuths in degrees clockwise from north, one
+        value for all stations or one per station, ordered like
+        :py:attr:`TraceArray.nsl_ids`
+    :param in_channels: names of the north and east channels
+    :param out_channels: output channel names (default: ('R', 'T'))
+    :returns: :py:class:`TraceArray` with the rotated channels
+    '''
+
+    return rotate_array(
+        array, _per_station(backazimuths, len(array.nsl_ids)) + 180.,
+        in_channels, out_channels)
+
+
+def rotate_to_lqt_array(array, backazimuths, incidences, in_channels,
+                        out_channels=('L', 'Q', 'T')):
+    '''
+    Rotate from ZNE to LQT system for many stations at once.
+
+    Vectorized counterpart of :py:func:`rotate_to_lqt`.
+
+    :param array: :py:class:`TraceArray` with the input channels
+    :param backazimuths: backazimuths in degrees clockwise from north
+    :param incidences: incidence angles in degrees from vertical
+    :param in_channels: input channel names
+    :param out_channels: output channel names (default: ('L', 'Q', 'T'))
+    :returns: :py:class:`TraceArray` with the transformed channels
+
+    Angles can be given as one value for all stations or as arrays with one
+    value per station, ordered like :py:attr:`TraceArray.nsl_ids`.
+    '''
+
+    nstations = len(array.nsl_ids)
+    i = _per_station(incidences, nstations) / 180. * num.pi
+    b = _per_station(backazimuths, nstations) / 180. * num.pi
+
+    ci = num.cos(i)
+    cb = num.cos(b)
+    si = num.sin(i)
+    sb = num.sin(b)
+
+    matrix = num.zeros((nstations, 3, 3))
+    matrix[:, 0, :] = num.array([ci, -cb*si, -sb*si]).T
+    matrix[:, 1, :] = num.array([si, cb*ci, sb*ci]).T
+    matrix[:, 2, 1] = sb
+    matrix[:, 2, 2] = -cb
+
+    return project_array(array, matrix, in_channels, out_channels)
+
+
 def correlate(a, b, mode='valid', normalization=None, use_fft=False):
     '''
     Cross correlation of two traces.
@@ -2323,8 +3077,24 @@ def correlate(a, b, mode='valid', normalization=None, use_fft=False):
     yc = numpy_correlate_fixed(yb, ya, mode=mode, use_fft=use_fft)
     kmin, kmax = numpy_correlate_lag_range(yb, ya, mode=mode, use_fft=use_fft)
 
+    yc = _normalize_correlation(ya, yb, yc, mode, normalization)
+
+    return _correlation_trace(a, b, yc, kmin)
+
+
+def _correlation_trace(a, b, yc, kmin):
+    c = a.copy(data=False)
+    c.set_ydata(yc)
+    c.set_codes(*merge_codes(a, b, '~'))
+    c.shift(-c.tmin + b.tmin-a.tmin + kmin * c.deltat)
+    return c
+
+
+def _normalize_correlation(ya, yb, yc, mode, normalization, normfac=None):
     if normalization == 'normal':
-        normfac = num.sqrt(num.sum(ya**2))*num.sqrt(num.sum(yb**2))
+        if normfac is None:
+            normfac = num.sqrt(num.sum(ya**2))*num.sqrt(num.sum(yb**2))
+
         yc = yc/normfac
 
     elif normalization == 'gliding':
@@ -2348,12 +3118,127 @@ def correlate(a, b, mode='valid', normalization=None, use_fft=False):
 
         yc /= normfac
 
-    c = a.copy()
-    c.set_ydata(yc)
-    c.set_codes(*merge_codes(a, b, '~'))
-    c.shift(-c.tmin + b.tmin-a.tmin + kmin * c.deltat)
+    return yc
 
-    return c
+
+def correlate_many(
+        traces, pairs=None, mode='valid', normalization=None, nthreads=1,
+        return_array=False):
+
+    '''
+    Cross correlation of many pairs of traces.
+
+    :param traces: list of input traces, all with the same sampling rate and
+        with real-valued data
+    :param pairs: list of index tuples ``(ia, ib)`` selecting the pairs of
+        traces to be correlated, as in ``correlate(traces[ia], traces[ib])``
+        (default: all pairs with ``ia < ib``); use e.g. ``[(0, i) for i in
+        range(1, len(traces))]`` to correlate a template with many traces
+    :param mode: ``'valid'``, ``'full'``, or ``'same'``
+    :param normalization: ``'normal'``, ``'gliding'``, or ``None``
+    :param nthreads: number of threads to distribute the pairs over
+    :param return_array: whether to return the results as a dense array
+        instead of traces, requires all traces to have the same length
+    :returns: list of traces as returned by :py:func:`correlate` (with
+        ``use_fft=True``), one for each pair, or, if ``return_array`` is set,
+        a tuple ``(tmins, coefs)`` with the time of the first lag of each
+        pair, and a 2D array of shape ``(npairs, nlags)`` with the cross
+        correlation coefficients
+
+    The spectrum of each trace is computed only once, the spectral products
+    and their inverse transforms are computed for chunks of pairs at once.
+    '''
+
+    from multiprocessing.pool import ThreadPool
+
+    if normalization == 'gliding' and mode != 'valid':
+        assert False, 'gliding normalization currently only available ' \
+            'with "valid" mode.'
+
+    ntraces = len(traces)
+    if pairs is None:
+        pairs = [(ia, ib)
+                 for ia in range(ntraces) for ib in range(ia+1, ntraces)]
+
+    pairs = [tuple(pair) for pair in pairs]
+    if not pairs:
+        return ([], num.zeros((0, 0))) if return_array else []
+
+    for tr in traces[1:]:
+        assert_same_sampling_rate(traces[0], tr)
+
+    if return_array and len(set(tr.ydata.size for tr in traces)) != 1:
+        raise ValueError(
+            'correlate_many: traces must have the same length to return an '
+            'array')
+
+    used = sorted(set(i for pair in pairs for i in pair))
+    irow = dict((i, j) for (j, i) in enumerate(used))
+
+    nmax = max(traces[i].ydata.size for i in used)
+    nfft = nextfftlen(2*nmax - 1)
+    padded = num.zeros((len(used), nfft), dtype=num.float)
+    for i in used:
+        padded[irow[i], :traces[i].ydata.size] = traces[i].ydata
+
+    spectra = num.fft.rfft(padded, axis=1)
+    del padded
+
+    norms = None
+    if normalization == 'normal':
+        norms = dict(
+            (i, num.sqrt(num.sum(traces[i].ydata**2))) for i in used)
+
+    nchunk = 64
+
+    def work(ibeg):
+        chunk = pairs[ibeg:ibeg+nchunk]
+        ias = [irow[ia] for (ia, _) in chunk]
+        ibs = [irow[ib] for (_, ib) in chunk]
+        cross = num.fft.irfft(
+            num.conj(spectra[ias]) * spectra[ibs], nfft, axis=1)
+
+        results = []
+        for (ia, ib), row in zip(chunk, cross):
+            ya, yb = traces[ia].ydata, traces[ib].ydata
+            kmin, kmax = numpy_correlate_lag_range(
+                yb, ya, mode=mode, use_fft=True)
+
+            yc = row[num.arange(kmin, kmax+1) % nfft]
+            normfac = None
+            if norms is not None:
+                normfac = norms[ia] * norms[ib]
+
+            yc = _normalize_correlation(
+                ya, yb, yc, mode, normalization, normfac)
+
+            results.append((kmin, yc))
+
+        return results
+
+    ibegs = list(range(0, len(pairs), nchunk))
+    if nthreads > 1:
+        pool = ThreadPool(nthreads)
+        try:
+            chunks = pool.map(work, ibegs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        chunks = [work(ibeg) for ibeg in ibegs]
+
+    results = [result for chunk in chunks for result in chunk]
+
+    if return_array:
+        tmins = num.array([
+            traces[ib].tmin - traces[ia].tmin + kmin * traces[ia].deltat
+            for ((ia, ib), (kmin, _)) in zip(pairs, results)])
+
+        return tmins, num.array([yc for (_, yc) in results])
+
+    return [
+        _correlation_trace(traces[ia], traces[ib], yc, kmin)
+        for ((ia, ib), (kmin, yc)) in zip(pairs, results)]
 
 
 def deconvolve(
@@ -2567,8 +3452,18 @@ class GaussTaper(Taper):
         self._alpha = alpha
 
     def __call__(self, y, x0, dx):
-        f = x0 + num.arange(y.size)*dx
-        y *= num.exp(-num.pi**2 / (self._alpha**2) * f**2)
+        k = (self._alpha, y.size, x0, dx)
+        weights = cached_gausstaper_weights.get(k)
+        if weights is None:
+            f = x0 + num.arange(y.size)*dx
+            weights = num.exp(-num.pi**2 / (self._alpha**2) * f**2)
+            weights.flags.writeable = False
+            cached_gausstaper_weights.put(k, weights)
+
+        y *= weights
+
+
+cached_gausstaper_weights = util.LRUCache(16)
 
 
 class FrequencyResponse(Object):
@@ -2889,6 +3784,70 @@ def _get_cached_filter_coefs(order, corners, btype):
 
 class _globals(object):
     _numpy_has_correlate_flip_bug = None
+    processing_dtype = num.dtype(num.float64)
+
+
+def set_processing_dtype(dtype):
+    '''
+    Set default floating point type used in trace filtering.
+
+    :param dtype: ``numpy.float64`` (default) or ``numpy.float32``
+
+    Affects :py:meth:`Trace.lowpass`, :py:meth:`Trace.highpass`,
+    :py:meth:`Trace.bandpass`, :py:meth:`Trace.bandpass_fft`,
+    :py:meth:`Trace.transfer`, :py:meth:`Trace.taper` and the ``co_*``
+    coroutines, when these are not given an explicit ``dtype``. In single
+    precision mode, memory use and bandwidth of the data arrays are halved.
+    Relative errors introduced are typically in the order of ``1e-7`` to
+    ``1e-6``; the tests bound them at ``1e-5`` for the filters covered.
+    Recursive filters are evaluated in double precision in either case,
+    because single precision filter coefficients are numerically unstable at
+    low corner frequencies; only their output is stored in single precision.
+    '''
+
+    _globals.processing_dtype = _processing_dtype(dtype)
+
+
+def get_processing_dtype():
+    '''
+    Get default floating point type used in trace filtering.
+
+    See :py:func:`set_processing_dtype`.
+    '''
+
+    return _globals.processing_dtype
+
+
+def _processing_dtype(dtype):
+    if dtype is None:
+        return _globals.processing_dtype
+
+    dtype = num.dtype(dtype)
+    if dtype not in (num.dtype(num.float32), num.dtype(num.float64)):
+        raise ValueError(
+            'processing dtype must be float32 or float64, not %s' % dtype)
+
+    return dtype
+
+
+def _lfilter(b, a, data, nchunk=65536):
+    '''
+    Apply recursive filter, keeping the floating point type of the data.
+
+    Single precision data is filtered chunk-wise with filter state in double
+    precision, so that double precision temporaries stay small.
+    '''
+
+    if data.dtype == num.float64:
+        return signal.lfilter(b, a, data)
+
+    out = num.empty(data.size, dtype=data.dtype)
+    zi = num.zeros(max(len(a), len(b))-1, dtype=num.float64)
+    for ibeg in range(0, data.size, nchunk):
+        out[ibeg:ibeg+nchunk], zi = signal.lfilter(
+            b, a, data[ibeg:ibeg+nchunk], zi=zi)
+
+    return out
 
 
 def _default_key(tr):
@@ -3085,6 +4044,92 @@ def nextpow2(i):
     return 2**int(math.ceil(math.log(i)/math.log(2.)))
 
 
+def nextfftlen(i):
+    '''
+    Get fast FFT length.
+
+    :returns: smallest even number ``>= i`` with no prime factors other than
+        2, 3 and 5
+
+    Such lengths are transformed about as efficiently as powers of two, but
+    need much less zero-padding on average.
+    '''
+
+    # search m = p2 * p35 >= ceil(i/2), return 2*m
+    n = max(1, int(math.ceil(i / 2.)))
+    best = nextpow2(n)
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            quotient = -(-n // p35)
+            p2 = 1 << (quotient - 1).bit_length()
+            best = min(best, p2 * p35)
+            if best == n:
+                return 2*best
+
+            p35 *= 3
+
+        p5 *= 5
+
+    return 2*best
+
+
+class _FFTWorkBuffers(threading.local):
+    def __init__(self):
+        self.buffers = util.LRUCache(8)
+
+
+_fft_work_buffers = _FFTWorkBuffers()
+
+# larger buffers are not kept, limiting the pool to 8 * 4 MB per thread
+g_fft_work_buffer_nbytes_max = 4 * 1024**2
+
+
+def _get_fft_work_buffer(ntrans, data, dtype=num.float64):
+    '''
+    Get zero-padded copy of data, reusing a per-thread buffer.
+
+    Only buffers up to ``g_fft_work_buffer_nbytes_max`` bytes are kept for
+    reuse, larger ones are allocated on each call and freed when no longer
+    referenced.
+
+    The returned array is only valid until the next call with the same
+    ``ntrans`` and ``dtype`` in the same thread. It must not outlive the
+    calling function, i.e. it must not be returned or stored: pass it to
+    the FFT and use the FFT output.
+    '''
+
+    dtype = num.dtype(dtype)
+    nbytes = ntrans * dtype.itemsize
+    if nbytes > g_fft_work_buffer_nbytes_max:
+        buf = num.empty(ntrans, dtype=dtype)
+    else:
+        buf = _fft_work_buffers.buffers.get((ntrans, dtype))
+        if buf is None:
+            buf = num.empty(ntrans, dtype=dtype)
+            _fft_work_buffers.buffers.put((ntrans, dtype), buf)
+
+    ndata = data.size
+    buf[:ndata] = data
+    buf[ndata:] = 0.0
+    return buf
+
+
+def _rfft(data, n=None):
+    if scipy_fft is not None and data.dtype == num.float32:
+        return scipy_fft.rfft(data, n)
+    else:
+        return num.fft.rfft(data, n)
+
+
+def _irfft(fdata, n=None):
+    if scipy_fft is not None and fdata.dtype == num.complex64:
+        return scipy_fft.irfft(fdata, n)
+    else:
+        return num.fft.irfft(fdata, n)
+
+
 def snapper_w_offset(nmax, offset, delta, snapfun=math.ceil):
     def snap(x):
         return max(0, min(int(snapfun((x-offset)/delta)), nmax))
@@ -3097,14 +4142,73 @@ def snapper(nmax, delta, snapfun=math.ceil):
     return snap
 
 
+cached_costaper_weights = util.LRUCache(64)
+
+
+def _costaper_weights(a, b, c, d, n, x0, dx):
+    '''
+    Get sample ranges and weights of the fading parts of a cosine taper.
+
+    :returns: tuple ``(i_a, i_b, i_c, i_d, fadein, fadeout)``, where samples
+        before ``i_a`` and from ``i_d`` on are zero and samples from ``i_b`` to
+        ``i_c`` are one
+
+    Results are cached, the weight arrays are read-only.
+    '''
+
+    k = (a, b, c, d, n, x0, dx)
+    weights = cached_costaper_weights.get(k)
+    if weights is None:
+        hi = snapper_w_offset(n, x0, dx)
+        i_a, i_b, i_c, i_d = hi(a), hi(b), hi(c), hi(d)
+        fadein = 0.5 \
+            - 0.5*num.cos((dx*num.arange(i_a, i_b)-(a-x0))/(b-a)*num.pi)
+        fadeout = 0.5 \
+            + 0.5*num.cos((dx*num.arange(i_c, i_d)-(c-x0))/(d-c)*num.pi)
+
+        for w in (fadein, fadeout):
+            w.flags.writeable = False
+
+        weights = i_a, i_b, i_c, i_d, fadein, fadeout
+        cached_costaper_weights.put(k, weights)
+
+    return weights
+
+
 def apply_costaper(a, b, c, d, y, x0, dx):
-    hi = snapper_w_offset(y.size, x0, dx)
-    y[:hi(a)] = 0.
-    y[hi(a):hi(b)] *= 0.5 \
-        - 0.5*num.cos((dx*num.arange(hi(a), hi(b))-(a-x0))/(b-a)*num.pi)
-    y[hi(c):hi(d)] *= 0.5 \
-        + 0.5*num.cos((dx*num.arange(hi(c), hi(d))-(c-x0))/(d-c)*num.pi)
-    y[hi(d):] = 0.
+    '''
+    Apply cosine taper to samples in place.
+
+    Only the faded parts are touched, no full length weight array is
+    created. For multi-dimensional ``y``, the taper is applied along the
+    last axis.
+    '''
+
+    i_a, i_b, i_c, i_d, fadein, fadeout = _costaper_weights(
+        a, b, c, d, y.shape[-1], x0, dx)
+
+    y[..., :i_a] = 0.
+    y[..., i_a:i_b] *= fadein
+    y[..., i_c:i_d] *= fadeout
+    y[..., i_d:] = 0.
+
+
+def _apply_fade(y, tfade, deltat):
+    '''
+    Apply cosine fade in and fade out of length ``tfade`` in place.
+
+    Gives the same result as multiplying with :py:func:`costaper`, also
+    when the fades overlap, in which case the fade out takes precedence over
+    the fade in. Only then a full length weight array is created.
+    '''
+
+    n = y.shape[-1]
+    a, b, c, d = 0., tfade, deltat*(n-1)-tfade, deltat*n
+    _, i_b, i_c, _, _, _ = _costaper_weights(a, b, c, d, n, 0., deltat)
+    if i_c < i_b:
+        y *= costaper(a, b, c, d, n, deltat)
+    else:
+        apply_costaper(a, b, c, d, y, 0., deltat)
 
 
 def span_costaper(a, b, c, d, y, x0, dx):
@@ -3113,17 +4217,130 @@ def span_costaper(a, b, c, d, y, x0, dx):
 
 
 def costaper(a, b, c, d, nfreqs, deltaf):
-    hi = snapper(nfreqs, deltaf)
+    i_a, i_b, i_c, i_d, fadein, fadeout = _costaper_weights(
+        a, b, c, d, nfreqs, 0., deltaf)
+
     tap = num.zeros(nfreqs)
-    tap[hi(a):hi(b)] = 0.5 \
-        - 0.5*num.cos((deltaf*num.arange(hi(a), hi(b))-a)/(b-a)*num.pi)
-    tap[hi(b):hi(c)] = 1.
-    tap[hi(c):hi(d)] = 0.5 \
-        + 0.5*num.cos((deltaf*num.arange(hi(c), hi(d))-c)/(d-c)*num.pi)
+    tap[i_a:i_b] = fadein
+    tap[i_b:i_c] = 1.
+    tap[i_c:i_d] = fadeout
 
     return tap
 
 
+cached_tapered_coefs = util.LRUCache(64)
+
+
+def _response_key(obj):
+    if isinstance(obj, (Object, FrequencyResponse)):
+        return (obj.__class__,) + tuple(sorted(
+            (name, _response_key(val)) for (name, val) in
+            obj.__dict__.items()))
+
+    elif isinstance(obj, (list, tuple)):
+        return tuple(_response_key(x) for x in obj)
+
+    elif isinstance(obj, num.ndarray):
+        return (obj.dtype.str, obj.shape, obj.tostring())
+
+    else:
+        hash(obj)
+        return obj
+
+
+def _get_tapered_coefs(
+        deltat, ntrans, freqlimits, transfer_function, invert=False):
+
+    '''
+    Get coefficients of tapered transfer function, cached.
+
+    Responses are identified by their content, so that coefficients are
+    reused for equal responses of many traces. The returned array must not be
+    modified. The cache is bounded, its statistics can be retrieved with
+    ``cached_tapered_coefs.stats()``.
+    '''
+
+    try:
+        ck = (
+            _response_key(transfer_function), ntrans, deltat,
+            None if freqlimits is None else tuple(freqlimits), bool(invert))
+
+    except TypeError:
+        ck = None  # unhashable content, don't cache
+
+    if ck is not None:
+        coefs = cached_tapered_coefs.get(ck)
+        if coefs is not None:
+            return coefs
+
+    coefs = _eval_tapered_coefs(
+        deltat, ntrans, freqlimits, transfer_function, invert)
+
+    if ck is not None:
+        coefs.flags.writeable = False
+        cached_tapered_coefs.put(ck, coefs)
+
+    return coefs
+
+
+def _eval_tapered_coefs(
+        deltat, ntrans, freqlimits, transfer_function, invert=False):
+
+    deltaf = 1./(deltat*ntrans)
+    nfreqs = ntrans//2 + 1
+    transfer = num.ones(nfreqs, dtype=num.complex)
+    hi = snapper(nfreqs, deltaf)
+    if freqlimits is not None:
+        a, b, c, d = freqlimits
+        freqs = num.arange(hi(d)-hi(a), dtype=num.float)*deltaf \
+            + hi(a)*deltaf
+
+        if invert:
+            transfer[hi(a):hi(d)] = 1.0 / transfer_function.evaluate(freqs)
+        else:
+            transfer[hi(a):hi(d)] = transfer_function.evaluate(freqs)
+
+        tapered_transfer = costaper(a, b, c, d, nfreqs, deltaf)*transfer
+    else:
+        freqs = num.arange(nfreqs) * deltaf
+        tapered_transfer = transfer_function.evaluate(freqs)
+
+    tapered_transfer[0] = 0.0  # don't introduce static offsets
+    return tapered_transfer
+
+
+def _overlap_add(data, coefs):
+    '''
+    Filter data segment-wise with given frequency domain coefficients.
+
+    The coefficients are interpreted as spectrum of a two-sided impulse
+    response with ``nblock = 2*(coefs.size-1)`` samples, non-causal parts
+    of it wrapped around to the end. The data is convolved with it in
+    segments of ``nblock`` samples, using FFTs of length ``2*nblock``.
+    '''
+
+    nblock = 2*(coefs.size-1)
+    nhalf = nblock // 2
+    impulse = num.fft.irfft(coefs, nblock)
+    impulse_pad = num.zeros(2*nblock, dtype=data.dtype)
+    impulse_pad[:nhalf] = impulse[:nhalf]
+    impulse_pad[-nhalf:] = impulse[nhalf:]
+    fimpulse = _rfft(impulse_pad)
+
+    ndata = data.size
+    output = num.zeros(ndata + 2*nblock, dtype=data.dtype)
+    for ibeg in range(0, ndata, nblock):
+        segment = _irfft(
+            _rfft(data[ibeg:ibeg+nblock], 2*nblock) * fimpulse,
+            2*nblock)
+
+        # output[i+nhalf] holds sample i
+        output[ibeg+nhalf:ibeg+nblock+2*nhalf] += segment[:nblock+nhalf]
+        output[ibeg:ibeg+nhalf] += segment[-nhalf:]
+
+    return output[nhalf:nhalf+ndata]
+
+
 def t2ind(t, tdelta, snap=round):
     return int(snap(t/tdelta))
 
@@ -3154,10 +4371,185 @@ def hilbert(x, N=None):
 
     if len(x.shape) > 1:
         h = h[:, num.newaxis]
-    x = num.fft.ifft(Xf*h)
+    x = num.fft.ifft(Xf*h, axis=0)
     return x
 
 
+def _hilbert_envelope(y, nblock=None, noverlap=None):
+    '''
+    Absolute value of the analytic signal, optionally computed block-wise.
+    '''
+
+    n = y.size
+    if nblock is None or n <= nblock:
+        return num.abs(hilbert(y))
+
+    if noverlap is None:
+        noverlap = nblock // 4
+
+    ncore = nblock - 2*noverlap
+    if ncore <= 0:
+        raise ValueError('nblock must be larger than 2*noverlap')
+
+    ntrans = nextfftlen(nblock)
+    env = num.empty(n)
+    for ibeg in range(0, n, ncore):
+        iend = min(n, ibeg + ncore)
+        ibeg_ext = max(0, ibeg - noverlap)
+        iend_ext = min(n, iend + noverlap)
+        block_env = num.abs(hilbert(y[ibeg_ext:iend_ext], ntrans))
+        env[ibeg:iend] = block_env[ibeg-ibeg_ext:iend-ibeg_ext]
+
+    return env
+
+
+def _window_argmax(y, ibegs, nwindow, nmax=2**20):
+    '''
+    Indices of the maxima of ``y`` in the windows ``[ibeg, ibeg+nwindow)``.
+
+    Windows are clipped at the end of ``y``. Windows are processed in batches
+    of at most ``nmax`` samples.
+    '''
+
+    ipeaks = num.empty(ibegs.size, dtype=num.int64)
+    offsets = num.arange(nwindow)
+    nbatch = max(1, nmax // nwindow)
+    for i in range(0, ibegs.size, nbatch):
+        indices = ibegs[i:i+nbatch, num.newaxis] + offsets[num.newaxis, :]
+        num.minimum(indices, y.size-1, out=indices)
+        # repeated last sample does not matter: argmax returns first maximum
+        ipeaks[i:i+nbatch] = indices[
+            num.arange(indices.shape[0]), num.argmax(y[indices], axis=1)]
+
+    return ipeaks
+
+
+def _deadtime_end(y, ibeg, nblock):
+    '''
+    Index where deadtime after trigger at ``ibeg`` ends, ``None`` if not
+    within ``y``.
+    '''
+
+    iblock = 0
+    totalsum = 0.
+    while ibeg+iblock*nblock < len(y):
+        logy = num.log(y[ibeg+iblock*nblock:ibeg+(iblock+1)*nblock])
+        logy[0] += totalsum
+        ysum = num.cumsum(logy)
+        totalsum = ysum[-1]
+        below = num.where(ysum <= 0., 1, 0)
+        deriv = num.zeros(ysum.size, dtype=num.int8)
+        deriv[1:] = below[1:]-below[:-1]
+        izero_positions = num.nonzero(deriv > 0)[0] + iblock*nblock
+        if len(izero_positions) > 0:
+            return ibeg + izero_positions[0]
+
+        iblock += 1
+
+    return None
+
+
+def _next_candidates(tpeaks, ttrigs, kbegs, tzeros):
+    '''
+    For each ``kbeg``, ``tzero`` pair, get index of first trigger at or after
+    ``kbeg`` with peak time not before ``tzero``.
+
+    Returns ``len(tpeaks)`` where there is none.
+    '''
+
+    # peak time is never before trigger time, so the first trigger after
+    # tzero is the last candidate to be checked
+    kmaxs = num.maximum(kbegs, num.searchsorted(ttrigs, tzeros, 'left'))
+    knexts = kmaxs.copy()
+    todo = num.nonzero(kbegs < kmaxs)[0]
+    ks = kbegs[todo]
+    while todo.size != 0:
+        hit = tpeaks[ks] >= tzeros[todo]
+        knexts[todo[hit]] = ks[hit]
+        ks = ks + 1
+        keep = num.logical_and(~hit, ks < kmaxs[todo])
+        todo = todo[keep]
+        ks = ks[keep]
+
+    return knexts
+
+
+def _peaks(y, tmin, deltat, threshold, tsearch, deadtime,
+           nblock_duration_detection, tzero, final):
+
+    '''
+    Peak detection core of :py:meth:`Trace.peaks` and :py:class:`StreamPeaks`.
+
+    If ``final`` is ``False``, detection stops at the first trigger for which
+    a decision cannot be made with the data available. Its index is returned
+    as ``ihold``, together with the current deadtime end ``tzero``.
+    '''
+
+    n = y.size
+    above = y > threshold
+    itrigs = num.nonzero(above[1:] & ~above[:-1])[0] + 1
+    nsearch = max(1, int(math.ceil(tsearch/deltat)))
+
+    if final:
+        ncomplete = itrigs.size
+    else:
+        ncomplete = num.searchsorted(itrigs, n - nsearch, 'right')
+
+    itrigs_complete = itrigs[:ncomplete]
+    ipeaks = _window_argmax(y, itrigs_complete, nsearch)
+    tpeaks_all = tmin + ipeaks*deltat
+    ttrigs = tmin + itrigs_complete*deltat
+
+    def next_candidate(kbeg, tzero):
+        return int(_next_candidates(
+            tpeaks_all, ttrigs, num.array([kbeg]), num.array([tzero]))[0])
+
+    ihold = None
+    ks = []
+    if not deadtime:
+        # successor of each trigger, if it is accepted
+        tzeros_all = itrigs_complete*deltat + tmin + tsearch
+        knexts = _next_candidates(
+            tpeaks_all, ttrigs, num.arange(1, ncomplete+1),
+            tzeros_all).tolist()
+
+        k = next_candidate(0, tzero)
+        while k < ncomplete:
+            ks.append(k)
+            k = knexts[k]
+
+        tzeros = tzeros_all[ks].tolist()
+
+    else:
+        tzeros = []
+        k = next_candidate(0, tzero)
+        while k < ncomplete:
+            izero = _deadtime_end(y, itrigs[k], nblock_duration_detection)
+            if izero is None:
+                if not final:
+                    ihold = itrigs[k]
+                    break
+
+                tzero = tmin + (n-1) * deltat
+            else:
+                tzero = tmin + deltat * izero
+
+            ks.append(k)
+            tzeros.append(tzero)
+            k = next_candidate(k+1, tzero)
+
+    if tzeros:
+        tzero = tzeros[-1]
+
+    if ihold is None and ncomplete < itrigs.size:
+        ihold = itrigs[ncomplete]
+
+    tpeaks = tpeaks_all[ks].tolist()
+    apeaks = list(y[ipeaks[ks]])
+
+    return tpeaks, apeaks, tzeros, ihold, tzero
+
+
 def near(a, b, eps):
     return abs(a-b) < eps
 
@@ -3212,7 +4604,7 @@ def co_list_append(list):
 
 
 @coroutine
-def co_lfilter(target, b, a):
+def co_lfilter(target, b, a, dtype=None):
     '''
     Successively filter broken continuous trace data (coroutine).
 
@@ -3230,6 +4622,10 @@ def co_lfilter(target, b, a):
 
     Filter state is reset, when gaps occur.
 
+    The filter recursion is evaluated in double precision, the output traces
+    hold data of type ``dtype`` (``numpy.float32`` or ``numpy.float64``,
+    default: see :py:func:`set_processing_dtype`).
+
     Use it like this::
 
       from pyrocko.trace import co_lfilter, co_list_append
@@ -3244,6 +4640,7 @@ def co_lfilter(target, b, a):
     '''
 
     try:
+        dtype = _processing_dtype(dtype)
         states = States()
         output = None
         while True:
@@ -3255,7 +4652,7 @@ def co_lfilter(target, b, a):
 
             output = input.copy(data=False)
             ydata, zf = signal.lfilter(b, a, input.get_ydata(), zi=zi)
-            output.set_ydata(ydata)
+            output.set_ydata(ydata.astype(dtype, copy=False))
             states.set(input, zf)
             target.send(output)
 
@@ -3263,9 +4660,9 @@ def co_lfilter(target, b, a):
         target.close()
 
 
-def co_antialias(target, q, n=None, ftype='fir'):
+def co_antialias(target, q, n=None, ftype='fir', dtype=None):
     b, a, n = util.decimate_coeffs(q, n, ftype)
-    anti = co_lfilter(target, b, a)
+    anti = co_lfilter(target, b, a, dtype=dtype)
     return anti
 
 
@@ -3303,7 +4700,7 @@ def co_dropsamples(target, q, nfir):
         target.close()
 
 
-def co_downsample(target, q, n=None, ftype='fir'):
+def co_downsample(target, q, n=None, ftype='fir', dtype=None):
     '''
     Successively downsample broken continuous trace data (coroutine).
 
@@ -3322,14 +4719,18 @@ def co_downsample(target, q, n=None, ftype='fir'):
     Filter state is reset, when gaps occur. The sampling instances are choosen
     so that they occur at (or as close as possible) to even multiples of the
     sampling interval of the downsampled trace (based on system time).
+
+    The output data type can be set with ``dtype``, see
+    :py:func:`co_lfilter`.
     '''
 
     b, a, n = util.decimate_coeffs(q, n, ftype)
-    return co_antialias(co_dropsamples(target, q, n), q, n, ftype)
+    return co_antialias(
+        co_dropsamples(target, q, n), q, n, ftype, dtype=dtype)
 
 
 @coroutine
-def co_downsample_to(target, deltat):
+def co_downsample_to(target, deltat, dtype=None):
 
     decimators = {}
     try:
@@ -3344,7 +4745,7 @@ def co_downsample_to(target, deltat):
             if deci_seq not in decimators:
                 pipe = target
                 for q in deci_seq[::-1]:
-                    pipe = co_downsample(pipe, q)
+                    pipe = co_downsample(pipe, q, dtype=dtype)
 
                 decimators[deci_seq] = pipe
 
@@ -3355,6 +4756,455 @@ def co_downsample_to(target, deltat):
             g.close()
 
 
+class StreamStage(object):
+    '''
+    Base class for stages of a :py:class:`StreamPipeline`.
+
+    A stage processes successive chunks of continuous trace data, like the
+    ``co_*`` coroutines (e.g. :py:func:`co_lfilter`), keeping state *per
+    channel* between calls. State is reset, when gaps occur. Unlike the state
+    of a coroutine, the state of a stage can be retrieved, pickled and
+    restored, see :py:meth:`get_state` and :py:meth:`set_state`.
+    '''
+
+    def __init__(self):
+        self.states = States()
+
+    def process(self, tr):
+        '''
+        Process a chunk of trace data.
+
+        :param tr: :py:class:`Trace` object
+        :returns: list of :py:class:`Trace` objects with the processed data
+            available so far
+        '''
+
+        if tr.data_len() == 0:
+            return []
+
+        output, state = self._process(tr, self.states.get(tr))
+        self.states.set(tr, state)
+        if output is None or output.data_len() == 0:
+            return []
+
+        return [output]
+
+    def _process(self, tr, state):
+        return tr, None
+
+    def reset(self):
+        '''
+        Drop state of all channels.
+        '''
+
+        self.states = States()
+
+    def get_state(self):
+        return self.states
+
+    def set_state(self, state):
+        self.states = state
+
+
+class StreamLFilter(StreamStage):
+    '''
+    Successively filter broken continuous trace data.
+
+    Stage counterpart of :py:func:`co_lfilter`.
+    '''
+
+    def __init__(self, b, a, dtype=None):
+        StreamStage.__init__(self)
+        self.b = b
+        self.a = a
+        self.dtype = dtype
+
+    def _process(self, tr, zi):
+        if zi is None:
+            zi = num.zeros(max(len(self.a), len(self.b))-1, dtype=num.float)
+
+        output = tr.copy(data=False)
+        ydata, zf = signal.lfilter(self.b, self.a, tr.get_ydata(), zi=zi)
+        output.set_ydata(
+            ydata.astype(_processing_dtype(self.dtype), copy=False))
+        return output, zf
+
+
+class _StreamDropSamples(StreamStage):
+
+    def __init__(self, q, nfir):
+        StreamStage.__init__(self)
+        self.q = q
+        self.nfir = nfir
+
+    def _process(self, tr, ioffset):
+        q, nfir = self.q, self.nfir
+        newdeltat = q * tr.deltat
+        if ioffset is None:
+            # see co_dropsamples
+            newtmin_want = math.ceil(
+                (tr.tmin+(nfir+1)*tr.deltat) / newdeltat) * newdeltat \
+                - (nfir/2*tr.deltat)
+            ioffset = int(round((newtmin_want - tr.tmin)/tr.deltat))
+            if ioffset < 0:
+                ioffset = ioffset % q
+
+        newtmin_have = tr.tmin + ioffset * tr.deltat
+        newtr = tr.copy(data=False)
+        newtr.deltat = newdeltat
+        newtr.tmin = newtmin_have - (nfir/2*tr.deltat)
+        newtr.set_ydata(tr.get_ydata()[ioffset::q].copy())
+        return newtr, (ioffset % q - tr.data_len() % q) % q
+
+
+class StreamDownsample(StreamStage):
+    '''
+    Successively downsample broken continuous trace data.
+
+    Stage counterpart of :py:func:`co_downsample_to`.
+
+    :param deltat: target sampling interval
+    :param dtype: floating point type of the output, see
+        :py:func:`set_processing_dtype`
+    '''
+
+    def __init__(self, deltat, dtype=None):
+        StreamStage.__init__(self)
+        self.deltat = deltat
+        self.dtype = dtype
+        self._decimators = {}
+
+    def _get_decimator(self, deci_seq):
+        if deci_seq not in self._decimators:
+            stages = []
+            for q in deci_seq:
+                b, a, n = util.decimate_coeffs(q, None, 'fir')
+                stages.append(StreamLFilter(b, a, dtype=self.dtype))
+                stages.append(_StreamDropSamples(q, n))
+
+            self._decimators[deci_seq] = StreamPipeline(*stages)
+
+        return self._decimators[deci_seq]
+
+    def process(self, tr):
+        ratio = self.deltat / tr.deltat
+        rratio = round(ratio)
+        if abs(rratio - ratio)/ratio > 0.0001:
+            raise util.UnavailableDecimation('ratio = %g' % ratio)
+
+        deci_seq = tuple(x for x in util.decitab(int(rratio)) if x != 1)
+        return self._get_decimator(deci_seq).process(tr)
+
+    def reset(self):
+        self._decimators = {}
+
+    def get_state(self):
+        return dict(
+            (deci_seq, decimator.get_state())
+            for (deci_seq, decimator) in self._decimators.items())
+
+    def set_state(self, state):
+        self._decimators = {}
+        for deci_seq, decimator_state in state.items():
+            self._get_decimator(deci_seq).set_state(decimator_state)
+
+
+class StreamRestitution(StreamStage):
+    '''
+    Successively apply transfer function to broken continuous trace data.
+
+    Convolves the data with the impulse response of the tapered transfer
+    function, truncated to ``nblock`` samples (see :py:meth:`Trace.transfer`
+    with ``nblock`` set). Because the impulse response is two-sided, the
+    output lags the input by ``nblock/2`` samples. On gaps, the output
+    samples pending at the end of the previous chunk are dropped.
+
+    :param transfer_function: :py:class:`FrequencyResponse` object
+    :param freqlimits: 4-tuple with corner frequencies in Hz
+    :param nblock: length of the impulse response in samples
+    :param invert: set to True to do a deconvolution
+    :param dtype: floating point type of the output, see
+        :py:func:`set_processing_dtype`
+    '''
+
+    def __init__(self, transfer_function, freqlimits, nblock, invert=True,
+                 dtype=None):
+
+        StreamStage.__init__(self)
+        self.transfer_function = transfer_function
+        self.freqlimits = freqlimits
+        self.nblock = nblock + nblock % 2
+        self.invert = invert
+        self.dtype = dtype
+        self._impulse_spectra = util.LRUCache(8)
+
+    def _get_impulse_spectrum(self, deltat, nfft):
+        k = (deltat, nfft)
+        spec = self._impulse_spectra.get(k)
+        if spec is None:
+            coefs = _get_tapered_coefs(
+                deltat, self.nblock, self.freqlimits, self.transfer_function,
+                invert=self.invert)
+
+            impulse = num.roll(
+                num.fft.irfft(coefs, self.nblock), self.nblock // 2)
+
+            spec = num.fft.rfft(impulse, nfft)
+            self._impulse_spectra.put(k, spec)
+
+        return spec
+
+    def _process(self, tr, state):
+        nblock = self.nblock
+        ydata = tr.get_ydata()
+        ndata = ydata.size
+        nfft = nextfftlen(ndata + nblock - 1)
+        ydata_conv = num.fft.irfft(
+            num.fft.rfft(ydata, nfft)
+            * self._get_impulse_spectrum(tr.deltat, nfft),
+            nfft)[:ndata + nblock - 1]
+
+        if state is None:
+            # start of stream: skip samples preceding the first input sample
+            nskip = nblock // 2
+        else:
+            tail, nskip = state
+            ydata_conv[:nblock-1] += tail
+
+        iskip = min(nskip, ndata)
+        output = tr.copy(data=False)
+        output.tmin = tr.tmin + (iskip - nblock // 2) * tr.deltat
+        output.set_ydata(ydata_conv[iskip:ndata].astype(
+            _processing_dtype(self.dtype)))
+
+        return output, (ydata_conv[ndata:].copy(), nskip - iskip)
+
+
+class StreamStaLta(StreamStage):
+    '''
+    Successively compute recursive STA/LTA of broken continuous trace data.
+
+    The output traces contain the ratio of short-term and long-term
+    exponential moving averages of the squared input data.
+
+    :param tshort: time constant of the short-term average in seconds
+    :param tlong: time constant of the long-term average in seconds
+    '''
+
+    def __init__(self, tshort, tlong):
+        StreamStage.__init__(self)
+        self.tshort = tshort
+        self.tlong = tlong
+
+    def _process(self, tr, state):
+        energy = tr.get_ydata().astype(num.float64)**2
+        if state is None:
+            mean = num.mean(energy[:int(round(self.tlong / tr.deltat))+1])
+            state = [mean, mean]
+
+        averages = []
+        for i, t in enumerate((self.tshort, self.tlong)):
+            c = min(1.0, tr.deltat / t)
+            avg, _ = signal.lfilter(
+                [c], [1., c - 1.], energy, zi=[(1. - c) * state[i]])
+
+            averages.append(avg)
+            state[i] = avg[-1]
+
+        output = tr.copy(data=False)
+        with num.errstate(divide='ignore', invalid='ignore'):
+            output.set_ydata(averages[0] / averages[1])
+
+        return output, state
+
+
+class StreamPeaks(object):
+    '''
+    Detect peaks in broken continuous trace data.
+
+    Chunked counterpart of :py:meth:`Trace.peaks`, giving the same peaks as
+    if the data were processed at once. Peaks whose search window or
+    deadtime extends beyond the end of the data available are held back and
+    reported with one of the following chunks. Overlapping chunks, e.g.
+    from :py:meth:`pyrocko.pile.Pile.chopper` with ``tpad``, are handled by
+    ignoring samples which have already been seen. Detection state is kept
+    *per channel*. Use it like this::
+
+        detector = trace.StreamPeaks(threshold=3., tsearch=10.)
+        for traces in p.chopper(tinc=3600.):
+            for tr in traces:
+                tpeaks, apeaks = detector.process(tr)
+                ...
+
+        for nslc_id, (tpeaks, apeaks) in detector.finish().items():
+            ...
+
+    At gaps, pending peaks are reported with the data available, as
+    :py:meth:`Trace.peaks` does at the end of a trace.
+
+    See :py:meth:`Trace.peaks` for the meaning of the parameters.
+    '''
+
+    def __init__(self, threshold, tsearch, deadtime=False,
+                 nblock_duration_detection=100):
+
+        self.threshold = threshold
+        self.tsearch = tsearch
+        self.deadtime = deadtime
+        self.nblock_duration_detection = nblock_duration_detection
+        self._states = {}
+
+    def _detect(self, y, tmin, deltat, tzero, final):
+        return _peaks(
+            y, tmin, deltat, self.threshold, self.tsearch, self.deadtime,
+            self.nblock_duration_detection, tzero, final)
+
+    def _result(self, tpeaks, apeaks, tzeros):
+        if self.deadtime:
+            return tpeaks, apeaks, tzeros
+        else:
+            return tpeaks, apeaks
+
+    def _flush(self, nslc_id):
+        tmin, deltat, ydata, tzero = self._states.pop(nslc_id)
+        return self._detect(ydata, tmin, deltat, tzero, True)[:3]
+
+    def process(self, tr):
+        '''
+        Process a chunk of trace data.
+
+        :param tr: :py:class:`Trace` object
+        :returns: peaks detected so far, in the format of
+            :py:meth:`Trace.peaks`
+        '''
+
+        tpeaks, apeaks, tzeros = [], [], []
+        ydata = tr.get_ydata()
+        tmin = tr.tmin
+        tzero = tr.tmin
+
+        state = self._states.get(tr.nslc_id, None)
+        if state is not None:
+            tmin_buf, deltat, ydata_buf, tzero_buf = state
+            tnext = tmin_buf + ydata_buf.size * deltat
+            nskip = int(round((tnext - tr.tmin) / deltat))
+            if (abs(deltat - tr.deltat) < deltat * 1e-6
+                    and abs(tnext - tr.tmin - nskip * deltat) < deltat * 0.01
+                    and nskip >= 0):
+
+                if nskip >= ydata.size:
+                    return self._result(tpeaks, apeaks, tzeros)
+
+                ydata = num.concatenate((ydata_buf, ydata[nskip:]))
+                tmin = tmin_buf
+                tzero = tzero_buf
+
+            else:
+                tpeaks, apeaks, tzeros = self._flush(tr.nslc_id)
+
+        tpeaks_new, apeaks_new, tzeros_new, ihold, tzero = self._detect(
+            ydata, tmin, tr.deltat, tzero, False)
+
+        tpeaks.extend(tpeaks_new)
+        apeaks.extend(apeaks_new)
+        tzeros.extend(tzeros_new)
+
+        # keep undecided part, plus one sample to detect threshold crossings
+        if ihold is None:
+            ihold = ydata.size
+
+        ikeep = max(0, ihold - 1)
+        self._states[tr.nslc_id] = (
+            tmin + ikeep * tr.deltat, tr.deltat, ydata[ikeep:].copy(), tzero)
+
+        return self._result(tpeaks, apeaks, tzeros)
+
+    def finish(self):
+        '''
+        Get pending peaks of all channels and reset.
+
+        :returns: dict with peaks for each channel, with ``nslc_id`` as key
+            and peaks in the format of :py:meth:`Trace.peaks` as values
+        '''
+
+        result = {}
+        for nslc_id in list(self._states.keys()):
+            result[nslc_id] = self._result(*self._flush(nslc_id))
+
+        return result
+
+
+class StreamPipeline(StreamStage):
+    '''
+    Chain of stages processing broken continuous trace data.
+
+    Use it like this::
+
+        from pyrocko import trace
+
+        pipe = trace.StreamPipeline(
+            trace.StreamLFilter(b, a),
+            trace.StreamDownsample(0.1),
+            trace.StreamRestitution(resp, (0.01, 0.02, 1., 2.), 4096),
+            trace.StreamStaLta(2., 60.))
+
+        for tr in incoming_traces:
+            for tr_out in pipe.process(tr):
+                ...
+
+        pipe.save_state('pipe.state')
+
+    A pipeline created with the same stages continues processing from a
+    saved checkpoint after :py:meth:`load_state`.
+    '''
+
+    def __init__(self, *stages):
+        StreamStage.__init__(self)
+        self.stages = list(stages)
+
+    def process(self, tr):
+        traces = [tr]
+        for stage in self.stages:
+            traces_out = []
+            for tr in traces:
+                traces_out.extend(stage.process(tr))
+
+            traces = traces_out
+
+        return traces
+
+    def reset(self):
+        for stage in self.stages:
+            stage.reset()
+
+    def get_state(self):
+        return [stage.get_state() for stage in self.stages]
+
+    def set_state(self, state):
+        assert len(state) == len(self.stages)
+        for stage, stage_state in zip(self.stages, state):
+            stage.set_state(stage_state)
+
+    def save_state(self, filename):
+        '''
+        Checkpoint state of all stages to file.
+        '''
+
+        tempfn = filename + '.%i.tmp' % os.getpid()
+        with open(tempfn, 'wb') as f:
+            pickle.dump(self.get_state(), f, protocol=2)
+
+        os.rename(tempfn, filename)
+
+    def load_state(self, filename):
+        '''
+        Restore state of all stages from file.
+        '''
+
+        with open(filename, 'rb') as f:
+            self.set_state(pickle.load(f))
+
+
 class DomainChoice(StringChoice):
     choices = [
         'time_domain',
@@ -3415,7 +5265,7 @@ def equalize_sampling_rates(trace_1, trace_2):
         return trace_1, t2_out
 
 
-def Lx_norm(u, v, norm=2):
+def Lx_norm(u, v, norm=2, axis=None):
     '''
     Calculate the misfit denominator *m* and the normalization devisor *n*
     according to norm.
@@ -3425,24 +5275,86 @@ def Lx_norm(u, v, norm=2):
     :param u: :py:class:`numpy.array`
     :param v: :py:class:`numpy.array`
     :param norm: (default = 2)
+    :param axis: axis along which the norms are computed (default: all
+        elements)
 
-    ``u`` and ``v`` must be of same size.
+    ``u`` and ``v`` must be of same size, or broadcastable when ``axis`` is
+    given, e.g. to compute the misfits of the rows of a 2D array ``u``
+    against ``v`` with ``axis=-1``.
     '''
 
     if norm == 1:
         return (
-            num.sum(num.abs(v-u)),
-            num.sum(num.abs(v)))
+            num.sum(num.abs(v-u), axis=axis),
+            num.sum(num.abs(v), axis=axis))
 
     elif norm == 2:
         return (
-            num.sqrt(num.sum((v-u)**2)),
-            num.sqrt(num.sum(v**2)))
+            num.sqrt(num.sum((v-u)**2, axis=axis)),
+            num.sqrt(num.sum(v**2, axis=axis)))
 
     else:
         return (
-            num.power(num.sum(num.abs(num.power(v - u, norm))), 1./norm),
-            num.power(num.sum(num.abs(num.power(v, norm))), 1./norm))
+            num.power(
+                num.sum(num.abs(num.power(v - u, norm)), axis=axis), 1./norm),
+            num.power(
+                num.sum(num.abs(num.power(v, norm)), axis=axis), 1./norm))
+
+
+def misfit_many(observed, candidates, setup, nocache=False):
+    '''
+    Calculate misfits of many candidate traces against an observed trace.
+
+    Gives the same results as calling :py:meth:`Trace.misfit` of
+    ``observed`` for each candidate, but the observed trace is processed
+    only once for each distinct processing window and the norms of all
+    candidates sharing a window are computed at once. Candidates are
+    processed without caching, as they are usually evaluated only once.
+
+    :param observed: :py:class:`Trace` object
+    :param candidates: list of :py:class:`Trace` objects
+    :param setup: :py:class:`MisfitSetup` object
+    :param nocache: whether to bypass the processing cache of ``observed``
+    :returns: tuple ``(ms, ns)`` of arrays with the misfit values and
+        normalization divisors of the candidates
+    '''
+
+    ms = num.zeros(len(candidates))
+    ns = num.zeros(len(candidates))
+
+    windows = {}
+    for icand, b in enumerate(candidates):
+        deltat = max(observed.deltat, b.deltat)
+        tmin = min(observed.tmin, b.tmin) - deltat
+        tmax = max(observed.tmax, b.tmax) + deltat
+        windows.setdefault((tmin, tmax, deltat), []).append(icand)
+
+    for tr in [observed] + list(candidates):
+        if not tr._pchain:
+            tr.init_chain()
+
+    for (tmin, tmax, deltat), icands in windows.items():
+        adata, aproc = observed.run_chain(tmin, tmax, deltat, setup, nocache)
+
+        by_size = {}
+        for icand in icands:
+            bdata, bproc = candidates[icand].run_chain(
+                tmin, tmax, deltat, setup, nocache=True)
+
+            if setup.domain != 'cc_max_norm':
+                by_size.setdefault(bdata.size, []).append((icand, bdata))
+            else:
+                ctr = correlate(
+                    aproc, bproc, mode='full', normalization='normal')
+                ms[icand] = 0.5 - 0.5 * ctr.max()[1]
+                ns[icand] = 0.5
+
+        for size, group in by_size.items():
+            ii = [icand for (icand, _) in group]
+            bdatas = num.vstack([bdata for (_, bdata) in group])
+            ms[ii], ns[ii] = Lx_norm(bdatas, adata, norm=setup.norm, axis=-1)
+
+    return ms, ns
 
 
 def do_downsample(tr, deltat):
@@ -3473,9 +5385,8 @@ def do_fft(tr, filter):
         return tr
     else:
         ndata = tr.ydata.size
-        nfft = nextpow2(ndata)
-        padded = num.zeros(nfft, dtype=num.float)
-        padded[:ndata] = tr.ydata
+        nfft = nextfftlen(ndata)
+        padded = _get_fft_work_buffer(nfft, tr.ydata)
         spectrum = num.fft.rfft(padded)
         df = 1.0 / (tr.deltat * nfft)
         frequencies = num.arange(spectrum.size)*df
@@ -3487,7 +5398,8 @@ def do_filter(inp, filter):
         return inp
     else:
         tr, frequencies, spectrum = inp
-        spectrum *= filter.evaluate(frequencies)
+        # not in place, input may be a cached result of the previous stage
+        spectrum = spectrum * filter.evaluate(frequencies)
         return [tr, frequencies, spectrum]
 
 
@@ -21,6 +21,7 @@ import shlex
 import optparse
 import os.path as op
 import platform
+from collections import OrderedDict
 
 import numpy as num
 from scipy import signal
@@ -623,6 +624,113 @@ def decimate(x, q, n=None, ftype='iir', zi=None, ioff=0):
         return y[n//2+ioff::q].copy()
 
 
+class PolyphaseResampler(object):
+    '''
+    Rational resampler with polyphase FIR anti-aliasing filter.
+
+    Changes the sampling rate by the factor ``up/down``. The Kaiser-windowed
+    sinc lowpass filter is applied with :py:func:`scipy.signal.upfirdn` and
+    its delay is compensated, i.e. output sample ``m`` is located at input
+    sample position ``(m*down + ioffset) / up``.
+
+    The input can be given in consecutive chunks to :py:meth:`process`. As
+    the filter is non-causal, the output lags behind the input by about half
+    of the filter length; the remaining samples up to the position of the
+    last input sample are obtained with :py:meth:`flush`.
+
+    :param up: upsampling factor
+    :param down: downsampling factor
+    :param ioffset: position of the first output sample, in units of the
+        upsampled sampling interval, ``0 <= ioffset < down``
+    :param nhalf: half length of the filter in units of the lower of the two
+        sampling rates
+    :param beta: shape parameter of the Kaiser window
+    '''
+
+    def __init__(self, up, down, ioffset=0, nhalf=10, beta=5.0):
+        g = gcd(up, down, epsilon=0)
+        up, down = int(up // g), int(down // g)
+        self.up = up
+        self.down = down
+        self.ioffset = ioffset
+
+        rate_max = max(up, down)
+        nhalf_up = nhalf * rate_max
+        h = signal.firwin(
+            2*nhalf_up + 1, 1.0/rate_max, window=('kaiser', beta)) * up
+
+        # pad filter in front to make the delay a multiple of down
+        npad = (down - (nhalf_up + ioffset) % down) % down
+        self.h = num.concatenate((num.zeros(npad), h))
+        self.idelay = nhalf_up + npad
+
+        self.n_in = 0
+        self.m_next = 0
+        self._buf = num.zeros(0)
+        self._ibuf = 0
+
+    def _get(self, buf, m_end):
+        up, down = self.up, self.down
+        if m_end <= self.m_next:
+            return num.zeros(0)
+
+        out = signal.upfirdn(self.h, buf, up, down)
+        j0 = (self.ioffset + self.idelay - self._ibuf*up) // down
+        y = out[self.m_next + j0:m_end + j0]
+        self.m_next = m_end
+
+        # keep input needed for the next output sample, starting at a
+        # multiple of down to keep the phase of upfirdn's output
+        i_need = max(0, (
+            self.m_next*down + self.ioffset + self.idelay
+            - (self.h.size - 1)) // up)
+
+        i_keep = (i_need // down) * down
+        if i_keep > self._ibuf:
+            self._buf = self._buf[i_keep - self._ibuf:]
+            self._ibuf = i_keep
+
+        return y
+
+    def process(self, x):
+        '''
+        Feed input samples.
+
+        :param x: 1D array with the next input samples
+        :returns: 1D array with output samples which can be computed from the
+            input given so far
+        '''
+
+        x = num.asarray(x, dtype=num.float)
+        self._buf = num.concatenate((self._buf, x))
+        self.n_in += x.size
+        m_end = (self.n_in*self.up - self.ioffset - self.idelay - 1) \
+            // self.down + 1
+
+        return self._get(self._buf, max(m_end, self.m_next))
+
+    def flush(self):
+        '''
+        Get remaining output samples, assuming zeros after the end of input.
+
+        :returns: 1D array with the output samples up to the position of the
+            last input sample
+        '''
+
+        if self.n_in == 0:
+            return num.zeros(0)
+
+        m_end = ((self.n_in-1)*self.up - self.ioffset) // self.down + 1
+        if m_end <= self.m_next:
+            return num.zeros(0)
+
+        nzeros = -(-((m_end-1)*self.down + self.ioffset + self.idelay + 1)
+                   // self.up) - self.n_in
+
+        buf = num.concatenate((self._buf, num.zeros(max(0, nzeros))))
+        return self._get(buf, m_end)
+
+
 class UnavailableDecimation(Exception):
     '''
     Exception raised by :py:func:`decitab` for unavailable decimation factors.
@@ -1102,6 +1210,78 @@ class Anon(object):
             self.__dict__[k] = dict[k]
 
 
+class LRUCache(object):
+    '''
+    Dict-like cache with a bounded number of entries.
+
+    When more than ``nmax`` entries are stored, the least recently used ones
+    are dropped. Numbers of hits, misses, and evictions are counted.
+
+    :param nmax: maximum number of entries
+
+    Example::
+
+        cache = LRUCache(100)
+        value = cache.get(key)
+        if value is None:
+            value = expensive(key)
+            cache.put(key, value)
+    '''
+
+    def __init__(self, nmax):
+        self.nmax = nmax
+        self._entries = OrderedDict()
+        self.nhits = 0
+        self.nmisses = 0
+        self.nevictions = 0
+
+    def get(self, key, default=None):
+        '''Get entry and mark it as recently used, count hit or miss.'''
+
+        if key in self._entries:
+            self.nhits += 1
+            value = self._entries.pop(key)
+            self._entries[key] = value
+            return value
+
+        self.nmisses += 1
+        return default
+
+    def put(self, key, value):
+        '''Store entry, evict least recently used entries if needed.'''
+
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self.nmax:
+            self._entries.popitem(last=False)
+            self.nevictions += 1
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+
+    def set_nmax(self, nmax):
+        self.nmax = nmax
+        while len(self._entries) > self.nmax:
+            self._entries.popitem(last=False)
+            self.nevictions += 1
+
+    def stats(self):
+        '''Get dict with numbers of entries, hits, misses and evictions.'''
+
+        return dict(
+            nentries=len(self._entries),
+            nmax=self.nmax,
+            nhits=self.nhits,
+            nmisses=self.nmisses,
+            nevictions=self.nevictions)
+
+
 def select_files(paths, selector=None, regex=None, show_progress=True):
     '''
     Recursively select files.
@@ -0,0 +1,58 @@
+from __future__ import division, print_function, absolute_import
+
+import time
+from pyrocko import trace
+import numpy as num
+
+
+def timeit(f, duration=1.0):
+    f()
+    b = time.time()
+    n = 0
+    while (time.time() - b) < duration:
+        f()
+        n += 1
+    return (time.time() - b)/n
+
+
+def fft_roundtrip(ndata, nextlen):
+    ntrans = nextlen(ndata*1.2)
+    data = num.random.normal(size=ndata)
+
+    def f():
+        data_pad = num.zeros(ntrans)
+        data_pad[:ndata] = data
+        num.fft.irfft(num.fft.rfft(data_pad))
+
+    return ntrans, f
+
+
+def transfer(ndata):
+    tr = trace.Trace(
+        tmin=1234567890., deltat=0.01, ydata=num.random.normal(size=ndata))
+
+    resp = trace.PoleZeroResponse(
+        zeros=[0., 0.], poles=[-4.4+4.4j, -4.4-4.4j])
+
+    def f():
+        tr.transfer(
+            tfade=10., freqlimits=(0.5, 1., 20., 40.),
+            transfer_function=resp)
+
+    return f
+
+
+print('%10s %10s %10s %12s %12s %8s %12s' % (
+    'ndata', 'npow2', 'nfast', 't_pow2 [s]', 't_fast [s]', 'speedup',
+    'transfer [s]'))
+
+# one minute, 10 minutes, one hour at 100 Hz, one day at 20 Hz, one hour at
+# 200 Hz, 6 hours at 100 Hz
+for ndata in [6000, 60000, 360000, 1728000, 720000, 2160000]:
+    npow2, fpow2 = fft_roundtrip(ndata, trace.nextpow2)
+    nfast, ffast = fft_roundtrip(ndata, trace.nextfftlen)
+    tpow2 = timeit(fpow2)
+    tfast = timeit(ffast)
+    ttransfer = timeit(transfer(ndata))
+    print('%10i %10i %10i %12.5f %12.5f %8.2f %12.5f' % (
+        ndata, npow2, nfast, tpow2, tfast, tpow2/tfast, ttransfer))
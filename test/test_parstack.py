@@ -369,6 +369,102 @@ class ParstackTestCase(unittest.TestCase):
             num.testing.assert_almost_equal(
                 mat0[:, ioff:ioff+neach], mat)
 
+    def test_recursive_stalta_multi(self):
+        deltat = 0.01
+        nchannels = 5
+        nsamples = 5000
+        args = (0.5, 5., 1.0, 3.0, 1.0)
+
+        data = (num.random.normal(size=(nchannels, nsamples))**2).astype(
+            num.float32)
+        data[:, 3000:3100] *= 100.
+
+        traces = [
+            trace.Trace(
+                station='S%i' % i, deltat=deltat, ydata=data[i].copy())
+            for i in range(nchannels)]
+
+        temps_single = []
+        for tr in traces:
+            temps_single.append(
+                autopick.recursive_stalta(*(args + (tr,))))
+
+        # batch, array input
+        data_multi = data.copy()
+        temp = autopick.recursive_stalta_multi(
+            *args, energy=data_multi, deltat=deltat, nparallel=3)
+
+        for i, tr in enumerate(traces):
+            num.testing.assert_array_equal(data_multi[i], tr.ydata)
+            num.testing.assert_array_equal(temp[i], temps_single[i])
+
+        # batch, trace input, in consecutive chunks
+        nchunk = 1234
+        chunks = []
+        temp = None
+        for i in range(0, nsamples, nchunk):
+            chunk = [
+                trace.Trace(
+                    station='S%i' % j, deltat=deltat,
+                    ydata=data[j, i:i+nchunk].copy())
+                for j in range(nchannels)]
+
+            temp = autopick.recursive_stalta_multi(
+                *args, energy=chunk, temp=temp)
+
+            chunks.append(num.vstack([tr.ydata for tr in chunk]))
+
+        num.testing.assert_allclose(
+            num.hstack(chunks), data_multi, rtol=1e-5)
+
+        # chunks shorter than the short window
+        ns = int(round(args[0] / deltat))
+        nl = int(round(args[1] / deltat))
+        chunks = []
+        temp = temp0 = None
+        i = 0
+        for nchunk in [nl+ns+1] + [1, 5, ns-1, ns, ns+1, 7] * 15:
+            chunk = data[:, i:i+nchunk].copy()
+            temp = autopick.recursive_stalta_multi(
+                *args, energy=chunk, deltat=deltat, temp=temp)
+
+            tr = traces[0].copy(data=False)
+            tr.set_ydata(data[0, i:i+nchunk].copy())
+            temp0 = autopick.recursive_stalta(
+                *(args + (tr,)), temp=temp0)
+
+            num.testing.assert_array_equal(chunk[0], tr.ydata)
+            num.testing.assert_array_equal(temp0, temp[0])
+
+            chunks.append(chunk)
+            i += nchunk
+
+        assert i < nsamples
+        num.testing.assert_allclose(
+            num.hstack(chunks), data_multi[:, :i], rtol=1e-5)
+
+        with self.assertRaises(autopick.AutopickError):
+            autopick.recursive_stalta_multi(
+                *args, energy=data[:, :nl+ns].copy(), deltat=deltat)
+
+        # state array of old format is accepted, starting from scratch
+        tr = traces[0].copy()
+        tr.set_ydata(data[0].copy())
+        temp = autopick.recursive_stalta(
+            *(args + (tr,)), temp=num.zeros(ns+2, dtype=num.float32))
+
+        assert temp.size == ns+3
+        num.testing.assert_array_equal(tr.ydata, traces[0].ydata)
+
+        with self.assertRaises(autopick.AutopickError):
+            autopick.recursive_stalta_multi(
+                *args, energy=data.astype(num.float64), deltat=deltat)
+
+        with self.assertRaises(autopick.AutopickError):
+            autopick.recursive_stalta_multi(
+                *args, energy=[traces[0], traces[1].chop(
+                    traces[1].tmin, traces[1].tmin + 10., inplace=False)])
+
 
 if __name__ == '__main__':
     util.setup_logging('test_parstack', 'warning')
@@ -5,6 +5,7 @@ from pyrocko import trace, pile, io, config, util
 import unittest
 import numpy as num
 import tempfile
+import time
 import random
 import os
 from random import choice as rc
@@ -109,6 +110,635 @@ class PileTestCase(unittest.TestCase):
         pile.get_cache(cachedir).clean()
         shutil.rmtree(datadir)
 
+    def testPileParallelLoad(self):
+        import shutil
+        nfiles = 50
+        nsamples = 100
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaaa', 'bbbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+
+        p1 = pile.Pile()
+        p1.load_files(filenames=filenames, show_progress=False)
+
+        cachedir = pjoin(datadir, '_cache_')
+        p2 = pile.Pile()
+        p2.load_files(filenames=filenames, cache=pile.get_cache(cachedir),
+                      show_progress=False, nworkers=4)
+
+        def keys(p):
+            return sorted(
+                (tr.nslc_id, tr.tmin, tr.tmax) for tr in p.iter_traces())
+
+        assert keys(p1) == keys(p2)
+        assert p1.tmin == p2.tmin and p1.tmax == p2.tmax
+
+        for fn in filenames:
+            tfile = pile.get_cache(cachedir).get(os.path.abspath(fn))
+            assert tfile is not None
+
+        s = 0
+        for traces in p2.chopper(tmax=p2.tmax+1., tinc=1000., degap=False):
+            for tr in traces:
+                s += num.sum(tr.ydata)
+
+        assert int(round(s)) == nfiles*nsamples
+
+        shutil.rmtree(datadir)
+
+    def testDBCache(self):
+        import shutil
+        nfiles = 20
+        nsamples = 100
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaaa', 'bbbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        cachedir = pjoin(datadir, '_cache_')
+
+        p1 = pile.Pile()
+        p1.load_files(
+            filenames=filenames,
+            cache=pile.get_cache(cachedir, backend='sqlite'),
+            show_progress=False)
+
+        # fresh cache object to force reading from the database
+        cache = pile.TracesFileDBCache(cachedir)
+        for fn in filenames:
+            abspath = os.path.abspath(fn)
+            tfile = cache.get(abspath)
+            assert tfile is not None
+            assert tfile.mtime == os.stat(fn)[8]
+            tr1, = [tr for tr in p1.iter_traces()
+                    if tr.file.abspath == abspath]
+            tr2, = tfile.traces
+            assert tr1.nslc_id == tr2.nslc_id
+            assert tr1.tmin == tr2.tmin and tr1.tmax == tr2.tmax
+
+        # headers are loaded in bulk, not with one query per file
+        abspaths = [os.path.abspath(fn) for fn in filenames]
+        tfiles = cache.get_many(abspaths + ['/nonexistent'])
+        assert sorted(tfiles.keys()) == sorted(abspaths)
+        for abspath in abspaths:
+            tr1, = cache.get(abspath).traces
+            tr2, = tfiles[abspath].traces
+            assert tr1.nslc_id == tr2.nslc_id
+            assert tr1.tmin == tr2.tmin and tr1.tmax == tr2.tmax
+
+        statements = []
+        cache._conn.set_trace_callback(statements.append)
+        batch_size = pile.g_db_batch_size
+        pile.g_db_batch_size = 7
+        try:
+            p2 = pile.Pile()
+            p2.load_files(
+                filenames=filenames, cache=cache, show_progress=False)
+        finally:
+            pile.g_db_batch_size = batch_size
+            cache._conn.set_trace_callback(None)
+
+        nbatches = (nfiles + 6) // 7
+        assert len([
+            st for st in statements
+            if st.strip().startswith('SELECT')]) == 2 * nbatches
+
+        assert p1.tmin == p2.tmin and p1.tmax == p2.tmax
+        assert set(p1.nslc_ids) == set(p2.nslc_ids)
+
+        assert len(cache.get_paths()) == nfiles
+        paths = cache.get_paths(tmin+150., tmin+250.)
+        assert len(paths) == 2
+
+        paths = cache.get_paths(codes='xx.aaaa.*.z?z')
+        assert paths == sorted(
+            tr.file.abspath for tr in p1.iter_traces() if tr.station == 'aaaa')
+
+        assert cache.get_paths(codes='xx.[!ab]*.*.*') == []
+        assert cache.get_paths(codes='XX.*.*.*') == cache.get_paths()
+
+        # make_pile selects files through the database, header objects are
+        # only built for the selected files
+        dbcache = pile.get_cache(cachedir, backend='sqlite')
+        pickle_cachedir = tempfile.mkdtemp()
+        requested = []
+        get_many = dbcache.get_many
+
+        def get_many_logged(abspaths):
+            requested.extend(abspaths)
+            return get_many(abspaths)
+
+        dbcache.get_many = get_many_logged
+        try:
+            for kwargs in [
+                    dict(tmin=tmin+150., tmax=tmin+250.),
+                    dict(codes='xx.aaaa.*.*'),
+                    dict(tmin=tmin+150., codes=['*.bbbb.*.*'])]:
+
+                del requested[:]
+                p3 = pile.make_pile(
+                    filenames, cachedirname=cachedir, cache_backend='sqlite',
+                    show_progress=False, **kwargs)
+
+                paths = sorted(f.abspath for f in p3.iter_files())
+                assert paths == cache.get_paths(**kwargs)
+                assert sorted(requested) == paths
+
+                p4 = pile.make_pile(
+                    filenames, cachedirname=pickle_cachedir,
+                    show_progress=False, **kwargs)
+
+                assert sorted(f.abspath for f in p4.iter_files()) == paths
+
+        finally:
+            del dbcache.get_many
+            shutil.rmtree(pickle_cachedir)
+
+        # the cache may be used from other threads
+        import threading
+        results = []
+
+        def use_cache():
+            try:
+                p5 = pile.Pile()
+                p5.load_files(
+                    filenames=filenames, cache=dbcache, show_progress=False)
+                results.append((
+                    len(list(p5.iter_files())),
+                    len(dbcache.get_paths()),
+                    len(dbcache.get_many(dbcache.get_paths()))))
+
+            except Exception as e:
+                results.append(e)
+
+        threads = [threading.Thread(target=use_cache) for i in range(4)]
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        assert results == [(nfiles, nfiles, nfiles)] * 4
+
+        os.remove(filenames[0])
+        cache.clean()
+        assert len(cache.get_paths()) == nfiles - 1
+
+        shutil.rmtree(datadir)
+
+    def testPartialReads(self):
+        import shutil
+        datadir = tempfile.mkdtemp()
+        tmin = 1234567890.
+        deltat = 0.01
+        nsamples = 360000
+        ydata = num.random.randint(
+            -10000, 10000, size=nsamples).astype(num.int32)
+
+        tr = trace.Trace(
+            'XX', 'STA', '', 'HHZ', tmin=tmin, deltat=deltat, ydata=ydata)
+
+        fn = pjoin(datadir, 'data.mseed')
+        io.save([tr], fn)
+
+        traces, record_groups = io.mseed.scan(fn)
+        assert len(traces) == 1
+        assert traces[0].tmin == tr.tmin and traces[0].tmax == tr.tmax
+        assert record_groups.shape[0] > 1
+        assert num.sum(record_groups[:, 1]) == os.path.getsize(fn)
+
+        wtraces = io.mseed.load_window(
+            fn, tmin+1000., tmin+1010., record_groups)
+        assert sum(wtr.data_len() for wtr in wtraces) < nsamples // 10
+
+        p = pile.Pile()
+        p.load_files([fn], show_progress=False)
+
+        windows = [(1000., 1010.), (-5., 5.), (3595., 3700.), (100., 3000.)]
+        chopped = []
+        for wmin, wmax in windows:
+            trs1, used1 = p.chop(
+                tmin+wmin, tmin+wmax, partial_reads=True)
+            assert not used1
+            chopped.append(trs1)
+
+        for (wmin, wmax), trs1 in zip(windows, chopped):
+            trs2, _ = p.chop(tmin+wmin, tmin+wmax)
+            assert len(trs1) == len(trs2) == 1
+            assert trs1[0].tmin == trs2[0].tmin
+            assert num.all(trs1[0].ydata == trs2[0].ydata)
+
+        p = pile.Pile()
+        p.load_files([fn], show_progress=False)
+        n = 0
+        for traces in p.chopper(tinc=600., partial_reads=True):
+            n += sum(tr.data_len() for tr in traces)
+
+        assert n == nsamples - 1
+
+        # partial reads go through the sample cache, per record group
+        cachedir = tempfile.mkdtemp()
+        cache = pile.SampleCache(cachedir, 2**30)
+        load_record_group = io.mseed.load_record_group
+        try:
+            for i in range(2):
+                p = pile.Pile(sample_cache=cache)
+                p.load_files([fn], show_progress=False)
+                for (wmin, wmax), trs1 in zip(windows, chopped):
+                    trs2, used2 = p.chop(
+                        tmin+wmin, tmin+wmax, partial_reads=True)
+                    assert not used2
+                    assert len(trs2) == 1
+                    assert trs1[0].tmin == trs2[0].tmin
+                    assert num.all(trs1[0].ydata == trs2[0].ydata)
+
+                if i == 0:
+                    nentries = len(cache._index)
+                    assert nentries > 1
+                    # second round must be served from the cache
+                    io.mseed.load_record_group = None
+
+        finally:
+            io.mseed.load_record_group = load_record_group
+
+        assert len(cache._index) == nentries
+        assert not next(p.iter_files()).data_loaded
+        shutil.rmtree(cachedir)
+
+        shutil.rmtree(datadir)
+
+    def testDataCache(self):
+        import shutil
+        nfiles = 20
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaaa'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+
+        nbytes_file = nsamples * 8
+        p = pile.Pile(data_cache_nbytes=5*nbytes_file)
+        p.load_files(filenames=filenames, show_progress=False)
+        cache = p.get_data_cache()
+
+        def window_sum():
+            s = 0
+            for traces in p.chopper(
+                    tmin=tmin+1000., tmax=tmin+3000., tinc=500.):
+                for tr in traces:
+                    s += num.sum(tr.ydata)
+
+            return s
+
+        assert window_sum() == 2000
+        assert cache.nmisses == 2
+        assert cache.nhits == 2
+        assert len(cache) == 2
+        assert cache.nbytes == 2*nbytes_file
+
+        assert window_sum() == 2000
+        assert cache.nmisses == 2
+        assert cache.nhits == 6
+
+        assert p.all(tmin=tmin, tmax=tmin+nfiles*nsamples, tinc=1000.)
+        assert cache.nbytes <= 5*nbytes_file
+        assert len(cache) == 5
+        assert cache.nevictions == nfiles - 5
+
+        nloaded = sum(1 for file in p.iter_files() if file.data_loaded)
+        assert nloaded == 5
+
+        p.set_data_cache_nbytes(2*nbytes_file)
+        assert len(cache) == 2
+        nloaded = sum(1 for file in p.iter_files() if file.data_loaded)
+        assert nloaded == 2
+
+        p.set_data_cache_nbytes(None)
+        nloaded = sum(1 for file in p.iter_files() if file.data_loaded)
+        assert nloaded == 0
+
+        shutil.rmtree(datadir)
+
+    def testChopperPrefetch(self):
+        import shutil
+        import threading
+        nfiles = 30
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaaa', 'bbbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+
+        def windows(**kwargs):
+            return [
+                [(tr.nslc_id, tr.tmin, tr.tmax, num.sum(tr.ydata))
+                 for tr in traces]
+                for traces in p.chopper(tinc=700., tpad=50., **kwargs)]
+
+        nthreads = threading.active_count()
+        assert windows() == windows(prefetch=3)
+        assert threading.active_count() == nthreads
+        assert not any(file.data_loaded for file in p.iter_files())
+
+        for traces in p.chopper(tinc=700., prefetch=3):
+            break
+
+        assert threading.active_count() == nthreads
+
+        shutil.rmtree(datadir)
+
+    def testChopperMap(self):
+        import shutil
+        nfiles = 30
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaaa', 'bbbb'], ['zzz'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+
+        def summary(traces):
+            return sorted(
+                (tr.nslc_id, tr.tmin, tr.tmax, num.sum(tr.ydata))
+                for tr in traces)
+
+        expect = [summary(traces) for traces in p.chopper(
+            tinc=700., tpad=50., want_incomplete=False)]
+
+        for nprocs in [1, 3]:
+            results = list(p.chopper_map(
+                summary, tinc=700., tpad=50., want_incomplete=False,
+                nprocs=nprocs))
+
+            assert results == expect
+
+        # files not needed anymore are released by the workers
+        def nloaded(traces):
+            return len([f for f in p.iter_files() if f.data_loaded])
+
+        for nprocs, nwindows_run in [(1, None), (3, None), (2, 100)]:
+            counts = list(p.chopper_map(
+                nloaded, tinc=700., tpad=50., nprocs=nprocs,
+                nwindows_run=nwindows_run))
+
+            assert len(counts) == len(expect)
+            assert max(counts) <= 4
+
+        assert not any(f.data_loaded for f in p.iter_files())
+
+        shutil.rmtree(datadir)
+
+    def testCodesIndex(self):
+        import shutil
+        nfiles = 40
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx', 'yy'], ['aaaa', 'bbbb', 'cccc'],
+            ['zzz', 'nnn'], tmin)
+        filenames = util.select_files([datadir], show_progress=False)
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+
+        def summary(traces):
+            return sorted(
+                (tr.nslc_id, tr.tmin, tr.tmax, num.sum(tr.ydata))
+                for tr in traces)
+
+        for codes in ['xx.aaaa.*.*', ['*.bbbb.*.zzz', 'yy.*.*.nnn'],
+                      'XX.*.*.*', 'ww.*.*.*']:
+
+            def tsel(tr):
+                return util.match_nslc(codes, tr.nslc_id)
+
+            for wmin, wmax in [(-100., 5000.), (12345., 23456.)]:
+                assert summary(p.relevant(
+                    tmin+wmin, tmin+wmax, codes=codes)) == summary(
+                        p.relevant(tmin+wmin, tmin+wmax, trace_selector=tsel))
+
+            assert [summary(traces) for traces in p.chopper(
+                tinc=700., tpad=50., codes=codes)] == [
+                    summary(traces) for traces in p.chopper(
+                        tinc=700., tpad=50., trace_selector=tsel)]
+
+        p.remove_files(list(p.iter_files())[:nfiles//2])
+        assert len(p.relevant(p.tmin, p.tmax, codes='*')) == nfiles - nfiles//2
+        assert sum(len(v) for v in p.by_nslc.values()) == nfiles - nfiles//2
+
+        p.remove_files(list(p.iter_files()))
+        assert not p.by_nslc
+
+        shutil.rmtree(datadir)
+
+    def testCoverage(self):
+        tmin = 1234567890.
+        p = pile.Pile()
+        traces = [
+            trace.Trace('', 'A', '', 'Z', tmin=tmin, deltat=1.0,
+                        ydata=num.zeros(100)),
+            trace.Trace('', 'A', '', 'Z', tmin=tmin+100., deltat=1.0,
+                        ydata=num.zeros(50)),
+            trace.Trace('', 'A', '', 'Z', tmin=tmin+120., deltat=1.0,
+                        ydata=num.zeros(10)),
+            trace.Trace('', 'A', '', 'Z', tmin=tmin+200., deltat=1.0,
+                        ydata=num.zeros(100)),
+            trace.Trace('', 'B', '', 'Z', tmin=tmin+50., deltat=0.5,
+                        ydata=num.zeros(100))]
+
+        p.add_file(pile.MemTracesFile(None, traces))
+
+        cov = p.coverage()
+        assert set(cov.keys()) == set([('', 'A', '', 'Z'), ('', 'B', '', 'Z')])
+        num.testing.assert_equal(
+            cov['', 'A', '', 'Z'] - tmin, [[0., 150.], [200., 300.]])
+        num.testing.assert_equal(
+            cov['', 'B', '', 'Z'] - tmin, [[50., 100.]])
+
+        gaps = p.gaps(tmin+10., tmin+250., codes='*.A.*.*')
+        assert list(gaps.keys()) == [('', 'A', '', 'Z')]
+        num.testing.assert_equal(
+            gaps['', 'A', '', 'Z'] - tmin, [[150., 200.]])
+
+        gaps = p.gaps(tmin+160., tmin+190.)
+        num.testing.assert_equal(
+            gaps['', 'A', '', 'Z'] - tmin, [[160., 190.]])
+        num.testing.assert_equal(
+            gaps['', 'B', '', 'Z'] - tmin, [[160., 190.]])
+
+        assert p.coverage(tmin+160., tmin+190.) == {}
+        assert pile.Pile().gaps() == {}
+
+    def testReloadModifiedIncremental(self):
+        import shutil
+        datadir = tempfile.mkdtemp()
+        tmin = 1234567890.
+        told = time.time() - 24*3600.
+
+        def save(dirname, station):
+            tr = trace.Trace(
+                'XX', station, '', 'Z', tmin=tmin, deltat=1.0,
+                ydata=num.ones(100, dtype=num.int32))
+
+            path = pjoin(datadir, dirname)
+            if not os.path.exists(path):
+                os.mkdir(path)
+
+            fn = pjoin(path, '%s.mseed' % station)
+            io.save([tr], fn)
+            return fn
+
+        fns = [save('a', sta) for sta in ['A1', 'A2', 'A3']]
+        for path in fns + [pjoin(datadir, 'a'), datadir]:
+            os.utime(path, (told, told))
+
+        p = pile.Pile()
+        p.watch([datadir], regex=r'\.mseed$', show_progress=False)
+        assert len(p.abspaths) == 3
+
+        assert not p.reload_modified(incremental=True)
+
+        # deletion is not noticed as long as the directory looks unchanged
+        os.unlink(fns[0])
+        os.utime(pjoin(datadir, 'a'), (told, told))
+        assert not p.reload_modified(incremental=True)
+        assert len(p.abspaths) == 3
+
+        save('b', 'B1')
+        assert p.reload_modified(incremental=True)
+        assert len(p.abspaths) == 4
+        assert set(p.stations.keys()) >= set(['A1', 'A2', 'A3', 'B1'])
+
+        os.utime(pjoin(datadir, 'a'), None)
+        assert p.reload_modified(incremental=True)
+        assert sorted(p.abspaths) == sorted(
+            fns[1:] + [pjoin(datadir, 'b', 'B1.mseed')])
+
+        assert len(p.relevant(tmin, tmin+100., codes='*.A1.*.*')) == 0
+        assert len(p.relevant(tmin, tmin+100., codes='*.B1.*.*')) == 1
+
+        shutil.rmtree(datadir)
+
+    def testSampleCache(self):
+        import shutil
+        nfiles = 10
+        nsamples = 1000
+        tmin = 1234567890
+        datadir = makeManyFiles(
+            nfiles, nsamples, ['xx'], ['aaaa', 'bbbb'], ['zzz'], tmin)
+        cachedir = tempfile.mkdtemp()
+        filenames = util.select_files([datadir], show_progress=False)
+
+        def summary(p):
+            return [
+                [(tr.nslc_id, tr.tmin, tr.tmax, num.sum(tr.ydata))
+                 for tr in traces]
+                for traces in p.chopper(tinc=700., tpad=50.)]
+
+        p = pile.Pile()
+        p.load_files(filenames=filenames, show_progress=False)
+        expect = summary(p)
+
+        cache = pile.SampleCache(cachedir, 2**30)
+        for i in range(2):
+            p = pile.Pile(sample_cache=cache)
+            p.load_files(filenames=filenames, show_progress=False)
+            assert summary(p) == expect
+
+        assert len(os.listdir(cachedir)) == 2 * nfiles
+
+        file = next(p.iter_files())
+        traces = cache.get(file.abspath, file.format)
+        assert isinstance(traces[0].ydata.base, num.memmap)
+        traces[0].ydata[:] = 0
+        assert num.all(cache.get(file.abspath, file.format)[0].ydata == 1)
+
+        nbytes_entry = cache.get_nbytes() // nfiles
+        cache.nbytes_max = 3 * nbytes_entry
+        cache._evict()
+        assert len(os.listdir(cachedir)) == 2 * 3
+        assert cache.get_nbytes() <= cache.nbytes_max
+
+        p = pile.Pile(sample_cache=cache)
+        p.load_files(filenames=filenames, show_progress=False)
+        assert summary(p) == expect
+        assert cache.get_nbytes() <= cache.nbytes_max
+
+        shutil.rmtree(datadir)
+        shutil.rmtree(cachedir)
+
+    def testSampleCacheScan(self):
+        import shutil
+        nfiles = 10
+        datadir = makeManyFiles(
+            nfiles, 1000, ['xx'], ['aaaa', 'bbbb'], ['zzz'], 1234567890)
+        cachedir = tempfile.mkdtemp()
+        filenames = util.select_files([datadir], show_progress=False)
+
+        cache = pile.SampleCache(cachedir, 2**30)
+        nscans = [0]
+        entries = cache._entries
+
+        def counting_entries():
+            nscans[0] += 1
+            return entries()
+
+        cache._entries = counting_entries
+
+        p = pile.Pile(sample_cache=cache)
+        p.load_files(filenames=filenames, show_progress=False)
+        for traces in p.chopper(tinc=700.):
+            pass
+
+        assert nscans[0] == 0
+        assert cache._nbytes == cache.get_nbytes()
+        assert nscans[0] == 1
+
+        # eviction follows the in-memory LRU order
+        file = next(p.iter_files())
+        keep = cache._key(file.abspath, file.format, None, None)
+        oldest = next(iter(cache._index))
+        assert cache.get(file.abspath, file.format) is not None
+        assert next(reversed(cache._index)) == keep
+
+        nbytes_entry = cache._nbytes // nfiles
+        cache.nbytes_max = 3 * nbytes_entry
+        cache._evict()
+        assert keep in cache._index
+        assert oldest not in cache._index or oldest == keep
+        assert len(cache._index) == 3
+        assert len(os.listdir(cachedir)) == 2 * 3
+
+        # a full cache is not rescanned on every put
+        cache.nbytes_max = 10 * nbytes_entry
+        traces = cache.get(file.abspath, file.format)
+        nscans[0] = 0
+        for i in range(60):
+            cache.put(file.abspath, file.format, {'network': 'N%i' % i},
+                      traces)
+            assert cache._nbytes <= cache.nbytes_max
+
+        assert nscans[0] == 0
+        assert len(cache._index) <= 10
+        assert cache.get_nbytes() <= cache.nbytes_max
+
+        nputs = pile.g_sample_cache_rescan_nputs
+        pile.g_sample_cache_rescan_nputs = 20
+        try:
+            nscans[0] = 0
+            for i in range(60):
+                cache.put(file.abspath, file.format, {'station': 'S%i' % i},
+                          traces)
+
+            assert 1 <= nscans[0] <= 3
+        finally:
+            pile.g_sample_cache_rescan_nputs = nputs
+
+        shutil.rmtree(datadir)
+        shutil.rmtree(cachedir)
+
     def testMemTracesFile(self):
         tr = trace.Trace(ydata=num.arange(100, dtype=num.float))
 
@@ -0,0 +1,179 @@
+from __future__ import division, print_function, absolute_import
+from builtins import range
+import unittest
+import tempfile
+import shutil
+import numpy as num
+from os.path import join as pjoin
+
+from pyrocko import util, trace, pile, io, guts
+from pyrocko.ppsd import PPSD, IncompatiblePPSD
+
+
+class PPSDTestCase(unittest.TestCase):
+
+    def make_traces(self, nwindows, twindow, deltat, amp=1000.):
+        n = int(round(twindow/deltat))
+        traces = []
+        for i in range(nwindows):
+            ydata = (num.random.normal(size=n)*amp).astype(num.int32)
+            traces.append(trace.Trace(
+                'XX', 'STA', '', 'BHZ',
+                tmin=i*twindow, deltat=deltat, ydata=ydata))
+
+        return traces
+
+    def test_white_noise(self):
+        deltat = 0.01
+        amp = 1000.
+        traces = self.make_traces(10, 100., deltat, amp)
+        acc = PPSD(
+            twindow=100., fmin=0.1, fmax=10., nfrequencies=20,
+            db_min=0., db_max=80., db_step=0.5)
+
+        for tr in traces:
+            assert acc.add_trace(tr)
+
+        assert acc.nwindows == 10
+        assert num.all(num.sum(acc.get_counts(), axis=1) == 10)
+
+        # one-sided psd of white noise
+        db_expect = 10.*num.log10(2.*deltat*amp**2)
+        assert num.all(num.abs(acc.percentile(50.) - db_expect) < 3.0)
+        high = acc.frequencies > 1.0
+        assert num.all(num.abs(acc.mode()[high] - db_expect) < 1.5)
+        assert num.all(acc.percentile(0.) <= acc.percentile(100.))
+
+        density = acc.get_density()
+        assert num.allclose(num.sum(density, axis=1), 1.0)
+
+        kwargs = dict(
+            twindow=100., fmin=0.1, fmax=10., nfrequencies=20,
+            db_min=0., db_max=80., db_step=0.5)
+
+        acc1 = PPSD(**kwargs)
+        acc1.add_trace(traces[0])
+        acc2 = PPSD(
+            transfer_function=trace.PoleZeroResponse(constant=10.),
+            **kwargs)
+
+        acc2.add_trace(traces[0])
+        assert num.all(num.abs(acc2.mode() - acc1.mode() + 20.) < 0.6)
+
+        # out-of-range powers do not pile up in the edge bins
+        acc_loud = PPSD(**kwargs)
+        loud = traces[0].copy()
+        loud.ydata = loud.ydata * 1000
+        acc_quiet = PPSD(**dict(kwargs, db_min=60., db_max=100.))
+        assert acc_loud.add_trace(loud)
+        assert acc_quiet.add_trace(traces[0])
+        assert num.all(acc_loud.get_counts() == 0)
+        assert num.all(acc_quiet.get_counts() == 0)
+        nbelow, nabove = acc_loud.get_out_of_range_counts()
+        assert num.all(nbelow == 0) and num.all(nabove == 1)
+        nbelow, nabove = acc_quiet.get_out_of_range_counts()
+        assert num.all(nbelow == 1) and num.all(nabove == 0)
+        assert num.all(num.isnan(acc_loud.percentile(50.)))
+
+        acc_loud.add(PPSD(**kwargs))
+        acc_loud.add(PPSD(
+            nabove=num.ones(20, dtype=num.int64), **kwargs))
+        assert num.all(acc_loud.nabove == 2)
+
+        short = traces[0].chop(0., 10., inplace=False)
+        assert not acc.add_trace(short)
+        assert acc.nwindows == 10
+
+    def test_merge_and_persist(self):
+        traces = self.make_traces(6, 100., 0.01)
+        kwargs = dict(
+            twindow=100., fmin=0.1, fmax=10., nfrequencies=20,
+            db_min=0., db_max=80., db_step=0.5)
+
+        acc = PPSD(**kwargs)
+        acc_a = PPSD(**kwargs)
+        acc_b = PPSD(**kwargs)
+        for i, tr in enumerate(traces):
+            acc.add_trace(tr)
+            (acc_a if i < 3 else acc_b).add_trace(tr)
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            fn = pjoin(tempdir, 'test.ppsd')
+            acc_b.dump(filename=fn)
+            acc_b_loaded = guts.load(filename=fn)
+        finally:
+            shutil.rmtree(tempdir)
+
+        assert num.all(acc_b_loaded.counts == acc_b.counts)
+
+        acc_a.add(acc_b_loaded)
+        assert num.all(acc_a.counts == acc.counts)
+        assert acc_a.nwindows == acc.nwindows == 6
+        assert acc_a.tmin == acc.tmin and acc_a.tmax == acc.tmax
+
+        # codes and response must match
+        resp = trace.PoleZeroResponse(
+            zeros=[0., 0.], poles=[-0.037+0.037j, -0.037-0.037j],
+            constant=1e9)
+
+        acc_c = PPSD(codes=('GE', 'A', '', 'BHZ'), **kwargs)
+        acc_d = PPSD(codes=('GE', 'B', '', 'BHZ'), **kwargs)
+        with self.assertRaises(IncompatiblePPSD):
+            acc_c.add(acc_d)
+
+        acc_d = PPSD(
+            codes=('GE', 'A', '', 'BHZ'), transfer_function=resp, **kwargs)
+        with self.assertRaises(IncompatiblePPSD):
+            acc_c.add(acc_d)
+
+        with self.assertRaises(IncompatiblePPSD):
+            acc_d.add(acc_c)
+
+        acc_d.add(guts.load_string(PPSD(
+            codes=('GE', 'A', '', 'BHZ'), transfer_function=resp,
+            **kwargs).dump()))
+
+        with self.assertRaises(IncompatiblePPSD):
+            acc_d.add(PPSD(
+                codes=('GE', 'A', '', 'BHZ'),
+                transfer_function=trace.PoleZeroResponse(constant=1e9),
+                **kwargs))
+
+        kwargs['db_step'] = 1.0
+        with self.assertRaises(IncompatiblePPSD):
+            acc_a.add(PPSD(**kwargs))
+
+    def test_pile(self):
+        traces = self.make_traces(5, 100., 0.01)
+        other = self.make_traces(5, 100., 0.01)
+        for tr in other:
+            tr.set_codes(channel='BHN')
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            io.save(
+                traces + other,
+                pjoin(tempdir, '%(station)s.%(channel)s.%(tmin)s.mseed'))
+
+            p = pile.make_pile([tempdir], show_progress=False)
+            kwargs = dict(
+                twindow=100., fmin=0.1, fmax=10., nfrequencies=20,
+                db_min=0., db_max=80., db_step=0.5)
+
+            acc = PPSD(codes=('XX', 'STA', '', 'BHZ'), **kwargs)
+            assert acc.add_pile(p, tmin=0., tmax=500.) == 5
+
+            acc_ref = PPSD(**kwargs)
+            for tr in traces:
+                acc_ref.add_trace(tr)
+
+            assert num.all(acc.counts == acc_ref.counts)
+
+        finally:
+            shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    util.setup_logging('test_ppsd', 'warning')
+    unittest.main()
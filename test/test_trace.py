@@ -125,6 +125,48 @@ class TraceTestCase(unittest.TestCase):
                 assert x.ydata.size == 18
                 assert numeq(x.ydata[8:10], res, 1e-6)
 
+    def testDegappingMany(self):
+        dt = 0.5
+        n = 10000
+        data = num.random.normal(size=n)
+        tmin = 1000.
+
+        for meth in ('use_first', 'use_second', 'crossfade_cos', 'add'):
+            traces = []
+            i = 0
+            while i < n:
+                nseg = num.random.randint(1, 50)
+                nlap = num.random.randint(0, 5)
+                j = max(i - nlap, 0) if meth != 'add' else i
+                traces.append(trace.Trace(
+                    deltat=dt, tmin=tmin+j*dt, ydata=data[j:i+nseg].copy()))
+                i += nseg
+
+            xs = trace.degapper(traces, deoverlap=meth)
+            assert len(xs) == 1
+            assert xs[0].tmin == tmin
+            assert numeq(xs[0].ydata, data, 1e-6)
+
+        traces = []
+        for i in range(0, n, 100):
+            traces.append(trace.Trace(
+                deltat=dt, tmin=tmin+i*dt, ydata=data[i:i+90].copy()))
+
+        xs = trace.degapper(traces, maxgap=11, fillmethod='zeros')
+        assert len(xs) == 1
+        assert xs[0].ydata.size == n - 10
+        for i in range(0, n-100, 100):
+            assert numeq(xs[0].ydata[i:i+90], data[i:i+90], 1e-6)
+            assert num.all(xs[0].ydata[i+90:i+100] == 0.)
+
+        traces = []
+        for i in range(0, n, 100):
+            traces.append(trace.Trace(
+                deltat=dt, tmin=tmin+i*dt, ydata=data[i:i+90].copy()))
+
+        xs = trace.degapper(traces, maxgap=5)
+        assert len(xs) == n // 100
+
     def testRotation(self):
         s2 = math.sqrt(2.)
         ndata = num.array([s2, s2], dtype=num.float)
@@ -214,6 +256,81 @@ class TraceTestCase(unittest.TestCase):
 
         assert(num.all(u.get_ydata() - num.array([-1., 1.]) < 1.0e-6))
 
+    def testProjectionArray(self):
+        nstations = 20
+        n = 500
+        traces = []
+        for ista in range(nstations):
+            for cha in 'ZNE':
+                if ista == 3 and cha == 'Z':
+                    continue
+
+                traces.append(trace.Trace(
+                    'XX', 'S%02i' % ista, '', cha, deltat=0.1,
+                    tmin=sometime + 0.1 * (ista % 3),
+                    ydata=num.random.normal(size=n)))
+
+        arr = trace.TraceArray.from_traces(traces)
+        assert len(arr.nsl_ids) == nstations
+
+        def by_codes(traces):
+            return dict((tr.nslc_id, tr) for tr in traces)
+
+        def check(arr_out, traces_out):
+            traces_out = by_codes(traces_out)
+            assert set(arr_out.codes) == set(traces_out.keys())
+            for tr in arr_out.to_traces():
+                tr_ref = traces_out[tr.nslc_id]
+                tr_ref.chop(tr.tmin, tr.tmax, include_last=True)
+                assert numeq(tr.ydata, tr_ref.ydata, 1e-9)
+
+        azimuths = num.random.uniform(0., 360., size=nstations)
+        incidences = num.random.uniform(0., 90., size=nstations)
+
+        # rotation, per-station azimuths
+        arr_rt = trace.rotate_to_rt_array(arr, azimuths)
+        assert arr_rt.codes[:2] == [
+            ('XX', 'S00', '', 'R'), ('XX', 'S00', '', 'T')]
+
+        traces_rt = []
+        for nsl, azi in zip(arr.nsl_ids, azimuths):
+            sta_traces = [tr for tr in traces if tr.nslc_id[:3] == nsl]
+            traces_rt.extend(trace.rotate(
+                sta_traces, azi + 180., ['N', 'E'], ['R', 'T']))
+
+        check(arr_rt, traces_rt)
+
+        # full 3x3 system, station without Z is skipped
+        arr_lqt = trace.rotate_to_lqt_array(arr, azimuths, incidences, 'ZNE')
+        assert arr_lqt.nchannels == 3 * (nstations - 1)
+
+        for nsl, azi, inc in zip(arr.nsl_ids, azimuths, incidences):
+            sta_traces = [tr for tr in traces if tr.nslc_id[:3] == nsl]
+            if len(sta_traces) != 3:
+                continue
+
+            for tr in trace.rotate_to_lqt(sta_traces, azi, inc, 'ZNE'):
+                irow = arr_lqt.codes.index(tr.nslc_id)
+                assert numeq(
+                    arr_lqt.data[irow],
+                    tr.chop(arr.tmin, arr.tmax, include_last=True,
+                            inplace=False).ydata,
+                    1e-9)
+
+        # decomposable system, station without Z keeps its horizontals
+        azi = 45.
+        cazi = math.cos(azi*d2r)
+        sazi = math.sin(azi*d2r)
+        rot45 = num.array(
+            [[cazi, sazi, 0], [-sazi, cazi, 0], [0, 0, -1]], dtype=num.float)
+
+        arr_rtu = trace.project_array(arr, rot45, 'NEZ', 'RTU')
+        assert arr_rtu.nchannels == 3 * nstations - 1
+        check(arr_rtu, trace.project(traces, rot45, 'NEZ', 'RTU'))
+
+        with self.assertRaises(ValueError):
+            trace.rotate_array(arr, azimuths[:-1], 'NE', 'RT')
+
     def testExtend(self):
         tmin = sometime
         t = trace.Trace(tmin=tmin, ydata=num.ones(10, dtype=num.float))
@@ -260,6 +377,64 @@ class TraceTestCase(unittest.TestCase):
 
             # trace.snuffle([t, t2])
 
+    def testPolyphaseResampling(self):
+        from scipy import signal
+        deltat = 0.005
+        n = 20000
+        ydata = num.random.normal(size=n)
+        tr = trace.Trace(tmin=sometime, deltat=deltat, ydata=ydata)
+
+        for deltat2, up, down in [(0.0125, 2, 5), (0.004, 5, 4)]:
+            tr2 = tr.copy()
+            tr2.resample_poly(deltat2)
+            assert abs(tr2.deltat - deltat2) < 1e-9
+            assert tr2.tmin == tr.tmin
+            assert abs(tr2.tmax - tr.tmax) < deltat2
+
+            ydata2 = signal.resample_poly(ydata, up, down)[:tr2.data_len()]
+            num.testing.assert_allclose(tr2.ydata, ydata2, atol=1e-12)
+
+            # streaming
+            state = True
+            chunks = []
+            for i in range(0, n, 3333):
+                chunk = tr.chop(
+                    tr.tmin + i*deltat, tr.tmin + (i+3333)*deltat,
+                    inplace=False)
+
+                state = chunk.resample_poly(deltat2, initials=state)
+                if chunks:
+                    assert abs(chunks[-1].tmax + deltat2 - chunk.tmin) \
+                        < deltat2*1e-3
+
+                chunks.append(chunk)
+
+            ystream = num.concatenate([c.ydata for c in chunks])
+            num.testing.assert_allclose(
+                ystream, tr2.ydata[:ystream.size], atol=1e-12)
+
+        # sine well below nyquist survives 100 Hz -> 40 Hz
+        tr = trace.Trace(
+            tmin=sometime, deltat=0.01,
+            ydata=num.sin(2*num.pi*5.0*num.arange(10000)*0.01))
+
+        tr2 = tr.copy()
+        tr2.resample(0.025, method='polyphase')
+        t = tr2.get_xdata()
+        expect = num.sin(2*num.pi*5.0*(t-sometime))
+        assert num.max(num.abs(tr2.ydata - expect)[100:-100]) < 1e-3
+
+        tr3 = tr.copy()
+        with self.assertRaises(util.UnavailableDecimation):
+            tr3.downsample_to(0.025)
+
+        tr3.downsample_to(0.025, allow_polyphase=True)
+        assert num.all(tr3.ydata == tr2.ydata)
+
+        tr4 = tr.copy()
+        tr4.resample_poly(0.025, snap=True)
+        assert abs(tr4.tmin / 0.025 - round(tr4.tmin / 0.025)) < 1e-6
+
     def testFiltering(self):
         tmin = sometime
         # b = time.time()
@@ -278,6 +453,65 @@ class TraceTestCase(unittest.TestCase):
             t.bandpass_fft(0.1, 5.)
         # d2 = time.time() - b
 
+    def testTraceArray(self):
+        deltat = 0.01
+        traces = []
+        for ista in range(5):
+            n = 2000 + ista*10
+            traces.append(trace.Trace(
+                '', 'S%i' % ista, '', 'Z',
+                tmin=sometime + ista*deltat, deltat=deltat,
+                ydata=num.random.normal(size=n)))
+
+        arr = trace.TraceArray.from_traces(traces)
+        assert arr.nchannels == 5
+        assert arr.tmin == traces[-1].tmin
+        assert abs(arr.tmax - min(tr.tmax for tr in traces)) < deltat * 1e-3
+
+        def chopped():
+            return [tr.chop(arr.tmin, arr.tmax, inplace=False,
+                            include_last=True) for tr in traces]
+
+        for tr1, tr2 in zip(arr.to_traces(), chopped()):
+            assert tr1.nslc_id == tr2.nslc_id
+            assert num.all(tr1.ydata == tr2.ydata)
+
+        taper = trace.CosFader(xfrac=0.1)
+        resp = trace.ButterworthResponse(corner=2.0, order=4, type='low')
+        for method, args in [
+                ('lowpass', (4, 5.)),
+                ('highpass', (4, 0.5)),
+                ('bandpass', (4, 0.5, 5.)),
+                ('taper', (taper,)),
+                ('envelope', ()),
+                ('downsample_to', (0.05,)),
+                ('transfer', (1.0, (0.1, 0.2, 10., 20.), resp))]:
+
+            arr1 = arr.copy()
+            result = getattr(arr1, method)(*args)
+            if result is not None:
+                arr1 = result
+
+            for tr1, tr2 in zip(arr1.to_traces(), chopped()):
+                result = getattr(tr2, method)(*args)
+                if result is not None:
+                    tr2 = result
+
+                assert abs(tr1.tmin - tr2.tmin) < deltat * 1e-3
+                assert abs(tr1.deltat - tr2.deltat) < deltat * 1e-3
+                assert tr1.ydata.size == tr2.ydata.size
+                num.testing.assert_allclose(
+                    tr1.ydata, tr2.ydata, rtol=1e-6, atol=1e-12)
+
+        sub = arr[[1, 3]]
+        assert sub.codes == [traces[1].nslc_id, traces[3].nslc_id]
+
+        with self.assertRaises(trace.MisalignedTraces):
+            trace.TraceArray.from_traces([
+                traces[0], trace.Trace(
+                    tmin=sometime + 0.5*deltat, deltat=deltat,
+                    ydata=num.zeros(10))])
+
     def testCropping(self):
         n = 20
         tmin = sometime
@@ -353,6 +587,64 @@ class TraceTestCase(unittest.TestCase):
         assert numeq(tp, [0.1, 50, 51.1, 99.9], 0.0001)
         assert numeq(ap, [1., 1., 1., 1.], 0.0001)
 
+    def testPeaksStream(self):
+        deltat = 0.01
+        n = 20000
+        ydata = num.abs(num.cumsum(num.random.normal(size=n))) * 0.3 \
+            + num.random.uniform(0.1, 0.5, size=n)
+
+        tr = trace.Trace(
+            'XX', 'STA', '', 'Z', tmin=1000., deltat=deltat, ydata=ydata)
+
+        for deadtime in (False, True):
+            with num.errstate(divide='ignore'):
+                ref = tr.peaks(2.0, 1.2345, deadtime=deadtime)
+
+            assert len(ref[0]) > 0
+
+            detector = trace.StreamPeaks(2.0, 1.2345, deadtime=deadtime)
+            result = [[] for x in ref]
+            i = 0
+            while i < n:
+                m = num.random.randint(1, 2000)
+                i0 = max(0, i - num.random.randint(0, 10))  # overlap
+                chunk = trace.Trace(
+                    'XX', 'STA', '', 'Z', tmin=1000. + i0*deltat,
+                    deltat=deltat, ydata=ydata[i0:i+m].copy())
+
+                with num.errstate(divide='ignore'):
+                    for x, xnew in zip(result, detector.process(chunk)):
+                        x.extend(xnew)
+
+                i += m
+
+            pending = detector.finish()
+            assert list(pending.keys()) == [tr.nslc_id]
+            for x, xnew in zip(result, pending[tr.nslc_id]):
+                x.extend(xnew)
+
+            for x, xref in zip(result, ref):
+                assert numeq(x, xref, 1e-6)
+
+    def testEnvelope(self):
+        tr = trace.Trace(deltat=0.01, ydata=num.random.normal(size=50000))
+        tr.bandpass(4, 1., 10.)
+        env = tr.envelope(inplace=False)
+        assert env.ydata.dtype == num.float64
+        assert numeq(env.ydata, num.abs(trace.hilbert(tr.ydata)), 1e-9)
+        assert num.all(env.ydata >= num.abs(tr.ydata) - 1e-9)
+
+        # differences at the ends, where the full length transform wraps
+        interior = slice(1000, -1000)
+        env_blocks = tr.envelope(inplace=False, nblock=4096)
+        assert numeq(
+            env_blocks.ydata[interior], env.ydata[interior],
+            0.01 * env.ydata.max())
+
+        tr.abshilbert(nblock=4096, noverlap=512)
+        assert numeq(
+            tr.ydata[interior], env.ydata[interior], 0.01 * env.ydata.max())
+
     def testCorrelate(self):
         for la, lb, mode, res in [
                 ([0, 1, .5, 0, 0],    [0, 0, 0, 1, 0],    'same', 0.3),
@@ -386,6 +678,54 @@ class TraceTestCase(unittest.TestCase):
         assert numeq(c_ab.ydata, c_ba.ydata[::-1], 0.001)
         assert numeq(c_ab2.ydata, c_ba2.ydata[::-1], 0.001)
 
+    def testCorrelateMany(self):
+        deltat = 0.1
+        traces = []
+        for i, n in enumerate([200, 200, 150, 201, 60]):
+            traces.append(trace.Trace(
+                '', 'S%i' % i, '', 'Z', tmin=sometime + i*1.3, deltat=deltat,
+                ydata=num.random.normal(size=n)))
+
+        for mode in ['full', 'valid', 'same']:
+            for normalization in [None, 'normal', 'gliding']:
+                if normalization == 'gliding' and mode != 'valid':
+                    continue
+
+                for nthreads in [1, 3]:
+                    cs = trace.correlate_many(
+                        traces, mode=mode, normalization=normalization,
+                        nthreads=nthreads)
+
+                    ipair = 0
+                    for ia in range(len(traces)):
+                        for ib in range(ia+1, len(traces)):
+                            c1 = trace.correlate(
+                                traces[ia], traces[ib], mode=mode,
+                                normalization=normalization, use_fft=True)
+                            c2 = cs[ipair]
+                            assert c1.nslc_id == c2.nslc_id
+                            assert abs(c1.tmin - c2.tmin) < deltat*1e-3
+                            num.testing.assert_allclose(
+                                c1.ydata, c2.ydata, rtol=1e-6, atol=1e-9)
+                            ipair += 1
+
+        equal = traces[:2] + [traces[3].copy()]
+        equal[2].set_ydata(equal[2].ydata[:200])
+        pairs = [(0, 1), (0, 2)]
+        tmins, coefs = trace.correlate_many(
+            equal, pairs=pairs, mode='full', normalization='normal',
+            return_array=True)
+
+        assert coefs.shape == (2, 399)
+        for (ia, ib), tmin, coef in zip(pairs, tmins, coefs):
+            c = trace.correlate(
+                equal[ia], equal[ib], mode='full', normalization='normal')
+            assert abs(c.tmin - tmin) < deltat*1e-3
+            num.testing.assert_allclose(c.ydata, coef, rtol=1e-6, atol=1e-9)
+
+        with self.assertRaises(ValueError):
+            trace.correlate_many(traces, return_array=True)
+
     def testNumpyCorrelate(self):
         primes = num.array(
             [1, 2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31], dtype=num.int)
@@ -509,6 +849,222 @@ class TraceTestCase(unittest.TestCase):
                 assert (round(c2s[0].tmin / dt2) * dt2 - c2s[0].tmin) \
                     / dt1 < 0.5001
 
+    def testPSD(self):
+        from scipy import signal
+        deltat = 0.01
+        ydata = num.random.normal(size=12345) + 3.
+        tr = trace.Trace(deltat=deltat, ydata=ydata)
+        for tsegment, overlap in [(10., 0.5), (33.3, 0.75), (50., 0.)]:
+            freqs, values = tr.psd(tsegment, overlap, nchunk=3)
+            nseg = int(round(tsegment/deltat))
+            freqs_ref, values_ref = signal.welch(
+                ydata, fs=1.0/deltat, nperseg=nseg,
+                noverlap=nseg - int(round(nseg*(1.0-overlap))))
+
+            assert numeq(freqs, freqs_ref, 1e-9)
+            assert numeq(values, values_ref, 1e-9)
+
+        resp = trace.PoleZeroResponse(constant=2.0)
+        freqs, values2 = tr.psd(50., 0., transfer_function=resp)
+        assert numeq(values2*4.0, values, 1e-9)
+
+        with self.assertRaises(trace.TraceTooShort):
+            tr.psd(200.)
+
+    def testStreamPipeline(self):
+        import os
+        import shutil
+        import tempfile
+        from scipy import signal
+
+        num.random.seed(0)
+        deltat = 0.01
+        n = 20000
+        ydata = num.random.normal(size=n)
+
+        def chunks(ydata, tmin=0.0, nmin=1):
+            trs = []
+            i = 0
+            while i < ydata.size:
+                m = num.random.randint(nmin, 2000)
+                trs.append(trace.Trace(
+                    tmin=tmin+i*deltat, deltat=deltat,
+                    ydata=ydata[i:i+m].copy()))
+                i += m
+
+            return trs
+
+        def join(trs):
+            for a, b in zip(trs[:-1], trs[1:]):
+                assert abs(a.tmax + a.deltat - b.tmin) < a.deltat * 1e-3
+
+            return num.concatenate([tr.ydata for tr in trs])
+
+        # filter
+        b, a = signal.butter(4, 0.1)
+        stage = trace.StreamLFilter(b, a)
+        out = []
+        for tr in chunks(ydata):
+            out.extend(stage.process(tr))
+
+        assert out[0].tmin == 0.0
+        assert numeq(join(out), signal.lfilter(b, a, ydata), 1e-9)
+
+        # decimation, same as co_downsample_to
+        stage = trace.StreamDownsample(deltat*10)
+        out = []
+        out_co = []
+        pipe = trace.co_downsample_to(trace.co_list_append(out_co), deltat*10)
+        # co_downsample_to fails on chunks shorter than the decimation
+        for tr in chunks(ydata, nmin=100):
+            out.extend(stage.process(tr))
+            pipe.send(tr)
+
+        pipe.close()
+        out_co = [tr for tr in out_co if tr.data_len() > 0]
+        assert out[0].tmin == out_co[0].tmin
+        assert out[0].deltat == deltat*10
+        assert numeq(join(out), join(out_co), 1e-9)
+
+        # restitution, same as overlap-add of whole trace
+        resp = trace.PoleZeroResponse(
+            poles=[-0.037+0.037j, -0.037-0.037j], zeros=[0., 0.],
+            constant=1.0)
+        freqlimits = (0.05, 0.1, 10., 20.)
+        nblock = 2048
+        stage = trace.StreamRestitution(resp, freqlimits, nblock)
+        out = []
+        for tr in chunks(ydata):
+            out.extend(stage.process(tr))
+
+        coefs = trace._get_tapered_coefs(
+            deltat, nblock, freqlimits, resp, invert=True)
+        ydata_ref = trace._overlap_add(ydata, coefs)
+        ydata_out = join(out)
+        assert out[0].tmin == 0.0
+        assert ydata_out.size == n - nblock//2
+        assert numeq(
+            ydata_out, ydata_ref[:ydata_out.size],
+            1e-9 * num.max(num.abs(ydata_ref)))
+
+        # full pipeline, checkpointed and continued, with gap
+        def make_pipe():
+            return trace.StreamPipeline(
+                trace.StreamLFilter(b, a),
+                trace.StreamDownsample(deltat*2),
+                trace.StreamRestitution(resp, freqlimits, 512),
+                trace.StreamStaLta(1., 10.))
+
+        trs = chunks(ydata[:n//2]) + chunks(ydata[n//2:], tmin=1000.)
+        pipe = make_pipe()
+        out_ref = []
+        for tr in trs:
+            out_ref.extend(pipe.process(tr))
+
+        tempdir = tempfile.mkdtemp()
+        try:
+            fn = os.path.join(tempdir, 'pipe.state')
+            pipe = make_pipe()
+            out = []
+            for tr in trs[:len(trs)//3]:
+                out.extend(pipe.process(tr))
+
+            pipe.save_state(fn)
+            pipe = make_pipe()
+            pipe.load_state(fn)
+            for tr in trs[len(trs)//3:]:
+                out.extend(pipe.process(tr))
+
+        finally:
+            shutil.rmtree(tempdir)
+
+        assert len(out) == len(out_ref)
+        for tr, tr_ref in zip(out, out_ref):
+            assert tr.tmin == tr_ref.tmin
+            assert numeq(tr.ydata, tr_ref.ydata, 1e-9)
+
+        # state reset at gap: second segment processed as fresh stream
+        pipe_fresh = make_pipe()
+        out_fresh = []
+        for tr in trs:
+            if tr.tmin >= 1000.:
+                out_fresh.extend(pipe_fresh.process(tr))
+
+        out_after_gap = [tr for tr in out_ref if tr.tmin >= 999.]
+        assert numeq(join(out_after_gap), join(out_fresh), 1e-9)
+
+    def testProcessingDtype(self):
+        num.random.seed(0)
+        n = 100000
+        deltat = 0.01
+        ydata = num.cumsum(num.random.randint(-1000, 1000, size=n)).astype(
+            num.int32)
+
+        tr = trace.Trace(deltat=deltat, ydata=ydata)
+
+        def relerr(a, b):
+            return num.max(num.abs(a.ydata - b.ydata)) \
+                / num.max(num.abs(b.ydata))
+
+        resp = trace.PoleZeroResponse(
+            poles=[-0.037+0.037j, -0.037-0.037j], zeros=[0., 0.],
+            constant=1.0)
+
+        for proc, eps in [
+                (lambda tr, dt: tr.lowpass(4, 1.0, dtype=dt), 1e-5),
+                (lambda tr, dt: tr.highpass(4, 0.1, dtype=dt), 1e-5),
+                (lambda tr, dt: tr.bandpass(4, 1.0, 10.0, dtype=dt), 1e-5),
+                (lambda tr, dt: tr.bandpass_fft(0.01, 1.0, dtype=dt), 1e-5),
+                (lambda tr, dt: tr.taper(
+                    trace.CosFader(xfrac=0.1), dtype=dt), 1e-5)]:
+
+            tr64 = tr.copy()
+            tr32 = tr.copy()
+            proc(tr64, num.float64)
+            proc(tr32, num.float32)
+            assert tr64.ydata.dtype == num.float64
+            assert tr32.ydata.dtype == num.float32
+            assert relerr(tr32, tr64) < eps
+
+        for nblock in (None, 4096):
+            tr64, tr32 = [tr.transfer(
+                100., (0.005, 0.01, 1., 2.), transfer_function=resp,
+                invert=True, nblock=nblock, dtype=dt)
+                for dt in (num.float64, num.float32)]
+
+            assert tr32.ydata.dtype == num.float32
+            assert relerr(tr32, tr64) < 1e-5
+
+        trs = [trace.Trace(
+            tmin=i*1000*deltat, deltat=deltat,
+            ydata=ydata[i*1000:(i+1)*1000]) for i in range(n//1000)]
+
+        results = {}
+        for dt in (num.float64, num.float32):
+            out = []
+            pipe = trace.co_downsample_to(
+                trace.co_list_append(out), deltat*10, dtype=dt)
+            for tr_in in trs:
+                pipe.send(tr_in)
+
+            pipe.close()
+            assert all(tr_out.ydata.dtype == dt for tr_out in out)
+            results[dt] = trace.degapper(out)[0]
+
+        assert relerr(results[num.float32], results[num.float64]) < 1e-6
+
+        trace.set_processing_dtype(num.float32)
+        try:
+            tr32 = tr.copy()
+            tr32.lowpass(4, 1.0)
+            assert tr32.ydata.dtype == num.float32
+        finally:
+            trace.set_processing_dtype(num.float64)
+
+        assert trace.get_processing_dtype() == num.float64
+        with self.assertRaises(ValueError):
+            trace.set_processing_dtype(num.int32)
+
     def testEqualizeSamplingRates(self):
         y = num.random.random(1000)
         t1 = trace.Trace(tmin=0, ydata=y, deltat=0.01)
@@ -552,6 +1108,65 @@ class TraceTestCase(unittest.TestCase):
 
             self.assertEqual(m, 0., 'misfit\'s m of equal traces is != 0')
 
+    def testMisfitMany(self):
+        deltat = 0.01
+        n = 2000
+        observed = trace.Trace(
+            tmin=0., deltat=deltat, ydata=num.random.normal(size=n))
+
+        candidates = []
+        for i in range(10):
+            candidates.append(trace.Trace(
+                tmin=(i % 3) * deltat * 7, deltat=deltat,
+                ydata=num.random.normal(size=n)))
+
+        candidates.append(observed.copy())
+
+        fresponse = trace.ButterworthResponse(
+            corner=5., order=4, type='low')
+        taper = trace.CosFader(xfade=2.)
+        setups = [trace.MisfitSetup(
+            norm=norm,
+            taper=taper,
+            domain=domain,
+            filter=fresponse)
+            for domain in ['time_domain', 'frequency_domain', 'envelope',
+                           'absolute', 'cc_max_norm']
+            for norm in [1, 2, 3]]
+
+        for setup in setups:
+            ms, ns = trace.misfit_many(observed, candidates, setup)
+            for i, cand in enumerate(candidates):
+                m, n = observed.misfit(candidate=cand, setup=setup)
+                num.testing.assert_allclose(ms[i], m, rtol=1e-10)
+                num.testing.assert_allclose(ns[i], n, rtol=1e-10)
+
+            assert ms[-1] < 1e-10
+
+        # bounded processing chain cache
+        observed.init_chain()
+        observed._pchain.set_nmax(2)
+        setup = setups[0]
+        for i in range(5):
+            cand = candidates[0].copy()
+            cand.shift(i*deltat)
+            observed.misfit(candidate=cand, setup=setup)
+
+        stages = observed._pchain.stages
+        stats = [stage.get_stats() for stage in stages]
+        assert all(st['nentries'] <= 2 for st in stats)
+        assert stats[0]['nhits'] == 4
+        assert stats[-1]['nevictions'] == 3
+
+        total = observed._pchain.get_stats()
+        assert total['nhits'] == sum(st['nhits'] for st in stats)
+        assert total['nentries'] <= 2 * len(stages)
+
+        m1, _ = observed.misfit(candidate=candidates[0], setup=setup)
+        m2, _ = observed.misfit(candidate=candidates[0], setup=setup)
+        assert m1 == m2
+        assert stages[-1].get_stats()['nhits'] == 1
+
     def testMisfitOfSameTracesDtDifferentShifted(self):
         test_file = common.test_data_file('1989.072.evt.mseed')
 
@@ -684,6 +1299,76 @@ class TraceTestCase(unittest.TestCase):
         tr2.ydata += tr1.ydata.mean()
         assert numeq(tr1.ydata, tr2.ydata, 0.01)
 
+    def test_transfer_blocks(self):
+        n = 100000
+        deltat = 0.01
+        tr = trace.Trace(
+            ydata=num.random.normal(size=n), deltat=deltat, tmin=0.0)
+
+        resp = trace.PoleZeroResponse(
+            zeros=[0., 0.], poles=[-4.4+4.4j, -4.4-4.4j])
+
+        for invert in [False, True]:
+            kwargs = dict(
+                tfade=5., freqlimits=(0.5, 1., 20., 40.),
+                transfer_function=resp, invert=invert)
+
+            tr1 = tr.transfer(**kwargs)
+            for nblock in [4096, 10000]:
+                tr2 = tr.transfer(nblock=nblock, **kwargs)
+                assert tr1.tmin == tr2.tmin
+                assert tr1.ydata.size == tr2.ydata.size
+                assert num.max(num.abs(tr1.ydata - tr2.ydata)) \
+                    < 1e-4 * num.max(num.abs(tr1.ydata))
+
+            tr3 = tr.transfer(nblock=2*n, **kwargs)
+            assert num.all(tr1.ydata == tr3.ydata)
+
+    def test_transfer_coefs_cache(self):
+        traces = [
+            trace.Trace(ydata=num.random.normal(size=1000), deltat=0.01,
+                        tmin=0.0)
+            for i in range(3)]
+
+        def resp():
+            return trace.PoleZeroResponse(
+                zeros=[0., 0.], poles=[-4.4+4.4j, -4.4-4.4j])
+
+        cache = trace.cached_tapered_coefs
+        cache.clear()
+        nmisses = cache.nmisses
+        results = [
+            tr.transfer(freqlimits=(0.5, 1., 20., 40.),
+                        transfer_function=resp())
+            for tr in traces]
+
+        assert cache.nmisses == nmisses + 1
+        assert len(cache) == 1
+
+        r = resp()
+        r.constant = 2.0
+        result = traces[0].transfer(
+            freqlimits=(0.5, 1., 20., 40.), transfer_function=r)
+
+        assert cache.nmisses == nmisses + 2
+        num.testing.assert_allclose(result.ydata, 2.0 * results[0].ydata)
+
+    def test_nextfftlen(self):
+        def smooth(n):
+            for p in (2, 3, 5):
+                while n % p == 0:
+                    n //= p
+
+            return n == 1
+
+        fast = [n for n in range(2, 5000) if n % 2 == 0 and smooth(n)]
+        for i in range(1, 4000):
+            n = trace.nextfftlen(i)
+            assert n == min(x for x in fast if x >= i)
+
+        assert trace.nextfftlen(360000*1.2) == 432000
+        assert trace.nextfftlen(2**20) == 2**20
+
     def test_muliply_taper(self):
 
         taper = trace.CosTaper(0., 1., 2., 3.)
@@ -699,6 +1384,64 @@ class TraceTestCase(unittest.TestCase):
         assert numeq(y, z, 1e-6)
         assert taper.time_span() == taper2.time_span()
 
+    def test_fft_work_buffer(self):
+        data = num.arange(10.)
+        buf = trace._get_fft_work_buffer(16, data)
+        assert num.all(buf[:10] == data) and num.all(buf[10:] == 0.)
+        assert trace._get_fft_work_buffer(16, data) is buf
+
+        n = trace.g_fft_work_buffer_nbytes_max // 8 + 1
+        big = trace._get_fft_work_buffer(n, data)
+        assert big.size == n
+        assert trace._get_fft_work_buffer(n, data) is not big
+        assert sum(
+            b.nbytes for b in
+            trace._fft_work_buffers.buffers._entries.values()) \
+            <= 8 * trace.g_fft_work_buffer_nbytes_max
+
+    def test_taper_cache(self):
+        taper = trace.CosTaper(0.25, 1., 2., 2.7)
+        y = num.random.normal(size=31)
+
+        nhits = trace.cached_costaper_weights.nhits
+        ys = []
+        for i in range(2):
+            ys.append(y.copy())
+            taper(ys[-1], 0., 0.1)
+
+        assert trace.cached_costaper_weights.nhits == nhits + 1
+        assert num.all(ys[0] == ys[1])
+
+        t = num.arange(31) * 0.1
+        w = num.where(
+            t < 1., 0.5 - 0.5*num.cos((t-0.25)/0.75*num.pi),
+            num.where(t <= 2., 1., 0.5 + 0.5*num.cos((t-2.)/0.7*num.pi)))
+        w[t < 0.25] = 0.
+        w[t >= 2.7] = 0.
+        assert numeq(ys[0], y*w, 1e-9)
+
+        # 2D, along last axis
+        y2 = num.vstack([y, 2.*y])
+        taper(y2, 0., 0.1)
+        assert numeq(y2, [ys[0], 2.*ys[0]], 1e-12)
+
+        assert numeq(
+            trace.costaper(0.25, 1., 2., 2.7, 31, 0.1), w, 1e-9)
+
+        # overlapping fades, fade out takes precedence as in costaper()
+        tr = trace.Trace(deltat=1.0, ydata=num.ones(10))
+        tap = trace.costaper(0., 6., 3., 10., 10, 1.0)
+        assert tap[3] == 1.0
+        _, spec = tr.spectrum(tfade=6.)
+        assert numeq(spec, num.fft.rfft(tap), 1e-12)
+
+        gtaper = trace.GaussTaper(alpha=2.)
+        z = num.ones(20, dtype=num.complex)
+        gtaper(z, 0., 0.5)
+        gtaper(z, 0., 0.5)
+        f = num.arange(20) * 0.5
+        assert numeq(z, num.exp(-num.pi**2 / 4. * f**2)**2, 1e-12)
+
     def test_pickle(self):
         y = num.random.random(10000)
         t1 = trace.Trace(tmin=0, ydata=y, deltat=0.01)
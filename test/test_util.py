@@ -164,6 +164,22 @@ class UtilTestCase(unittest.TestCase):
             util.arange2(0., 1.05, 0.1, error='ceil'),
             num.linspace(0., 1.1, 12))
 
+    def test_lru_cache(self):
+        cache = util.LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)
+        assert 'b' not in cache
+        assert cache.get('b') is None
+        assert cache.get('a') == 1 and cache.get('c') == 3
+        assert len(cache) == 2
+        assert cache.stats() == dict(
+            nentries=2, nmax=2, nhits=3, nmisses=1, nevictions=1)
+
+        cache.set_nmax(1)
+        assert 'a' not in cache and 'c' in cache
+
     def test_gform(self):
         s = ''
         for i in range(-11, 12):